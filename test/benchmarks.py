@@ -0,0 +1,335 @@
+"""
+Benchmarks of text2term mapping stages, using synthetic ontology terms and source terms so they run offline.
+Run all benchmarks with `python benchmarks.py`, or a single one with `python benchmarks.py <benchmark name>`
+"""
+
+import os
+import sys
+import time
+import pickle
+import random
+import string
+import tempfile
+import tracemalloc
+import bioregistry
+import pandas as pd
+from collections import Counter
+from text2term.term import OntologyTerm, OntologyTermTable
+from text2term.term_mapping import TermMapping, TermMappingCollection
+from text2term.mapper import Mapper
+from text2term.syntactic_mapper import SyntacticMapper
+from text2term.tfidf_mapper import TFIDFMapper
+from text2term.lsh_index import MinHashLSHIndex
+from text2term.columnar_terms import ColumnarOntologyTerms
+from text2term.label_index import LabelIndex
+from text2term.term_store import OntologyTermStore
+from text2term.curie_resolver import CurieResolver
+from text2term.tagged_term import TaggedTerm
+from text2term import t2t
+
+_rng = random.Random(42)
+WORDS = ["".join(_rng.choices(string.ascii_lowercase, k=_rng.randint(3, 10))) for _ in range(3000)]
+
+
+def synthetic_ontology_terms(nr_terms, max_synonyms=5, seed=0):
+    rng = random.Random(seed)
+    terms = dict()
+    for i in range(nr_terms):
+        iri = "http://purl.obolibrary.org/obo/SYN_%07d" % i
+        label = " ".join(rng.sample(WORDS, rng.randint(1, 4)))
+        synonyms = {" ".join(rng.sample(WORDS, rng.randint(1, 4))) for _ in range(rng.randint(0, max_synonyms))}
+        terms[iri] = OntologyTerm(iri, {label}, synonyms=synonyms)
+    return terms
+
+
+def synthetic_source_terms(ontology_terms, nr_source_terms, seed=1):
+    rng = random.Random(seed)
+    labels = [term.label for term in ontology_terms.values()]
+    source_terms = []
+    for _ in range(nr_source_terms):
+        words = rng.choice(labels).split()
+        if rng.random() < 0.5:  # perturb half of the source terms
+            words[rng.randrange(len(words))] = rng.choice(WORDS)
+        source_terms.append(" ".join(words))
+    return source_terms, ["ID%i" % i for i in range(nr_source_terms)]
+
+
+def timed(function, *args, **kwargs):
+    start = time.time()
+    result = function(*args, **kwargs)
+    return result, time.time() - start
+
+
+def benchmark_tfidf_result_assembly(nr_terms=50000, nr_source_terms=20000, max_mappings=3):
+    """Compare assembling TF-IDF mappings with NumPy array operations against a per-mapping Python loop"""
+    ontology_terms = synthetic_ontology_terms(nr_terms)
+    source_terms, source_term_ids = synthetic_source_terms(ontology_terms, nr_source_terms)
+    mapper = TFIDFMapper(ontology_terms)
+    source_mtx = mapper.tfidf_index.transform(source_terms)
+    results_mtx = mapper._sparse_dot_top(source_mtx, 0.3, max_mappings)
+    label_terms = [ontology_terms[mapper.term_store.iris[term_id]] for term_id in mapper._label_term_ids]
+    loop_df, loop_time = timed(_get_mappings_loop, results_mtx, max_mappings, source_terms, source_term_ids,
+                               label_terms)
+    df, vectorized_time = timed(mapper._get_mappings, results_mtx, max_mappings, source_terms, source_term_ids)
+    assert loop_df.sort_index(axis=1).equals(df.sort_index(axis=1))
+    print(f"TF-IDF result assembly of {results_mtx.nnz} label matches into {len(df)} mappings: "
+          f"loop {loop_time:.2f}s, vectorized {vectorized_time:.2f}s ({loop_time / vectorized_time:.1f}x)")
+
+
+def benchmark_lsh_recall(nr_terms=200000, nr_source_terms=5000, max_mappings=3, min_score=0.5,
+                         band_settings=((128, 32), (120, 40), (128, 64))):
+    """Compare the recall and mapping time of approximate (MinHash LSH) TF-IDF mapping with exact TF-IDF mapping"""
+    ontology_terms = synthetic_ontology_terms(nr_terms)
+    source_terms, source_term_ids = synthetic_source_terms(ontology_terms, nr_source_terms)
+    mapper = TFIDFMapper(ontology_terms)
+    mapper.map(source_terms, source_term_ids, max_mappings=max_mappings, min_score=min_score)  # resolve CURIEs once
+    exact_df, exact_time = timed(mapper.map, source_terms, source_term_ids, max_mappings=max_mappings,
+                                 min_score=min_score)
+    print(f"Exact TF-IDF mapping of {nr_source_terms} source terms to {nr_terms} terms: {exact_time:.2f}s")
+    for num_perm, bands in band_settings:
+        mapper.lsh_index, build_time = timed(MinHashLSHIndex.build, mapper.tfidf_index.label_counts, num_perm, bands)
+        df, approximate_time = timed(mapper.map, source_terms, source_term_ids, max_mappings=max_mappings,
+                                     min_score=min_score, approximate=True)
+        recall = _score_recall(exact_df, df)
+        print(f"  LSH with {num_perm} permutations in {bands} bands: recall {recall:.3f}, mapping time "
+              f"{approximate_time:.2f}s ({exact_time / approximate_time:.1f}x), index build time {build_time:.2f}s")
+
+
+def benchmark_syntactic_mapping(nr_terms=20000, nr_source_terms=200, max_mappings=3, mapper=Mapper.LEVENSHTEIN):
+    """Compare syntactic mapping via rapidfuzz.process.cdist with comparing each pair of strings in a Python loop"""
+    ontology_terms = synthetic_ontology_terms(nr_terms)
+    source_terms, source_term_ids = synthetic_source_terms(ontology_terms, nr_source_terms)
+    syntactic_mapper = SyntacticMapper(ontology_terms)
+    loop_df, loop_time = timed(_map_syntactic_loop, syntactic_mapper, source_terms, source_term_ids, mapper,
+                               max_mappings)
+    df, vectorized_time = timed(syntactic_mapper.map, source_terms, source_term_ids, mapper, max_mappings)
+    assert loop_df.equals(df)
+    print(f"Syntactic ({mapper.value}) mapping of {nr_source_terms} source terms to {nr_terms} terms: "
+          f"loop {loop_time:.2f}s, vectorized {vectorized_time:.2f}s ({loop_time / vectorized_time:.1f}x)")
+
+
+def benchmark_cache_loading(nr_terms=200000, nr_accessed_terms=1000):
+    """Compare loading cached ontology terms from a pickle with loading them from memory-mapped columnar arrays"""
+    ontology_terms = synthetic_ontology_terms(nr_terms)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        pickle_file = os.path.join(cache_dir, "terms.pickle")
+        with open(pickle_file, 'wb') as out_file:
+            pickle.dump(ontology_terms, out_file)
+        ColumnarOntologyTerms.build(ontology_terms).save(os.path.join(cache_dir, "terms"))
+        with open(pickle_file, 'rb') as in_file:
+            pickled_terms, pickle_time = timed(pickle.load, in_file)
+        columnar_terms, columnar_time = timed(ColumnarOntologyTerms.load, os.path.join(cache_dir, "terms"))
+        accessed_iris = random.Random(2).sample(list(ontology_terms), nr_accessed_terms)
+        _, access_time = timed(lambda: [columnar_terms[iri].labels for iri in accessed_iris])
+        assert all(pickled_terms[iri].labels == columnar_terms[iri].labels for iri in accessed_iris)
+        _, views_time = timed(lambda: [(term.labels, term.synonyms) for term in columnar_terms.values()])
+    print(f"Cache loading of {nr_terms} terms: pickle {pickle_time:.2f}s, columnar {columnar_time:.3f}s, then "
+          f"{access_time:.2f}s to get the labels of {nr_accessed_terms} terms by IRI, or {views_time:.2f}s to get the "
+          f"labels and synonyms of all terms")
+
+
+def benchmark_term_memory(nr_terms=150000):
+    """Compare the memory used by ontology terms with mutable set and dictionary fields, each with its own copies of the
+    IRIs and labels of its neighbours, and by immutable terms whose neighbours are IDs in a shared term table"""
+    rng = random.Random(3)
+    parents = [None] + [rng.randrange(max(0, i - 1000), i) for i in range(1, nr_terms)]
+    children = [[] for _ in range(nr_terms)]
+    for term_id, parent_id in enumerate(parents[1:], start=1):
+        children[parent_id].append(term_id)
+    labels = [" ".join(rng.sample(WORDS, rng.randint(1, 4))) for _ in range(nr_terms)]
+
+    # IRIs and labels are created anew for each term and neighbour, as owlready2 does when collecting terms
+    def neighbours(term_ids):
+        return {"http://purl.obolibrary.org/obo/SYN_%07d" % term_id: "%s" % labels[term_id] for term_id in term_ids}
+
+    def build_terms(term_class, **kwargs):
+        terms = dict()
+        for i in range(nr_terms):
+            iri = "http://purl.obolibrary.org/obo/SYN_%07d" % i
+            terms[iri] = term_class(iri, {"%s" % labels[i]}, synonyms=set(), instances=dict(), restrictions=dict(),
+                                    parents=neighbours(() if parents[i] is None else (parents[i],)),
+                                    children=neighbours(children[i]), **kwargs)
+        return terms
+
+    variants = (("mutable terms", _MutableOntologyTerm, dict),
+                ("immutable terms", OntologyTerm, lambda: {"term_table": OntologyTermTable()}))
+    for name, term_class, get_kwargs in variants:
+        _, build_time = timed(build_terms, term_class, **get_kwargs())
+        tracemalloc.start()
+        terms = build_terms(term_class, **get_kwargs())
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        pickled_terms = pickle.dumps(terms)
+        _, unpickle_time = timed(pickle.loads, pickled_terms)
+        print(f"{name.capitalize()} ({nr_terms}): {memory / 2 ** 20:.1f}MB, built in {build_time:.2f}s, "
+              f"{len(pickled_terms) / 2 ** 20:.1f}MB pickled, unpickled in {unpickle_time:.2f}s")
+        del terms, pickled_terms
+
+
+class _MutableOntologyTerm:
+    # Ontology term with the fields of OntologyTerm before it was immutable: sets, and dictionaries of the neighbours
+
+    def __init__(self, iri, labels, synonyms, parents, children, instances, restrictions):
+        self._iri = iri
+        self._labels = labels
+        self._synonyms = synonyms
+        self._definitions = set()
+        self._parents = parents
+        self._children = children
+        self._instances = instances
+        self._restrictions = restrictions
+        self._deprecated = False
+        self._term_type = "class"
+
+
+def benchmark_term_store(nr_terms=200000):
+    """Compare building the mappers and the label index of ontology terms from their dictionary with building them from
+    a single OntologyTermStore of the terms, which each of them would otherwise build for itself"""
+    ontology_terms = synthetic_ontology_terms(nr_terms)
+    consumers = (("TF-IDF mapper", TFIDFMapper), ("syntactic mapper", SyntacticMapper),
+                 ("label index", LabelIndex.build))
+    term_store, store_time = timed(OntologyTermStore.build, ontology_terms)
+    print(f"Term store of {nr_terms} terms with {len(term_store.names)} labels and synonyms: "
+          f"built in {store_time:.2f}s")
+    for name, build in consumers:
+        _, dict_time = timed(build, ontology_terms)
+        _, shared_time = timed(build, term_store)
+        print(f"  {name}: from the dictionary of terms {dict_time:.2f}s, from the term store {shared_time:.2f}s")
+
+
+def benchmark_curie_resolution(nr_mappings=1000000, nr_terms=50000, namespaces=("HP", "MONDO", "UBERON", "EFO")):
+    """Compare resolving the CURIE column of mappings with bioregistry one IRI at a time against resolving it in one
+    pass with a CurieResolver, which memoizes the CURIE prefix of each IRI namespace"""
+    rng = random.Random(0)
+    iris = ["http://purl.obolibrary.org/obo/%s_%07d" % (namespaces[i % len(namespaces)], i) for i in range(nr_terms)]
+    mapped_iris = rng.choices(iris, k=nr_mappings)
+    bioregistry.curie_from_iri(iris[0])  # loads the registry, which is not part of resolving CURIEs
+    loop_curies, loop_time = timed(lambda: [bioregistry.curie_from_iri(iri).upper() for iri in mapped_iris])
+    curies, resolver_time = timed(CurieResolver().get_curies, mapped_iris)
+    assert loop_curies == curies.tolist()
+    print(f"CURIEs of {nr_mappings} mapped IRIs of {nr_terms} terms: per-IRI loop {loop_time:.2f}s, "
+          f"resolver {resolver_time:.2f}s ({loop_time / resolver_time:.1f}x)")
+
+
+def benchmark_tagging(nr_source_terms=20000, max_mappings=3):
+    """Compare processing the tags of tagged source terms, adding unmapped source terms and adding the tags column to
+    the mappings by scanning the tagged terms or the mappings for each source term, against doing so via dictionaries
+    and a single concatenation of the unmapped terms"""
+    rng = random.Random(0)
+    source_terms = [" ".join(rng.sample(WORDS, 2)) + " %d" % i for i in range(nr_source_terms)]
+    source_term_ids = ["ID%d" % i for i in range(nr_source_terms)]
+    mappings = [TermMapping(term, term_id, "label", "http://purl.obolibrary.org/obo/SYN_%07d" % i, rng.random())
+                for term, term_id in zip(source_terms, source_term_ids) if rng.random() < 0.6
+                for i in range(rng.randint(1, max_mappings))]
+    mappings_df = TermMappingCollection(mappings).mappings_df()
+    term_tags = [["ignore"] if rng.random() < 0.1 else ["tag"] for _ in range(nr_source_terms)]
+    timings = []
+    for process_tags, add_unmapped_terms, add_tags_to_df in ((_process_tags_loop, _add_unmapped_terms_loop,
+                                                              _add_tags_to_df_loop),
+                                                             (t2t._process_tags, t2t._add_unmapped_terms,
+                                                              t2t._add_tags_to_df)):
+        tags = [TaggedTerm(term, tags, source_term_id=term_id)
+                for term, tags, term_id in zip(source_terms, term_tags, source_term_ids)]
+        (to_map, _, tags), process_time = timed(process_tags, source_terms, source_term_ids, tags)
+        df, unmapped_time = timed(add_unmapped_terms, mappings_df.copy(), tags, source_terms, source_term_ids)
+        df, tags_time = timed(add_tags_to_df, df, tags)
+        timings.append((to_map, df, (process_time, unmapped_time, tags_time)))
+    (loop_to_map, loop_df, loop_times), (to_map, df, times) = timings
+    assert loop_to_map == to_map and loop_df.equals(df)
+    print(f"Tags of {nr_source_terms} tagged source terms with {len(mappings_df)} mappings:")
+    for stage, loop_time, vectorized_time in zip(("processing tags", "adding unmapped terms", "adding tags column"),
+                                                 loop_times, times):
+        print(f"  {stage}: loop {loop_time:.2f}s, vectorized {vectorized_time:.2f}s "
+              f"({loop_time / vectorized_time:.1f}x)")
+
+
+def _score_recall(expected_df, df):
+    # Fraction of the expected mapping scores of each source term that are found. Unlike comparing mapped term IRIs,
+    # this does not penalize picking a different term among terms with tied scores
+    expected = Counter(zip(expected_df["Source Term ID"], expected_df["Mapping Score"].round(6)))
+    found = Counter(zip(df["Source Term ID"], df["Mapping Score"].round(6)))
+    return sum((expected & found).values()) / sum(expected.values())
+
+
+def _get_mappings_loop(results_mtx, max_mappings, source_terms, source_term_ids, label_terms):
+    # Reference implementation: one TermMapping per (source term, ontology term) pair
+    coo_mtx = results_mtx.tocoo()
+    mappings = []
+    last_row = -1
+    top_mappings = set()
+    for row, col, score in zip(coo_mtx.row, coo_mtx.col, coo_mtx.data):
+        onto_term = label_terms[col]
+        if row == last_row:
+            if len(top_mappings) == max_mappings:
+                continue
+        else:
+            last_row = row
+            top_mappings.clear()
+        if onto_term.iri not in top_mappings:
+            mappings.append(TermMapping(source_terms[row], source_term_ids[row], onto_term.label, onto_term.iri, score))
+            top_mappings.add(onto_term.iri)
+    return TermMappingCollection(mappings).mappings_df()
+
+
+def _map_syntactic_loop(syntactic_mapper, source_terms, source_term_ids, mapper, max_mappings):
+    # Reference implementation: compare each source term with each label and synonym of each ontology term
+    mappings = []
+    for source_term, source_term_id in zip(source_terms, source_term_ids):
+        term_matches = []
+        for term in syntactic_mapper.target_ontology_terms.values():
+            highest_similarity = 0.0
+            for target_name in list(term.labels) + list(term.synonyms):
+                highest_similarity = max(highest_similarity, syntactic_mapper.compare(source_term, target_name, mapper))
+            term_matches.append(TermMapping(source_term, source_term_id, term.label, term.iri, highest_similarity))
+        mappings.extend(sorted(term_matches, key=lambda x: x.mapping_score, reverse=True)[:max_mappings])
+    return TermMappingCollection(mappings).mappings_df()
+
+
+def _process_tags_loop(source_terms, source_term_ids, tags):
+    # Reference implementation: scan the tagged terms for the tags of each source term
+    to_map, to_map_ids = [], []
+    for term, term_id in zip(source_terms, source_term_ids):
+        for tag in tags:
+            if tag.get_term() == term:
+                if not any(term_tag in t2t.IGNORE_TAGS for term_tag in tag.get_tags()):
+                    to_map.append(term)
+                    to_map_ids.append(term_id)
+                break
+    return to_map, to_map_ids, tags
+
+
+def _add_unmapped_terms_loop(mappings_df, tags, source_terms, source_terms_ids):
+    # Reference implementation: append the mapping of each unmapped source term as a row of the mappings
+    mapped = pd.unique(mappings_df["Source Term"])
+    for term, term_id in zip(source_terms, source_terms_ids):
+        if term not in mapped:
+            mappings_df.loc[len(mappings_df.index)] = TermMapping(term, term_id, "", "", 0).to_dict()
+    return mappings_df
+
+
+def _add_tags_to_df_loop(df, tags):
+    # Reference implementation: scan the mappings for the mappings of each tagged term
+    for term in tags:
+        df.loc[df['Source Term'] == term.get_term(), "Tags"] = ','.join(term.get_tags())
+    return df
+
+
+BENCHMARKS = {
+    "tfidf_result_assembly": benchmark_tfidf_result_assembly,
+    "lsh_recall": benchmark_lsh_recall,
+    "syntactic_mapping": benchmark_syntactic_mapping,
+    "cache_loading": benchmark_cache_loading,
+    "term_memory": benchmark_term_memory,
+    "term_store": benchmark_term_store,
+    "curie_resolution": benchmark_curie_resolution,
+    "tagging": benchmark_tagging,
+}
+
+
+def main(benchmark_names):
+    for name in benchmark_names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
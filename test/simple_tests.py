@@ -1,10 +1,22 @@
 import os
+import pickle
+import shutil
+import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import text2term
 from text2term import OntologyTermType
 from text2term import Mapper
 from text2term import OntologyTermCollector
+from text2term import TaggedTerm
+from text2term import filter_terms
+from text2term import onto_cache
+from text2term import onto_utils
+from text2term.term import MAPPING_FIELDS
+from text2term.onto_cache import OntologyCache, DEFAULT_MEMORY_CACHE_BYTES
+from text2term.columnar_terms import ColumnarOntologyTerms
+from text2term.curie_resolver import CurieResolver
 
 pd.set_option('display.max_columns', None)
 
@@ -53,6 +65,38 @@ class Text2TermTestSuite(unittest.TestCase):
         caches = text2term.cache_ontology_set(ontology_registry_filepath)
         assert len(caches) == nr_ontologies_in_registry
 
+    def test_caching_ontology_set_with_failures(self):
+        registry_filepath = "test-ontology-registry.csv"
+        registry = pd.DataFrame({"acronym": ["EFO_A", "BAD", "EFO_B"], "version": ["3.57.0", "1.0", "3.57.0"],
+                                 "url": [self.EFO_URL, "no-such-ontology.owl", self.EFO_URL]})
+        registry.to_csv(registry_filepath, index=False)
+        for n_jobs in (1, 2):
+            # Test that an ontology that cannot be cached is reported and skipped without stopping the others
+            print(f"Test caching a set of ontologies, one of which cannot be cached, using {n_jobs} jobs...")
+            caches = text2term.cache_ontology_set(registry_filepath, n_jobs=n_jobs)
+            assert list(caches) == ["EFO_A", "EFO_B"]
+            assert all(cache.cache_exists() for cache in caches.values())
+            assert not text2term.cache_exists("BAD")
+            for acronym in caches:
+                text2term.clear_cache(acronym)
+        os.remove(registry_filepath)
+
+    def test_caching_ontology_concurrently(self):
+        # Test that, of two concurrent calls caching the same ontology, the one that waits for the other to cache it
+        # uses the ontology it cached rather than caching it again
+        print("Test caching the same ontology concurrently...")
+        with self.assertLogs("text2term.t2t", level="INFO") as logs, ThreadPoolExecutor(2) as executor:
+            caches = list(executor.map(lambda _: text2term.cache_ontology(self.EFO_URL, "EFO_CONCURRENT"), range(2)))
+        assert all(cache.cache_exists() for cache in caches)
+        assert len([message for message in logs.output if "Caching ontology" in message]) == 1
+        assert len([message for message in logs.output if "while waiting to cache it" in message]) == 1
+        # cache files are written to temporary files that then replace them
+        cache_files = os.listdir(os.path.join("cache", "EFO_CONCURRENT"))
+        assert not any(file_name.endswith(".tmp") for file_name in cache_files)
+        text2term.clear_cache("EFO_CONCURRENT")
+        assert not os.path.exists(os.path.join("cache", "EFO_CONCURRENT"))
+        assert not os.path.exists(os.path.join("cache", ".EFO_CONCURRENT.lock"))
+
     def test_mapping_to_cached_ontology(self):
         self.ensure_cache_exists("EFO", self.EFO_URL)
         # Test mapping a list of terms to EFO loaded from cache
@@ -105,6 +149,33 @@ class Text2TermTestSuite(unittest.TestCase):
         assert df3[self.TAGS_COLUMN].str.contains("disease").any()
         assert df3[self.TAGS_COLUMN].str.contains("measurement").any()
 
+    def test_mapping_repeated_and_tagged_terms(self):
+        self.ensure_cache_exists("EFO", self.EFO_URL)
+        # Test that each occurrence of a repeated source term gets the mappings of the term under its own ID, and that
+        # unmapped source terms are included and tagged as such
+        print("Test mapping a list of terms where some terms are repeated, and include unmapped terms...")
+        df = text2term.map_terms(["asthma", "margarita", "asthma", "margarita"], target_ontology="EFO", use_cache=True,
+                                 source_terms_ids=["a1", "m1", "a2", "m2"], incl_unmapped=True, min_score=0.8)
+        print(f"{df}\n")
+        assert set(df[self.SOURCE_TERM_ID_COLUMN]) == {"a1", "m1", "a2", "m2"}
+        assert (df[df["Source Term"] == "asthma"][self.MAPPING_SCORE_COLUMN] > 0).all()
+        unmapped = df[df["Source Term"] == "margarita"]
+        assert len(unmapped) == 2 and unmapped[self.TAGS_COLUMN].str.contains("unmapped").all()
+        # Test that the tags given in a dictionary or by tagged terms are joined by commas, along with the unmapped tag
+        print("Test mapping tagged terms given in a dictionary and as TaggedTerm objects...")
+        df = text2term.map_terms({"asthma": "disease", "protein level": ["measurement", "trait"], "isdjfnsdfwd": None},
+                                 target_ontology="EFO", use_cache=True, incl_unmapped=True)
+        print(f"{df}\n")
+        assert (df[df["Source Term"] == "asthma"][self.TAGS_COLUMN] == "disease").all()
+        assert (df[df["Source Term"] == "protein level"][self.TAGS_COLUMN] == "measurement,trait").all()
+        assert (df[df["Source Term"] == "isdjfnsdfwd"][self.TAGS_COLUMN] == "unmapped").all()
+        tagged_terms = [TaggedTerm("asthma", tags=["disease", "lung"]), TaggedTerm("isdjfnsdfwd", tags=["x"])]
+        df = text2term.map_terms(tagged_terms, target_ontology="EFO", use_cache=True, incl_unmapped=True)
+        print(f"{df}\n")
+        assert (df[df["Source Term"] == "asthma"][self.TAGS_COLUMN] == "disease,lung").all()
+        assert (df[df["Source Term"] == "isdjfnsdfwd"][self.TAGS_COLUMN] == "x,unmapped").all()
+        assert set(df["Source Term"]) == {"asthma", "isdjfnsdfwd"}
+
     def test_preprocessing_from_file(self):
         self.ensure_cache_exists("EFO", self.EFO_URL)
         # Test processing tagged terms where the tags are provided in a file
@@ -197,6 +268,143 @@ class Text2TermTestSuite(unittest.TestCase):
         terms = efo_term_collector.get_ontology_terms(base_iris=[efo_base_iri], term_type=OntologyTermType.PROPERTY)
         assert len(terms) == expected_nr_properties_with_efo_iri
 
+    def test_term_collector_quadstore(self):
+        quadstore_dir = "test-quadstores"
+        with tempfile.TemporaryDirectory() as download_dir:
+            efo_file = onto_cache._download_ontology(self.EFO_URL, "EFO", download_dir)
+            shutil.copy(efo_file, os.path.join(download_dir, "efo-copy.owl"))
+            efo_file = os.path.join(download_dir, "efo-copy.owl")
+            efo_term_collector = OntologyTermCollector(ontology_iri=efo_file)
+            expected_terms = [str(term) for term in efo_term_collector.get_ontology_terms().values()]
+            efo_term_collector.close()
+            # Test that the ontology is parsed into a quadstore the first time it is loaded, that the quadstore is
+            # reopened rather than parsing the ontology again the second time, and that both give the same terms
+            for expected_message in ("parsing ontology into quadstore", "reopening quadstore of unchanged ontology"):
+                print(f"Test loading an ontology with a quadstore, expecting: {expected_message}...")
+                with self.assertLogs("text2term.term_collector", level="INFO") as logs:
+                    efo_term_collector = OntologyTermCollector(ontology_iri=efo_file, quadstore_dir=quadstore_dir)
+                    terms = [str(term) for term in efo_term_collector.get_ontology_terms().values()]
+                    efo_term_collector.close()
+                assert any(expected_message in message for message in logs.output)
+                assert terms == expected_terms
+            # Test that the ontology is parsed again once its document has changed
+            with open(efo_file, "a") as ontology_document:
+                ontology_document.write("\n")
+            with self.assertLogs("text2term.term_collector", level="INFO") as logs:
+                OntologyTermCollector(ontology_iri=efo_file, quadstore_dir=quadstore_dir).close()
+            assert any("parsing ontology into quadstore" in message for message in logs.output)
+        shutil.rmtree(quadstore_dir)
+
+    def test_pickling_term_with_fields_not_collected(self):
+        efo_term_collector = OntologyTermCollector(ontology_iri=self.EFO_URL)
+        terms = efo_term_collector.get_ontology_terms(term_type=OntologyTermType.CLASS)
+        projected_terms = efo_term_collector.get_ontology_terms(term_type=OntologyTermType.CLASS,
+                                                                fields=MAPPING_FIELDS)
+        iri = next(iri for iri, term in terms.items() if len(term.parents) > 0)
+        # the fields that were not collected are loaded before pickling, as the unpickled term cannot load them
+        unpickled_term = pickle.loads(pickle.dumps(projected_terms[iri]))
+        efo_term_collector.close()
+        assert unpickled_term.labels == terms[iri].labels
+        assert unpickled_term.parents == terms[iri].parents
+        assert unpickled_term.children == terms[iri].children
+
+    def test_term_collector_bulk_annotations(self):
+        efo_term_collector = OntologyTermCollector(ontology_iri=self.EFO_URL)
+        terms = efo_term_collector.get_ontology_terms(term_type=OntologyTermType.ANY)
+        # get the annotations of some of the terms via owlready2 rather than from the values collected in bulk
+        efo_term_collector._bulk_annotation_storids = dict()
+        efo_term_collector._annotation_values = dict()
+        for iri in list(terms)[:1000]:
+            ontology_term = efo_term_collector.ontology.world[iri]
+            term_fields = efo_term_collector._get_term_fields(ontology_term, efo_term_collector.ontology,
+                                                              ("labels", "synonyms", "definitions", "parents"))
+            assert terms[iri].labels == set(term_fields["labels"])
+            assert terms[iri].synonyms == set(term_fields["synonyms"])
+            assert terms[iri].definitions == set(term_fields["definitions"])
+            assert terms[iri].parents == term_fields["parents"]
+            assert terms[iri].deprecated == (efo_term_collector._get_deprecated(ontology_term) == [True])
+        efo_term_collector.close()
+
+    def test_term_collector_children_and_instances(self):
+        efo_term_collector = OntologyTermCollector(ontology_iri=self.EFO_URL)
+        # the children and instances of terms collected without them are queried for each term when first used, while
+        # those of terms collected with them are found by inverting the parent and type relations of all terms
+        queried_terms = efo_term_collector.get_ontology_terms(term_type=OntologyTermType.ANY, fields=MAPPING_FIELDS)
+        iris = list(queried_terms)[:1000]
+        queried_relations = {iri: (queried_terms[iri].children, queried_terms[iri].instances) for iri in iris}
+        terms = efo_term_collector.get_ontology_terms(term_type=OntologyTermType.ANY)
+        efo_term_collector.close()
+        assert any(len(children) > 0 for children, _ in queried_relations.values())
+        for iri in iris:
+            assert (terms[iri].children, terms[iri].instances) == queried_relations[iri]
+
+    def test_term_store(self):
+        efo_term_collector = OntologyTermCollector(ontology_iri=self.EFO_URL)
+        terms = efo_term_collector.get_ontology_terms(term_type=OntologyTermType.CLASS)
+        term_store = efo_term_collector.get_term_store(term_type=OntologyTermType.CLASS)
+        assert term_store.iris == list(terms)
+        iri = next(iri for iri, term in terms.items() if len(term.parents) > 0)
+        term_id = term_store.get_term_id(iri)
+        names = term_store.names[term_store.name_offsets[term_id]:term_store.name_offsets[term_id + 1]]
+        assert set(names) == terms[iri].labels | terms[iri].synonyms
+        offsets, node_ids = term_store.neighbours["parents"]
+        parents = {term_store.node_iris[node_id] for node_id in node_ids[offsets[term_id]:offsets[term_id + 1]]}
+        assert parents == set(terms[iri].parents)
+
+    def test_mapping_in_batches(self):
+        self.ensure_cache_exists("EFO", self.EFO_URL)
+        efo_cache = OntologyCache("EFO")
+        source_terms = ["asthma", "disease location", "food allergy", "lung cancer", "heart", "margarita", "asthma"]
+        source_terms_ids = [f"t{i}" for i in range(len(source_terms))]
+        for mapper in (Mapper.TFIDF, Mapper.LSH):
+            df = efo_cache.map_terms(source_terms, source_terms_ids=source_terms_ids, mapper=mapper)
+            assert df.size > 0
+            # Test that mapping in batches and/or using multiple threads gives the same mappings in the same order
+            for batch_size, n_jobs in ((2, 1), (0, 2), (2, 2)):
+                print(f"Test mapping using the {mapper.value} mapper with batch_size={batch_size}, n_jobs={n_jobs}...")
+                df_batches = efo_cache.map_terms(source_terms, source_terms_ids=source_terms_ids, mapper=mapper,
+                                                 batch_size=batch_size, n_jobs=n_jobs)
+                pd.testing.assert_frame_equal(df_batches, df)
+
+    def test_filtering_cached_terms(self):
+        self.ensure_cache_exists("EFO", self.EFO_URL)
+        cached_terms = ColumnarOntologyTerms.load(os.path.join("cache", "EFO", "EFO-terms"))
+        terms = dict(cached_terms.items())
+        # cached terms are filtered via their sorted IRIs and arrays of their types and deprecation, which should give
+        # the same terms as filtering a dictionary of the terms
+        base_iris = ((), "http://www.ebi.ac.uk/efo/",
+                     ("http://purl.obolibrary.org/obo/MONDO_", "http://www.ebi.ac.uk/"))
+        for iris in base_iris:
+            for excl_deprecated in (False, True):
+                for term_type in (OntologyTermType.CLASS, OntologyTermType.PROPERTY, OntologyTermType.ANY):
+                    filtered_terms = filter_terms(cached_terms, iris, excl_deprecated, term_type)
+                    assert list(filtered_terms) == list(filter_terms(terms, iris, excl_deprecated, term_type))
+        assert 0 < len(filter_terms(cached_terms, "http://www.ebi.ac.uk/efo/", True, OntologyTermType.CLASS)) < \
+               len(cached_terms)
+
+    def test_curie_resolver(self):
+        iris = ["http://purl.obolibrary.org/obo/MONDO_0004979", "http://purl.obolibrary.org/obo/HP_0002099",
+                "http://purl.obolibrary.org/obo/MONDO_0005148", "http://www.ebi.ac.uk/efo/EFO_0000270",
+                "http://www.ebi.ac.uk/efo/EFO_0000270", "http://www.orpha.net/ORDO/Orphanet_1234",
+                "https://omim.org/MIM:600807", "https://omim.org/MIM:PS600807", "https://omim.org/MIM:PS208550",
+                "http://www.geneontology.org/formats/oboInOwl#hasExactSynonym", "http://example.org/onto#thing"]
+        expected_curies = []
+        for iri in iris:
+            try:
+                expected_curies.append(onto_utils.curie_from_iri(iri))
+            except TypeError:  # the resolver gives an empty CURIE for IRIs that bioregistry cannot compress
+                expected_curies.append("")
+        # Test that resolving CURIEs once per IRI namespace (or IRI, in namespaces such as that of OMIM, which has URI
+        # prefixes that extend it) gives the same CURIEs as resolving each IRI
+        print("Test resolving the CURIEs of IRIs...")
+        curie_resolver = CurieResolver()
+        assert list(curie_resolver.get_curies(iris + [None])) == expected_curies + [""]
+        with tempfile.TemporaryDirectory() as resolver_dir:
+            curie_resolver.save(os.path.join(resolver_dir, "curie-namespaces.json"))
+            loaded_resolver = CurieResolver.load(os.path.join(resolver_dir, "curie-namespaces.json"))
+        assert loaded_resolver.namespaces == curie_resolver.namespaces
+        assert [loaded_resolver.get_curie(iri) for iri in iris] == expected_curies
+
     def test_mapping_with_min_score_filter(self):
         self.ensure_cache_exists("EFO", self.EFO_URL)
         min_score = 0.6
@@ -236,6 +444,74 @@ class Text2TermTestSuite(unittest.TestCase):
                                  incl_unmapped=True, min_score=0.8)
         assert df[self.TAGS_COLUMN].str.contains("unmapped").any()
 
+    def test_mapping_exact_matches(self):
+        self.ensure_cache_exists("EFO", self.EFO_URL)
+        print("Test mapping to cached EFO with exact matches of labels or synonyms mapped ahead of the mapper...")
+        df = text2term.map_terms(["Asthma", "asthma attack"], target_ontology="EFO", use_cache=True,
+                                 mapper=Mapper.TFIDF, exact_match=True)
+        print(f"{df}\n")
+        exact_mappings = df[df["Source Term"] == "Asthma"]
+        assert exact_mappings.size > 0
+        assert (exact_mappings[self.MAPPING_SCORE_COLUMN] == 1).all()
+        assert (df["Source Term"] == "asthma attack").any()
+
+    def test_mapping_duplicate_source_terms(self):
+        self.ensure_cache_exists("EFO", self.EFO_URL)
+        print("Test that each distinct source term is mapped once and its mappings given to all its source term IDs...")
+        source_terms = ["asthma", "lung cancer", "Asthma!", "asthma"]
+        df = text2term.map_terms(source_terms, target_ontology="EFO", use_cache=True, mapper=Mapper.TFIDF,
+                                 source_terms_ids=["a1", "lc", "a2", "a3"])
+        print(f"{df}\n")
+        # the TF-IDF mapper maps source terms that are the same when normalized to the same ontology terms
+        mappings_a1 = df[df[self.SOURCE_TERM_ID_COLUMN] == "a1"].drop(columns=["Source Term", "Source Term ID"])
+        assert mappings_a1.size > 0
+        for source_term_id in ("a2", "a3"):
+            mappings = df[df[self.SOURCE_TERM_ID_COLUMN] == source_term_id]
+            assert self.check_df_equals(mappings.drop(columns=["Source Term", "Source Term ID"]).reset_index(drop=True),
+                                        mappings_a1.reset_index(drop=True))
+        assert (df[df[self.SOURCE_TERM_ID_COLUMN] == "a2"]["Source Term"] == "Asthma!").all()
+        single_df = text2term.map_terms(["lung cancer"], target_ontology="EFO", use_cache=True, mapper=Mapper.TFIDF,
+                                        source_terms_ids=["lc"])
+        assert self.check_df_equals(df[df[self.SOURCE_TERM_ID_COLUMN] == "lc"].reset_index(drop=True), single_df)
+
+    def test_memory_cache(self):
+        self.ensure_cache_exists("EFO", self.EFO_URL)
+        print("Test keeping ontologies loaded from the cache in memory across mapping calls...")
+        text2term.clear_memory_cache()
+        initial_stats = text2term.memory_cache_stats()
+        text2term.map_terms(["asthma"], target_ontology="EFO", use_cache=True)
+        text2term.map_terms(["food allergy"], target_ontology="EFO", use_cache=True)
+        stats = text2term.memory_cache_stats()
+        print(f"{stats}\n")
+        assert stats["misses"] == initial_stats["misses"] + 1
+        assert stats["hits"] == initial_stats["hits"] + 1
+        assert stats["entries"] == 1 and stats["bytes"] > 0
+        # loading EFO classes and properties as well as EFO classes only keeps both loaded
+        text2term.map_terms(["asthma"], target_ontology="EFO", use_cache=True, term_type=OntologyTermType.ANY)
+        assert text2term.memory_cache_stats()["entries"] == 2
+        try:
+            # bounding the memory cache below the size of its entries evicts the least recently used ones
+            text2term.set_memory_cache_size(text2term.memory_cache_stats()["bytes"] - 1)
+            stats = text2term.memory_cache_stats()
+            assert stats["entries"] == 1 and stats["evictions"] == initial_stats["evictions"] + 1
+            text2term.map_terms(["asthma"], target_ontology="EFO", use_cache=True, term_type=OntologyTermType.ANY)
+            assert text2term.memory_cache_stats()["hits"] == stats["hits"] + 1
+            text2term.map_terms(["asthma"], target_ontology="EFO", use_cache=True)
+            assert text2term.memory_cache_stats()["misses"] == stats["misses"] + 1
+        finally:
+            text2term.set_memory_cache_size(DEFAULT_MEMORY_CACHE_BYTES)
+
+    def test_cache_manifest(self):
+        self.ensure_cache_exists("EFO", self.EFO_URL)
+        print("Test listing the cached ontologies recorded in the cache manifest...")
+        cached_ontologies = text2term.list_cache()
+        print(f"{cached_ontologies}\n")
+        efo_entry = cached_ontologies[cached_ontologies["acronym"] == "EFO"].iloc[0]
+        assert efo_entry["source"] == self.EFO_URL
+        assert efo_entry["size"] > 0
+        assert not efo_entry["stale"]
+        assert "EFO" not in text2term.gc_cache(max_bytes=efo_entry["size"] * 100)
+
     def drop_source_term_ids(self, df):
         # Unless specified, source term IDs are randomly generated UUIDs. We have to drop the ID column to be able to
         # get a meaningful diff between two dataframes. Otherwise, the dataframes would always differ because of the IDs
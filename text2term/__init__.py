@@ -3,6 +3,13 @@ from .t2t import cache_ontology
 from .onto_cache import cache_ontology_set
 from .onto_cache import cache_exists
 from .onto_cache import clear_cache
+from .onto_cache import list_cache
+from .onto_cache import gc_cache
+from .onto_cache import refresh_cache
+from .onto_cache import set_cache_size
+from .onto_cache import memory_cache_stats
+from .onto_cache import set_memory_cache_size
+from .onto_cache import clear_memory_cache
 from .mapper import Mapper
 from .preprocess import preprocess_terms
 from .preprocess import preprocess_tagged_terms
@@ -11,3 +18,4 @@ from .term_collector import OntologyTermCollector
 from .term_collector import filter_terms
 from .term import OntologyTermType
 from .term import OntologyTerm
+from .term_store import OntologyTermStore
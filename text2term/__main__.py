@@ -2,10 +2,38 @@ import argparse
 import os
 import sys
 from t2t import map_terms, cache_ontology
-from onto_cache import cache_exists
+from onto_cache import cache_exists, list_cache, gc_cache, refresh_cache
 from mapper import Mapper
 
+
+# Runs the 'cache' command, e.g., `python text2term cache ls`, to list, garbage-collect or refresh the ontology cache
+def run_cache_command(args):
+    parser = argparse.ArgumentParser(prog="text2term cache", description='Manage the cache of ontologies')
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("ls", help="List the cached ontologies with their source, version, size and access times")
+    gc_parser = commands.add_parser("gc", help="Evict the least recently used ontologies while the cache exceeds the "
+                                               "bound on its size")
+    gc_parser.add_argument("--max_bytes", required=False, type=int, default=None,
+                           help="Bound on the size of the cache in bytes (default=bound set via set_cache_size)")
+    refresh_parser = commands.add_parser("refresh", help="Cache again the ontologies whose source document has "
+                                                         "changed or whose cache files are missing")
+    refresh_parser.add_argument("acronym", nargs="?", default="",
+                                help="Acronym of the ontology to check (default=all cached ontologies)")
+    arguments = parser.parse_args(args)
+    if arguments.command == "ls":
+        print(list_cache().to_string(index=False))
+    elif arguments.command == "gc":
+        evicted = gc_cache(arguments.max_bytes)
+        print("Evicted: " + ", ".join(evicted) if len(evicted) > 0 else "Nothing evicted")
+    else:
+        refreshed = refresh_cache(arguments.acronym)
+        print("Cached again: " + ", ".join(refreshed) if len(refreshed) > 0 else "Nothing cached again")
+
+
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["cache"]:
+        run_cache_command(sys.argv[2:])
+        sys.exit(0)
     parser = argparse.ArgumentParser(description='A tool for mapping free-text descriptions of (biomedical) '
                                                  'entities to ontology terms')
     parser.add_argument("-s", "--source", required=True, type=str,
@@ -44,6 +72,23 @@ if __name__ == "__main__":
                         help="Include all unmapped terms in the output")
     parser.add_argument('-bp', "--bioportal_apikey", required=False, type=str, default="",
                         help="BioPortal API Key to use along with the BioPortal mapper option")
+    parser.add_argument("-bs", "--batch_size", required=False, type=int, default=0,
+                        help="Number of source terms mapped at a time by the tfidf and lsh mappers, to bound memory "
+                             "use when mapping large numbers of source terms (default=0, i.e., all source terms at "
+                             "once)")
+    parser.add_argument('-j', "--jobs", required=False, type=int, default=1,
+                        help="Number of threads used by the mapper (-1 uses all CPUs; default=1)")
+    parser.add_argument('-e', "--exact_match", required=False, default=False, action="store_true",
+                        help="Map source terms that exactly match an ontology term label or synonym (after "
+                             "normalization) with a score of 1, and use the mapper only for the remaining terms "
+                             "(default=False)")
+    parser.add_argument("-perm", "--num_perm", required=False, type=int, default=120,
+                        help="Number of hash functions in the MinHash signatures of ontology labels used by the lsh "
+                             "mapper (default=120)")
+    parser.add_argument("-bands", "--bands", required=False, type=int, default=40,
+                        help="Number of bands the MinHash signatures are split into by the lsh mapper, which must "
+                             "divide the number of hash functions. More bands miss fewer mappings, at the cost of "
+                             "speed (default=40)")
 
     arguments = parser.parse_args()
     if not os.path.exists(arguments.source):
@@ -66,4 +111,5 @@ if __name__ == "__main__":
               min_score=arguments.min_score, base_iris=iris, save_graphs=arguments.save_term_graphs,
               save_mappings=True, separator=arguments.separator, use_cache=cache_exists(target),
               term_type=arguments.term_type, incl_unmapped=arguments.incl_unmapped,
-              bioportal_apikey=arguments.bioportal_apikey)
+              bioportal_apikey=arguments.bioportal_apikey, batch_size=arguments.batch_size, n_jobs=arguments.jobs,
+              exact_match=arguments.exact_match, num_perm=arguments.num_perm, bands=arguments.bands)
@@ -0,0 +1,331 @@
+"""Provides ColumnarOntologyTerms class"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import numpy as np
+from owlready2 import locstr
+from functools import partial
+from collections.abc import Mapping, ItemsView, ValuesView
+from text2term import onto_utils
+from text2term.term import OntologyTerm, OntologyTermType, SET_FIELDS, NEIGHBOUR_FIELDS
+from text2term.term_store import OntologyTermStore
+
+# Version of the layout of the files of columnar ontology terms
+COLUMNAR_FORMAT_VERSION = 1
+
+# Types of ontology terms, stored as their index in this tuple
+TERM_TYPES = (OntologyTermType.CLASS, OntologyTermType.PROPERTY, "undetermined")
+
+# Fields with a dictionary of strings (e.g., IRIs) to strings per term
+DICT_FIELDS = ("parents", "restrictions", "children", "instances")
+
+# Fields of the OntologyTerm objects created for columnar terms, which are loaded when first used
+UNLOADED_FIELDS = dict.fromkeys(("labels",) + SET_FIELDS[1:] + DICT_FIELDS)
+
+
+class ColumnarOntologyTerms(Mapping):
+
+    def __init__(self, columns, term_indexes=None):
+        """
+        Read-only dictionary of ontology term IRIs to OntologyTerm objects whose details are stored in flat arrays that
+        can be memory-mapped from files so that they are loaded in near-constant time. All strings (IRIs, labels, etc.)
+        are stored once in a table of UTF-8 bytes and their offsets, along with the language of language-tagged strings
+        (owlready2 locstr). The first strings are the IRIs of the terms in order, so parents, children and instances
+        that are terms themselves are referenced by term index. Each field of the terms is stored as an array of string
+        indexes, or of pairs of string indexes for dictionaries, and the offsets of each term's values in that array.
+        The term indexes sorted by IRI, the deprecation of the terms and their types are stored to filter the terms
+        without going through all of them. OntologyTerm objects are created when a term is first accessed, and each of
+        their fields is read from the arrays when first used.
+        :param columns: Dictionary of column names to arrays
+        :param term_indexes: Sorted array of the indexes of the terms in this dictionary, or None for all terms
+        """
+        # memory-mapped arrays are viewed as plain arrays, which are faster to slice
+        self._columns = {name: column.view(np.ndarray) for name, column in columns.items()}
+        self._strings = memoryview(self._columns["strings"])
+        self._string_offsets = None
+        self._string_languages = None
+        self._field_offsets = dict()
+        self._term_indexes = term_indexes
+        self._term_index_list = None
+        self._nr_terms = len(columns["deprecated"]) if term_indexes is None else len(term_indexes)
+        self._iri_indexes = None
+        self._terms = dict()
+
+    @classmethod
+    def build(cls, ontology_terms):
+        """
+        Build the columnar representation of the given ontology terms. Values of the terms that are not strings (e.g.,
+        class expressions in restrictions) are stored as their string representation
+        :param ontology_terms: Dictionary of ontology term IRIs to OntologyTerm objects
+        :return: ColumnarOntologyTerms
+        """
+        # indexes of strings, by their value and language (None unless the string is a locstr)
+        string_indexes = dict()
+        for iri in ontology_terms:
+            string_indexes[(iri, None)] = len(string_indexes)
+
+        def string_index(value):
+            key = (str(value), value.lang if isinstance(value, locstr) else None)
+            index = string_indexes.get(key)
+            if index is None:
+                index = string_indexes[key] = len(string_indexes)
+            return index
+
+        columns = dict()
+        terms = ontology_terms.values()
+        for field in SET_FIELDS:
+            values = [[string_index(value) for value in getattr(term, field)] for term in terms]
+            columns[field + "_offsets"] = _get_offsets(values)
+            columns[field] = np.array([index for term_values in values for index in term_values], dtype=np.int32)
+        for field in DICT_FIELDS:
+            # terms created without a dictionary field have an empty tuple in its place
+            values = [[(string_index(key), string_index(value)) for key, value in (getattr(term, field) or {}).items()]
+                      for term in terms]
+            columns[field + "_offsets"] = _get_offsets(values)
+            columns[field] = np.array([pair for term_values in values for pair in term_values],
+                                      dtype=np.int32).reshape(-1, 2)
+        columns["iri_order"] = np.array(sorted(range(len(ontology_terms)), key=list(ontology_terms).__getitem__),
+                                        dtype=np.int32)
+        columns["deprecated"] = np.array([term.deprecated for term in terms], dtype=bool)
+        columns["term_types"] = np.array([TERM_TYPES.index(term.term_type) for term in terms], dtype=np.uint8)
+        # languages are strings themselves, which are added to the end of the table
+        string_keys = list(string_indexes)
+        string_languages = [-1 if language is None else string_index(language) for _, language in string_keys]
+        string_languages.extend([-1] * (len(string_indexes) - len(string_keys)))
+        columns["string_languages"] = np.array(string_languages, dtype=np.int32)
+        encoded_strings = [string.encode("utf-8") for string, _ in string_indexes]
+        columns["string_offsets"] = np.concatenate(([0], np.cumsum([len(string) for string in encoded_strings],
+                                                                   dtype=np.int64)))
+        columns["strings"] = np.frombuffer(b"".join(encoded_strings), dtype=np.uint8)
+        return cls(columns)
+
+    def save(self, directory):
+        """
+        Save the arrays of these terms as NumPy files in a new subdirectory of the given directory, and then replace the
+        format file of the given directory, which refers to that subdirectory, so that loading the terms from the given
+        directory never sees partially saved arrays. The arrays saved before the previous ones are removed, while the
+        previous ones are kept for readers that read the format file before it was replaced
+        :param directory: Directory where the arrays are saved, which is created if it does not exist
+        """
+        if self._term_indexes is not None:
+            raise ValueError("Filtered columnar ontology terms cannot be saved, as they share the arrays of all terms")
+        columns_dir = f"columns-{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        os.makedirs(os.path.join(directory, columns_dir))
+        for name, column in self._columns.items():
+            np.save(os.path.join(directory, columns_dir, name + ".npy"), column)
+        with onto_utils.atomic_write(os.path.join(directory, "format.json"), 'w') as json_file:
+            json.dump({"version": COLUMNAR_FORMAT_VERSION, "terms": self._nr_terms, "columns": columns_dir}, json_file)
+        saved_columns_dirs = sorted(file for file in os.listdir(directory) if file.startswith("columns-"))
+        for file in saved_columns_dirs[:-2]:
+            shutil.rmtree(os.path.join(directory, file), ignore_errors=True)
+        for file in os.listdir(directory):
+            if file.endswith(".npy"):  # arrays saved directly in the given directory by earlier versions
+                os.remove(os.path.join(directory, file))
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Load the arrays of terms saved in the given directory, memory-mapping them rather than reading them
+        :param directory: Directory where the arrays were saved
+        :return: ColumnarOntologyTerms
+        """
+        with open(os.path.join(directory, "format.json")) as json_file:
+            columns_format = json.load(json_file)
+        if columns_format["version"] != COLUMNAR_FORMAT_VERSION:
+            raise ValueError(f"Unsupported version of columnar ontology terms in {directory}: "
+                             f"{columns_format['version']}")
+        columns_dir = os.path.join(directory, columns_format.get("columns", ""))
+        columns = dict()
+        for file in os.listdir(columns_dir):
+            if file.endswith(".npy"):
+                columns[file[:-len(".npy")]] = np.load(os.path.join(columns_dir, file), mmap_mode='r')
+        return cls(columns)
+
+    def filter(self, iris=(), excl_deprecated=False, term_type=OntologyTermType.ANY):
+        """
+        Get the terms whose IRIs start with any of the given IRIs, and that are of the given type and, optionally, not
+        deprecated. Terms are selected by binary searches of the IRIs sorted in the order of their UTF-8 bytes, which
+        is the same order as their code points, and then by their deprecation and type
+        :param iris: IRI or tuple of IRIs that the IRIs of the terms must start with, or an empty tuple for all terms
+        :param excl_deprecated: Exclude terms stated as deprecated
+        :param term_type: Type of the terms: 'class' or 'property' or 'any'
+        :return: ColumnarOntologyTerms with the selected terms, in the same order as in these terms
+        """
+        if term_type not in {OntologyTermType.CLASS, OntologyTermType.PROPERTY, OntologyTermType.ANY}:
+            raise ValueError("Invalid term-type option. Acceptable term types are: 'class' or 'property' or 'any'")
+        if isinstance(iris, str):
+            iris = (iris,)
+        if len(iris) == 0:
+            selected = np.arange(len(self._columns["deprecated"])) if self._term_indexes is None else self._term_indexes
+        else:
+            iri_order = self._get_iri_order()
+            ranges = []
+            for iri in iris:
+                iri_prefix = iri.encode("utf-8")
+                ranges.append(iri_order[self._bisect_iris(iri_prefix, False):self._bisect_iris(iri_prefix, True)])
+            selected = np.unique(np.concatenate(ranges))
+            if self._term_indexes is not None:
+                selected = np.intersect1d(selected, self._term_indexes, assume_unique=True)
+        if excl_deprecated:
+            selected = selected[~self._columns["deprecated"][selected]]
+        if term_type != OntologyTermType.ANY:
+            selected = selected[self._columns["term_types"][selected] == TERM_TYPES.index(term_type)]
+        return ColumnarOntologyTerms(self._columns, selected)
+
+    def get_term_store(self):
+        """
+        Get a store of these terms, built with array operations on the columns of the terms. Parents, children and
+        instances that are terms of the store (i.e., whose IRI is the string of a term index) are nodes with the same
+        IRI as that term, as in a store built from OntologyTerm objects
+        :return: OntologyTermStore
+        """
+        indexes = np.arange(len(self._columns["deprecated"])) if self._term_indexes is None else self._term_indexes
+        get_string = self._get_string
+        label_indexes, label_offsets = self._get_values("labels", indexes)
+        synonym_indexes, synonym_offsets = self._get_values("synonyms", indexes)
+        # the names of each term are its labels followed by its synonyms, and a stable sort by term keeps that order
+        name_term_ids = np.concatenate((_get_value_term_ids(label_offsets), _get_value_term_ids(synonym_offsets)))
+        order = np.argsort(name_term_ids, kind="stable")
+        name_indexes = np.concatenate((label_indexes, synonym_indexes))[order]
+        name_offsets = np.concatenate(([0], np.cumsum(np.diff(label_offsets) + np.diff(synonym_offsets))))
+        labels = [get_string(label_indexes[offset]) if offset < end else ""
+                  for offset, end in zip(label_offsets[:-1].tolist(), label_offsets[1:].tolist())]
+        # nodes are the distinct (IRI, label) pairs of the neighbours, numbered via keys that combine both indexes
+        nr_strings = len(self._columns["string_offsets"]) - 1
+        neighbour_keys = dict()
+        for field in NEIGHBOUR_FIELDS:
+            pairs, offsets = self._get_values(field, indexes)
+            neighbour_keys[field] = (pairs[:, 0].astype(np.int64) * nr_strings + pairs[:, 1], offsets)
+        node_keys, node_ids = np.unique(np.concatenate([keys for keys, _ in neighbour_keys.values()]),
+                                        return_inverse=True)
+        neighbours, start = dict(), 0
+        for field, (keys, offsets) in neighbour_keys.items():
+            neighbours[field] = (offsets, node_ids[start:start + len(keys)].astype(np.int32))
+            start += len(keys)
+        return OntologyTermStore([get_string(index) for index in indexes.tolist()], labels,
+                                 [get_string(index) for index in name_indexes.tolist()], name_offsets,
+                                 [get_string(index) for index in (node_keys // nr_strings).tolist()],
+                                 [get_string(index) for index in (node_keys % nr_strings).tolist()], neighbours)
+
+    def _get_values(self, field, indexes):
+        # Get the values of the given field of the terms at the given indexes, and the offsets of each term's values
+        offsets = self._columns[field + "_offsets"]
+        starts = offsets[indexes]
+        counts = offsets[indexes + 1] - starts
+        value_offsets = np.concatenate(([0], np.cumsum(counts)))
+        positions = np.repeat(starts - value_offsets[:-1], counts) + np.arange(value_offsets[-1])
+        return self._columns[field][positions], value_offsets
+
+    def _get_iri_order(self):
+        if "iri_order" not in self._columns:  # columns saved before the sorted IRIs were stored
+            self._columns["iri_order"] = np.array(sorted(range(len(self._columns["deprecated"])),
+                                                         key=self._get_string_bytes), dtype=np.int32)
+        return self._columns["iri_order"]
+
+    def _bisect_iris(self, iri_prefix, right):
+        # Get the position in the sorted IRIs of the first IRI whose prefix (of the length of the given prefix) is not
+        # less than (or, if right is true, is greater than) the given prefix
+        iri_order = self._columns["iri_order"]
+        low, high = 0, len(iri_order)
+        while low < high:
+            middle = (low + high) // 2
+            prefix = self._get_string_bytes(iri_order[middle])[:len(iri_prefix)]
+            if prefix < iri_prefix or (right and prefix == iri_prefix):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _get_string_bytes(self, index):
+        offsets = self._columns["string_offsets"]
+        return bytes(self._strings[offsets[index]:offsets[index + 1]])
+
+    def get_term(self, index):
+        """
+        Get the ontology term at the given index
+        :param index: Index of the term, in the order of the terms the columns were built from
+        :return: OntologyTerm whose fields are read from the columns when first used
+        """
+        term = self._terms.get(index)
+        if term is None:
+            term = OntologyTerm(self._get_string(index), deprecated=bool(self._columns["deprecated"][index]),
+                                term_type=TERM_TYPES[self._columns["term_types"][index]],
+                                field_loader=partial(self._load_field, index), **UNLOADED_FIELDS)
+            self._terms[index] = term
+        return term
+
+    def _load_field(self, index, iri, field):
+        offsets = self._field_offsets.get(field)
+        if offsets is None:
+            offsets = self._field_offsets[field] = self._columns[field + "_offsets"].tolist()
+        values = self._columns[field][offsets[index]:offsets[index + 1]].tolist()
+        if field in SET_FIELDS:  # the values of each term are distinct
+            return [self._get_string(value) for value in values]
+        return {self._get_string(key): self._get_string(value) for key, value in values}
+
+    def _get_string(self, index):
+        if self._string_offsets is None:  # indexing lists is much faster than indexing arrays
+            self._string_offsets = self._columns["string_offsets"].tolist()
+            self._string_languages = self._columns["string_languages"].tolist()
+        string = str(self._strings[self._string_offsets[index]:self._string_offsets[index + 1]], "utf-8")
+        language = self._string_languages[index]
+        return string if language < 0 else locstr(string, self._get_string(language))
+
+    def _get_indexes(self):
+        # Indexes of the terms in this dictionary, as a list since indexing lists is much faster than indexing arrays
+        if self._term_indexes is None:
+            return range(self._nr_terms)
+        if self._term_index_list is None:
+            self._term_index_list = self._term_indexes.tolist()
+        return self._term_index_list
+
+    def _get_iri_indexes(self):
+        if self._iri_indexes is None:
+            self._iri_indexes = {self._get_string(index): index for index in self._get_indexes()}
+        return self._iri_indexes
+
+    def __getitem__(self, iri):
+        return self.get_term(self._get_iri_indexes()[iri])
+
+    def __contains__(self, iri):
+        return iri in self._get_iri_indexes()
+
+    def __iter__(self):
+        return (self._get_string(index) for index in self._get_indexes())
+
+    def __len__(self):
+        return self._nr_terms
+
+    def items(self):
+        return _TermItems(self)
+
+    def values(self):
+        return _TermValues(self)
+
+
+class _TermItems(ItemsView):
+    # Items of columnar ontology terms, iterated by term index rather than looked up by IRI
+
+    def __iter__(self):
+        for index in self._mapping._get_indexes():
+            term = self._mapping.get_term(index)
+            yield term.iri, term
+
+
+class _TermValues(ValuesView):
+    # Values of columnar ontology terms, iterated by term index rather than looked up by IRI
+
+    def __iter__(self):
+        return (self._mapping.get_term(index) for index in self._mapping._get_indexes())
+
+
+def _get_value_term_ids(offsets):
+    # Get the position of the term of each value, given the offsets of the values of each term
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def _get_offsets(values):
+    return np.concatenate(([0], np.cumsum([len(term_values) for term_values in values], dtype=np.int64)))
@@ -0,0 +1,122 @@
+"""Provides CurieResolver class"""
+
+import re
+import json
+import bisect
+import logging
+import functools
+import numpy as np
+import pandas as pd
+import bioregistry
+from text2term import onto_utils
+
+# The namespace of an IRI is the IRI up to (and including) the last of these characters
+NAMESPACE_PATTERN = re.compile(r".*[/#_:=]")
+
+# Number of CURIEs of IRIs in namespaces whose IRIs are resolved one by one that are memoized (least recently used first
+# out), which bounds the memory used by a resolver in a long-running process
+COMPRESSED_IRI_CACHE_SIZE = 100000
+
+
+class CurieResolver:
+
+    def __init__(self, namespaces=None):
+        """
+        Resolver of the CURIEs of IRIs via bioregistry, which memoizes the CURIE prefix of each IRI namespace so that
+        bioregistry is used once per namespace rather than once per IRI. Bioregistry compresses an IRI using the
+        longest URI prefix in the registry that the IRI starts with, so the CURIE prefix of an IRI applies to all IRIs
+        in its namespace, unless a URI prefix in the registry extends beyond the namespace (e.g., the URI prefix
+        'https://omim.org/MIM:PS' of the namespace 'https://omim.org/MIM:'), whose IRIs are resolved one by one
+        :param namespaces: Dictionary of IRI namespaces to the CURIE prefix and the length of the URI prefix of their
+                           IRIs, or to None for namespaces whose IRIs have no CURIE
+        """
+        self.namespaces = dict() if namespaces is None else namespaces
+        self.logger = onto_utils.get_logger(__name__, logging.INFO)
+        self._ambiguous_namespaces = set()
+        self._uri_prefixes = None
+
+    def get_curie(self, iri):
+        """
+        Get the CURIE of the given IRI, which is the (upper case) CURIE given by bioregistry
+        :param iri: IRI
+        :return: CURIE, or an empty string if the IRI is empty or bioregistry cannot compress it
+        """
+        if iri == "":
+            return ""
+        match = NAMESPACE_PATTERN.match(iri)
+        namespace = "" if match is None else match.group()
+        resolved = self.namespaces.get(namespace, False)
+        if resolved is False:
+            if namespace not in self._ambiguous_namespaces:
+                self._resolve_namespace(namespace, iri)
+            resolved = self.namespaces.get(namespace, False)
+            if resolved is False:  # the IRIs of the namespace are resolved one by one
+                return _compress(iri)
+        if resolved is None:
+            return ""
+        prefix, uri_prefix_length = resolved
+        return (prefix + ":" + iri[uri_prefix_length:]).upper()
+
+    def get_curies(self, iris):
+        """
+        Get the CURIEs of the given IRIs in one pass, resolving the CURIE of each distinct IRI once
+        :param iris: Array, list or series of IRIs
+        :return: Array of the CURIE of each IRI
+        """
+        codes, distinct_iris = pd.factorize(np.asarray(iris, dtype=object))
+        # missing IRIs have the code -1, which selects the empty string appended to the CURIEs of the distinct IRIs
+        curies = np.array([self.get_curie(iri) for iri in distinct_iris] + [""], dtype=object)
+        return curies[codes]
+
+    def update(self, curie_resolver):
+        """
+        Add the namespaces resolved by the given resolver to the namespaces of this resolver
+        :param curie_resolver: CurieResolver
+        """
+        self.namespaces.update(curie_resolver.namespaces)
+
+    def _resolve_namespace(self, namespace, iri):
+        # Resolve the CURIE prefix of the given namespace from an IRI in that namespace, unless a URI prefix extends the
+        # namespace, in which case the IRIs of the namespace are resolved one by one
+        if self._uri_prefixes is None:
+            self._uri_prefixes = sorted(bioregistry.manager.converter.reverse_prefix_map)
+        # URI prefixes that extend the namespace are the ones sorted right after the namespace, if any
+        position = bisect.bisect_right(self._uri_prefixes, namespace)
+        if position < len(self._uri_prefixes) and self._uri_prefixes[position].startswith(namespace):
+            self._ambiguous_namespaces.add(namespace)
+            return
+        try:
+            prefix, identifier = bioregistry.parse_iri(iri)
+        except TypeError:  # bioregistry cannot compress the IRI
+            prefix, identifier = None, None
+        if prefix is None or identifier is None:
+            self.logger.warning("Error obtaining CURIE for IRIs in namespace: %s", namespace)
+            self.namespaces[namespace] = None
+        else:
+            self.namespaces[namespace] = (prefix, len(iri) - len(identifier))
+
+    def save(self, file_path):
+        with onto_utils.atomic_write(file_path, 'w') as json_file:
+            json.dump({"bioregistry": bioregistry.version.get_version(), "namespaces": self.namespaces}, json_file)
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path) as json_file:
+            saved = json.load(json_file)
+        if saved["bioregistry"] != bioregistry.version.get_version():  # the registry may have changed
+            return cls()
+        return cls({namespace: None if resolved is None else tuple(resolved)
+                    for namespace, resolved in saved["namespaces"].items()})
+
+
+@functools.lru_cache(maxsize=COMPRESSED_IRI_CACHE_SIZE)
+def _compress(iri):
+    try:
+        curie = bioregistry.curie_from_iri(iri)
+    except TypeError:  # bioregistry cannot compress the IRI
+        curie = None
+    return "" if curie is None else curie.upper()
+
+
+# Resolver shared by the mappers, whose namespaces are resolved once per process (or loaded from the ontology cache)
+CURIE_RESOLVER = CurieResolver()
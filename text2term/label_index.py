@@ -0,0 +1,77 @@
+"""Provides LabelIndex class"""
+
+import pickle
+from text2term import onto_utils
+from text2term.term_mapping import TermMapping, TermMappingCollection
+from text2term.term_store import get_term_store
+
+
+class LabelIndex:
+
+    def __init__(self, label_iris):
+        """
+        Hash index of the normalized labels and synonyms of ontology terms, used to map source terms that exactly match
+        a label or synonym (after normalization via onto_utils.normalize) with a score of 1, without comparing them with
+        every ontology term
+        :param label_iris: Dictionary of normalized labels and synonyms to the tuple of IRIs of the terms that have them
+        """
+        self.label_iris = label_iris
+
+    @classmethod
+    def build(cls, ontology_terms):
+        """
+        Build an index of the normalized labels and synonyms of the given ontology terms
+        :param ontology_terms: OntologyTermStore, or dictionary of ontology term IRIs to OntologyTerm objects
+        :return: LabelIndex
+        """
+        term_store = get_term_store(ontology_terms)
+        label_iris = dict()
+        for name, term_id in zip(term_store.names, term_store.name_term_ids.tolist()):
+            iris = label_iris.setdefault(onto_utils.normalize(name), [])
+            if term_store.iris[term_id] not in iris:
+                iris.append(term_store.iris[term_id])
+        label_iris.pop("", None)  # labels made only of stop words and non-word characters cannot be matched exactly
+        return cls({label: tuple(iris) for label, iris in label_iris.items()})
+
+    def get_iris(self, source_term, ontology_terms=None):
+        """
+        Get the IRIs of the ontology terms with a label or synonym that matches the given source term when normalized
+        :param source_term: Source term to look up
+        :param ontology_terms: Collection of (IRIs of) ontology terms to restrict the matches to, or None for any term
+        :return: List of IRIs, in the order of the ontology terms the index was built from
+        """
+        iris = self.label_iris.get(onto_utils.normalize(source_term), ())
+        if ontology_terms is None:
+            return list(iris)
+        return [iri for iri in iris if iri in ontology_terms]
+
+    def map(self, source_terms, source_terms_ids, ontology_terms, max_mappings=3):
+        """
+        Map the given source terms that exactly match a label or synonym of an ontology term with a score of 1
+        :param source_terms: List of source terms to be mapped with ontology terms
+        :param source_terms_ids: List of identifiers for the given source terms
+        :param ontology_terms: OntologyTermStore, or dictionary of ontology terms, to map to
+        :param max_mappings: Maximum number of ontology term mappings that should be returned per source term
+        :return: Data frame of the exact mappings, and the lists of the source terms that have no exact match and of
+                 their identifiers
+        """
+        term_store = get_term_store(ontology_terms)
+        mappings, unmatched_terms, unmatched_ids = [], [], []
+        for term, term_id in zip(source_terms, source_terms_ids):
+            iris = self.get_iris(term, term_store)
+            if len(iris) == 0:
+                unmatched_terms.append(term)
+                unmatched_ids.append(term_id)
+            for iri in iris[:max_mappings]:
+                label = term_store.labels[term_store.get_term_id(iri)]
+                mappings.append(TermMapping(term, term_id, label, iri, 1.0))
+        return TermMappingCollection(mappings).mappings_df(), unmatched_terms, unmatched_ids
+
+    def save(self, file_path):
+        with onto_utils.atomic_write(file_path) as out_file:
+            pickle.dump(self.label_iris, out_file)
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path, 'rb') as in_file:
+            return cls(pickle.load(in_file))
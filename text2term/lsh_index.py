@@ -0,0 +1,128 @@
+"""Provides MinHashLSHIndex class"""
+
+import pickle
+import numpy as np
+from text2term import onto_utils
+
+# Mersenne prime modulus of the universal hash functions used to compute MinHash signatures
+MERSENNE_PRIME = (1 << 31) - 1
+
+# Number of rows whose MinHash signatures are computed at a time, to bound the size of intermediate hash arrays
+SIGNATURE_BATCH_SIZE = 2000
+
+
+class MinHashLSHIndex:
+
+    def __init__(self, band_keys, vocabulary_size, num_perm=120, bands=40, seed=1):
+        """
+        Locality-sensitive hashing (LSH) index of the MinHash signatures of the n-gram sets of ontology term labels.
+        The signature of each label is split into bands, and labels are bucketed by the hash of each band. Labels whose
+        n-gram sets have a high Jaccard similarity to a source term are likely to share a bucket with it in at least one
+        band, so looking up the buckets of a source term gives candidate labels without comparing it with every label.
+        :param band_keys: Array with the bucket key of each label (rows) in each band (columns)
+        :param vocabulary_size: Number of distinct n-grams, i.e. columns of the n-gram matrices to hash
+        :param num_perm: Number of hash functions (permutations) in a MinHash signature
+        :param bands: Number of bands that signatures are split into. More bands, with fewer hash values in each, give
+                      a higher recall at the cost of more candidates
+        :param seed: Seed of the random hash functions
+        """
+        if num_perm % bands != 0:
+            raise ValueError(f"The number of permutations ({num_perm}) must be a multiple of the number of bands "
+                             f"({bands})")
+        self.vocabulary_size = vocabulary_size
+        self.num_perm = num_perm
+        self.bands = bands
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        a = rng.integers(1, MERSENNE_PRIME, size=num_perm, dtype=np.int64)
+        b = rng.integers(0, MERSENNE_PRIME, size=num_perm, dtype=np.int64)
+        self._hash_table = ((a[:, None] * np.arange(vocabulary_size, dtype=np.int64)[None, :] + b[:, None])
+                            % MERSENNE_PRIME).astype(np.uint32)
+        self._band_multipliers = rng.integers(1, np.iinfo(np.int64).max, size=num_perm // bands,
+                                              dtype=np.int64).astype(np.uint64) | np.uint64(1)
+        self._set_band_keys(band_keys)
+
+    @classmethod
+    def build(cls, ngram_matrix, num_perm=120, bands=40, seed=1):
+        """
+        Build an LSH index of the MinHash signatures of the rows of the given n-gram matrix
+        :param ngram_matrix: Sparse matrix with one row per label and one column per n-gram (eg TFIDFIndex.label_counts)
+        :param num_perm: Number of hash functions (permutations) in a MinHash signature
+        :param bands: Number of bands that signatures are split into
+        :param seed: Seed of the random hash functions
+        :return: MinHashLSHIndex
+        """
+        index = cls(np.zeros((0, bands), dtype=np.uint64), ngram_matrix.shape[1], num_perm, bands, seed)
+        index._set_band_keys(index.get_band_keys(ngram_matrix))
+        return index
+
+    def restrict(self, rows):
+        """
+        Get an index containing only the given rows (labels) of this index, renumbered from 0 in the given order
+        :param rows: Array of row numbers to keep
+        :return: MinHashLSHIndex
+        """
+        if len(rows) == len(self.band_keys):
+            return self
+        return MinHashLSHIndex(self.band_keys[rows], self.vocabulary_size, self.num_perm, self.bands, self.seed)
+
+    def _set_band_keys(self, band_keys):
+        self.band_keys = band_keys
+        # labels without any n-grams cannot be candidates, so they are left out of the buckets. The buckets of each band
+        # are the runs of equal keys in the sorted keys of that band
+        indexed = np.flatnonzero(band_keys[:, 0] != 0)
+        order = np.argsort(band_keys[indexed], axis=0, kind='stable')
+        self._bucket_labels = indexed[order].T
+        self._bucket_keys = np.take_along_axis(band_keys[indexed], order, axis=0).T
+
+    def get_band_keys(self, ngram_matrix):
+        """
+        Compute the bucket keys in each band of the rows of the given n-gram matrix. Rows without n-grams get the key 0
+        :param ngram_matrix: Sparse matrix with one row per string and one column per n-gram
+        :return: Array with one row per string and one column per band
+        """
+        ngram_matrix = ngram_matrix.tocsr()
+        rows_per_band = self.num_perm // self.bands
+        band_keys = np.zeros((ngram_matrix.shape[0], self.bands), dtype=np.uint64)
+        for start in range(0, ngram_matrix.shape[0], SIGNATURE_BATCH_SIZE):
+            batch = ngram_matrix[start:start + SIGNATURE_BATCH_SIZE]
+            nonempty = np.flatnonzero(np.diff(batch.indptr))
+            if len(nonempty) == 0:
+                continue
+            hashes = self._hash_table[:, batch.indices]
+            signatures = np.minimum.reduceat(hashes, batch.indptr[nonempty], axis=1).T.astype(np.uint64)
+            signatures = signatures.reshape(len(nonempty), self.bands, rows_per_band)
+            keys = (signatures * self._band_multipliers).sum(axis=2, dtype=np.uint64)
+            keys[keys == 0] = 1  # 0 is reserved for rows without n-grams
+            band_keys[start + nonempty] = keys
+        return band_keys
+
+    def get_candidates(self, ngram_matrix):
+        """
+        Get the labels that share a bucket in at least one band with each row of the given n-gram matrix
+        :param ngram_matrix: Sparse matrix with one row per source term and one column per n-gram
+        :return: Arrays of the rows of the given matrix and of their respective candidate labels, sorted by row
+        """
+        query_keys = self.get_band_keys(ngram_matrix)
+        nr_labels = len(self.band_keys)
+        pairs = []
+        for band in range(self.bands):
+            bucket_keys = self._bucket_keys[band]
+            lower = np.searchsorted(bucket_keys, query_keys[:, band], side='left')
+            upper = np.searchsorted(bucket_keys, query_keys[:, band], side='right')
+            bucket_sizes = np.where(query_keys[:, band] != 0, upper - lower, 0)
+            rows = np.repeat(np.arange(len(query_keys), dtype=np.int64), bucket_sizes)
+            offsets = np.arange(bucket_sizes.sum()) - np.repeat(np.cumsum(bucket_sizes) - bucket_sizes, bucket_sizes)
+            labels = self._bucket_labels[band][np.repeat(lower, bucket_sizes) + offsets]
+            pairs.append(rows * nr_labels + labels)
+        pairs = np.unique(np.concatenate(pairs)) if len(pairs) > 0 else np.zeros(0, dtype=np.int64)
+        return pairs // max(nr_labels, 1), pairs % max(nr_labels, 1)
+
+    def save(self, file_path):
+        with onto_utils.atomic_write(file_path) as out_file:
+            pickle.dump((self.band_keys, self.vocabulary_size, self.num_perm, self.bands, self.seed), out_file)
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path, 'rb') as in_file:
+            return cls(*pickle.load(in_file))
@@ -12,6 +12,7 @@ class Mapper(str, Enum):
     INDEL = 'indel'
     FUZZY = 'fuzzy'
     TFIDF = 'tfidf'
+    LSH = 'lsh'
     ZOOMA = 'zooma'
     BIOPORTAL = 'bioportal'
 
@@ -1,53 +1,720 @@
 import os
+import re
 import sys
+import json
+import mmap
+import time
+import datetime
+import itertools
+import contextlib
+import tempfile
+import threading
+import multiprocessing
+import urllib.request
 import text2term
 import owlready2
+import bioregistry
+import numpy as np
 import pandas as pd
-from text2term.term import OntologyTermType
+from functools import partial
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+from text2term import onto_utils
+from text2term.term import OntologyTerm, OntologyTermType
+from text2term.term_collector import get_document_version
 from text2term.mapper import Mapper
+from text2term.config import VERSION
 from shutil import rmtree
 
 CACHE_FOLDER = "cache"
 
+# File in the cache folder that records the source, version, build time, last access time and size of each cached
+# ontology, and the bound on the size of the cache
+MANIFEST_FILE = "manifest.json"
+
+# Minimum number of seconds between updates of the time a cached ontology was last accessed, recorded in the manifest
+ACCESS_TIME_RESOLUTION = 60
+
+# Minimum number of seconds between checks of whether the source document of a cached ontology that is loaded in memory
+# has changed, done when mapping to the ontology (ontologies that are not loaded in memory are always checked)
+STALENESS_CHECK_INTERVAL = 60
+
+# Columns of the table of cached ontologies given by list_cache
+CACHE_LIST_COLUMNS = ["acronym", "source", "base_iris", "version", "content_hash", "build_time", "last_access", "size",
+                      "stale"]
+
+# Number of ontology documents downloaded at a time while caching a set of ontologies
+DOWNLOAD_JOBS = 4
+
+# Default bound on the (estimated) bytes of the cached ontologies kept loaded in memory across map_terms calls
+DEFAULT_MEMORY_CACHE_BYTES = 1024 ** 3
+
+# Estimated bytes of an OntologyTerm object along with its fields. Terms are counted rather than measured, since
+# measuring their fields would load the fields of the terms loaded from the cache that have not been used
+ESTIMATED_TERM_BYTES = 700
+
+# Values whose size is that of the value itself, and top-level packages whose objects are measured along with the values
+# of their attributes when estimating the memory held by loaded ontologies (other objects, e.g., loggers, are not)
+_ATOMIC_TYPES = (str, bytes, int, float, bool, type(None))
+_MEASURED_PACKAGES = {"text2term", "numpy", "scipy", "sklearn"}
+
+# Time each cached ontology was last recorded as accessed in the cache manifest, as last read or written in this process
+_last_recorded_accesses = dict()
+
+# Time (per time.monotonic) each cached ontology was last checked for staleness by refresh_cache in this process
+_last_staleness_checks = dict()
+
+LOGGER = onto_utils.get_logger(__name__)
+
 """
 CACHING FUNCTIONS -- Public
 """
 
 
-# Caches many ontologies from a csv
-def cache_ontology_set(ontology_registry_path):
+# Caches many ontologies from a csv. Ontology documents are downloaded (DOWNLOAD_JOBS at a time) while the ontologies
+# already downloaded are cached, either one at a time or, if n_jobs > 1, in separate processes (-1 uses all CPUs). At
+# most n_jobs + DOWNLOAD_JOBS documents are being downloaded or cached at a time, and each downloaded document is
+# deleted once its ontology has been cached. An ontology that cannot be downloaded or cached is reported and skipped.
+# Returns the caches of the ontologies that were cached, in the order of the csv
+def cache_ontology_set(ontology_registry_path, n_jobs=1):
     registry = pd.read_csv(ontology_registry_path)
-    cache_set = {}
-    for index, row in registry.iterrows():
+    n_jobs = onto_utils.get_worker_count(n_jobs)
+    start = time.time()
+    cache_set, failures = {}, {}
+    rows = registry.itertuples()
+    downloads, jobs = dict(), dict()
+    # Workers are started rather than forked, so each one has its own owlready2 World and quadstore
+    pool = ProcessPoolExecutor(n_jobs, mp_context=multiprocessing.get_context("spawn")) if n_jobs > 1 \
+        else contextlib.nullcontext()
+    with tempfile.TemporaryDirectory() as download_dir, ThreadPoolExecutor(DOWNLOAD_JOBS) as downloader, pool:
+        while True:
+            for row in itertools.islice(rows, n_jobs + DOWNLOAD_JOBS - len(downloads) - len(jobs)):
+                downloads[downloader.submit(_download_ontology, row.url, row.acronym, download_dir)] = row
+            if len(downloads) + len(jobs) == 0:
+                break
+            for done in wait(set(downloads) | set(jobs), return_when=FIRST_COMPLETED).done:
+                if done in jobs:
+                    row, document_path = jobs.pop(done)
+                    _report_cached_ontology(row, done.result, cache_set, failures, len(registry))
+                    _remove_downloaded_ontology(document_path, download_dir)
+                    continue
+                row = downloads.pop(done)
+                if done.exception() is not None:
+                    _report_cached_ontology(row, done.result, cache_set, failures, len(registry))
+                elif n_jobs == 1:
+                    _report_cached_ontology(row, lambda: _cache_downloaded_ontology(done, row.acronym, row.url),
+                                            cache_set, failures, len(registry))
+                    _remove_downloaded_ontology(done.result(), download_dir)
+                else:
+                    jobs[pool.submit(_cache_ontology, done.result(), row.acronym, row.url)] = row, done.result()
+    LOGGER.info(f"Cached {len(cache_set)} of {len(registry)} ontologies (total time: {time.time() - start:.2f}s)" +
+                "".join(f"\n  failed to cache {acronym}: {error}" for acronym, error in failures.items()))
+    return {row.acronym: cache_set[row.acronym] for row in registry.itertuples() if row.acronym in cache_set}
+
+
+# Will check if an acronym exists in the cache, i.e., whether the terms of the ontology with that acronym have been
+# cached (or, if no acronym is given, whether the cache exists)
+def cache_exists(ontology_acronym=''):
+    if ontology_acronym == '':
+        return os.path.exists(CACHE_FOLDER)
+    return get_cache_version(ontology_acronym) is not None
+
+
+# Gets a table of the cached ontologies, with the source (URL or path) each was cached from, the base IRIs given when
+# caching it, its version IRI and the SHA-256 hash of its document (when known), the times it was cached and last
+# accessed, the size of its cache files in bytes, and whether its (local) source document has changed since
+def list_cache():
+    manifest = _read_manifest()
+    cached_ontologies = []
+    for acronym in sorted(set(manifest["ontologies"]) | set(_get_cache_folders())):
+        entry = manifest["ontologies"].get(acronym, {})
+        cached_ontologies.append({"acronym": acronym, "source": entry.get("source"),
+                                  "base_iris": tuple(entry.get("base_iris", ())), "version": entry.get("version"),
+                                  "content_hash": entry.get("content_hash"),
+                                  "build_time": _to_datetime(entry.get("build_time")),
+                                  "last_access": _to_datetime(_get_last_access(acronym, entry)),
+                                  "size": _get_folder_size(os.path.join(CACHE_FOLDER, acronym)),
+                                  "stale": _get_stale_reason(acronym, entry, check_remote=False) is not None})
+    return pd.DataFrame(cached_ontologies, columns=CACHE_LIST_COLUMNS)
+
+
+# Sets the bound on the size in bytes of the cache, which is recorded in the cache manifest so that it applies to all
+# processes using the cache, and evicts the least recently used ontologies as needed. None removes the bound
+def set_cache_size(max_bytes):
+    with _update_manifest() as manifest:
+        manifest["max_bytes"] = max_bytes
+    gc_cache()
+
+
+# Removes the manifest entries of ontologies whose cache files no longer exist and, while the size of the cache exceeds
+# the given bound (by default, that set via set_cache_size), evicts the least recently accessed ontologies other than
+# those with the given acronyms. Returns the acronyms of the evicted ontologies
+def gc_cache(max_bytes=None, keep=()):
+    with _update_manifest() as manifest:
+        for acronym in [acronym for acronym in manifest["ontologies"] if not cache_exists(acronym)]:
+            LOGGER.info(f"Removing ontology {acronym} from the cache manifest: its cache files no longer exist")
+            del manifest["ontologies"][acronym]
+    max_bytes = manifest["max_bytes"] if max_bytes is None else max_bytes
+    if max_bytes is None:
+        return []
+    sizes = {acronym: _get_folder_size(os.path.join(CACHE_FOLDER, acronym)) for acronym in _get_cache_folders()}
+    evicted = []
+    for acronym in sorted(sizes, key=lambda name: _get_last_access(name, manifest["ontologies"].get(name, {}))):
+        if sum(sizes.values()) <= max_bytes:
+            break
+        if acronym in keep:
+            continue
+        LOGGER.info(f"Evicting ontology {acronym} from the cache (size: {sizes[acronym]} bytes, cache size: "
+                    f"{sum(sizes.values())} bytes, bound: {max_bytes} bytes)")
+        if _remove_cached_ontology(acronym):
+            del sizes[acronym]
+            evicted.append(acronym)
+    return evicted
+
+
+# Caches again the ontologies (or only that with the given acronym) whose cache files are missing or whose source
+# document has changed since they were cached. Local documents are compared by their SHA-256 hash, and, if check_remote
+# is True, remote documents are compared by their version IRI (or, if they had none when cached from a downloaded
+# copy, by their SHA-256 hash). Returns the acronyms of the ontologies cached again
+def refresh_cache(ontology_acronym='', check_remote=True):
+    manifest = _read_manifest()
+    acronyms = list(manifest["ontologies"]) if ontology_acronym == '' else [ontology_acronym]
+    refreshed = []
+    for acronym in acronyms:
+        entry = manifest["ontologies"].get(acronym)
+        if entry is None:
+            continue
+        _last_staleness_checks[acronym] = time.monotonic()
+        reason = _get_stale_reason(acronym, entry, check_remote)
+        if reason is None:
+            continue
+        LOGGER.info(f"Caching ontology {acronym} again: {reason}")
         try:
-            cache = text2term.cache_ontology(row.url, row.acronym)
-            cache_set.update({row.acronym: cache})
+            text2term.cache_ontology(entry["source"], acronym, tuple(entry["base_iris"]))
+            refreshed.append(acronym)
         except Exception as err:
-            err_message = "Could not cache ontology " + row.acronym + " due to error: " + str(err)
-            sys.stderr.write(err_message)
-        owlready2.default_world.ontologies.clear()
-    return cache_set
+            LOGGER.warning(f"Could not cache ontology {acronym} again due to error: {err}")
+    return refreshed
 
 
-# Will check if an acronym exists in the cache
-def cache_exists(ontology_acronym=''):
-    return os.path.exists(os.path.join(CACHE_FOLDER, ontology_acronym))
+# Checks whether the cached ontology with the given acronym has not been checked for staleness by refresh_cache in the
+# last STALENESS_CHECK_INTERVAL seconds
+def is_staleness_check_due(ontology_acronym):
+    last_check = _last_staleness_checks.get(ontology_acronym)
+    return last_check is None or time.monotonic() - last_check >= STALENESS_CHECK_INTERVAL
+
 
+# Gets the version of the cached terms of the ontology with the given acronym, which is the last time they were
+# modified, or None if the terms of the ontology have not been cached
+def get_cache_version(ontology_acronym):
+    cache_dir = os.path.join(CACHE_FOLDER, ontology_acronym)
+    for terms_file in (os.path.join(cache_dir, ontology_acronym + "-terms", "format.json"),
+                       os.path.join(cache_dir, ontology_acronym + "-term-details.pickle")):
+        if os.path.exists(terms_file):
+            return os.stat(terms_file).st_mtime_ns
+    return None
+
+
+# Gets the version IRI and SHA-256 hash (when known) of the ontology document with the given path, URL or name, along
+# with the size and modification time of local documents, which are used to check whether they have changed
+def get_document_details(document):
+    owl_link = None if os.path.exists(document) else bioregistry.get_owl_download(document)
+    try:
+        details = get_document_version(document if owl_link is None else owl_link, dict(), hash_remote=False)
+    except (OSError, ValueError) as err:
+        LOGGER.debug(f"Could not get the version of ontology document {document}: {err}")
+        details = {"document_version": None}
+    document_version = details["document_version"] or ""
+    return details | {"version": document_version[len("versionIRI:"):] if document_version.startswith("versionIRI:")
+                      else None, "content_hash": document_version if document_version.startswith("sha256:") else None}
 
-# Clears the cache
+
+# Records in the cache manifest that the ontology with the given acronym was cached from the given source (URL, path or
+# name of the ontology) using the given base IRIs, along with the details of the version of the ontology document
+# (obtained via get_document_details before loading it). Called while holding the cache lock of the ontology
+def record_cached_ontology(ontology_acronym, source, base_iris, document_details):
+    with _update_manifest() as manifest:
+        manifest["ontologies"][ontology_acronym] = document_details | {
+            "source": source, "base_iris": [base_iris] if isinstance(base_iris, str) else list(base_iris),
+            "build_time": time.time(), "last_access": time.time(),
+            "size": _get_folder_size(os.path.join(CACHE_FOLDER, ontology_acronym)), "text2term_version": VERSION}
+
+
+# Records in the cache manifest that the ontology with the given acronym was accessed. The recorded time is updated at
+# most every ACCESS_TIME_RESOLUTION seconds, and the time last recorded is kept in memory, so that mapping to a cached
+# ontology repeatedly rarely reads or writes the manifest
+def record_cache_access(ontology_acronym):
+    if time.time() - _last_recorded_accesses.get(ontology_acronym, 0) < ACCESS_TIME_RESOLUTION:
+        return
+    last_access = _read_manifest()["ontologies"].get(ontology_acronym, {}).get("last_access")
+    if last_access is None or time.time() - last_access >= ACCESS_TIME_RESOLUTION:
+        last_access = time.time()
+        with _update_manifest() as manifest:
+            if ontology_acronym in manifest["ontologies"]:
+                manifest["ontologies"][ontology_acronym]["last_access"] = last_access
+    _last_recorded_accesses[ontology_acronym] = last_access
+
+
+# Clears the cache, or only the cached ontology with the given acronym. Each ontology is removed while holding its cache
+# lock, so an ontology is not removed while it is being cached, and so are the lock files (see _file_lock)
 def clear_cache(ontology_acronym=''):
-    cache_dir = CACHE_FOLDER
-    if ontology_acronym != '':
-        cache_dir = os.path.join(CACHE_FOLDER, ontology_acronym)
-    # Is equivalent to: rm -r cache_dir
+    LOADED_ONTOLOGIES.clear(ontology_acronym)
     try:
-        rmtree(cache_dir)
+        if ontology_acronym != '':
+            _remove_cache_files(ontology_acronym)
+        elif os.path.exists(CACHE_FOLDER):
+            for acronym in _get_cache_folders():
+                _remove_cache_files(acronym)
+            manifest_lock_path = os.path.join(CACHE_FOLDER, MANIFEST_FILE + ".lock")
+            with _file_lock(manifest_lock_path):
+                _remove_file(os.path.join(CACHE_FOLDER, MANIFEST_FILE))
+                _remove_file(manifest_lock_path)
+            for name in os.listdir(CACHE_FOLDER):
+                path = os.path.join(CACHE_FOLDER, name)
+                if name.endswith(".lock"):  # e.g., lock files of ontologies that were never cached
+                    with _file_lock(path):
+                        _remove_file(path)
+                elif name != MANIFEST_FILE and os.path.isfile(path):
+                    os.remove(path)
+            with contextlib.suppress(OSError):  # unless an ontology has been cached meanwhile
+                os.rmdir(CACHE_FOLDER)
         sys.stderr.write("Cache has been cleared successfully\n")
     except OSError as error:
         sys.stderr.write("Cache cannot be removed:")
         sys.stderr.write(str(error))
 
 
+# Holds an advisory lock on the cache of the ontology with the given acronym, waiting until other processes or threads
+# that hold it release it. The lock is taken while caching the ontology, so that its cache files are written by one
+# process at a time
+def cache_lock(ontology_acronym):
+    return _file_lock(_get_lock_file_path(ontology_acronym))
+
+
+def _get_lock_file_path(ontology_acronym):
+    return os.path.join(CACHE_FOLDER, "." + re.sub(r"[^\w.-]", "_", ontology_acronym) + ".lock")
+
+
+# Holds an advisory lock on the given lock file in the cache folder, waiting until other processes or threads release
+# it. Lock files are removed (when clearing the cache) only while locked, so a lock file that has been removed by the
+# time it is locked is no longer used, and the lock file that replaces it is locked instead
+@contextlib.contextmanager
+def _file_lock(lock_file_path):
+    with _THREAD_LOCKS_LOCK:  # file locks are held by processes, so threads of a process take a thread lock as well
+        thread_lock = _THREAD_LOCKS.setdefault(lock_file_path, threading.Lock())
+    with thread_lock:
+        while True:
+            os.makedirs(CACHE_FOLDER, exist_ok=True)
+            try:
+                lock_file = open(lock_file_path, 'a+')
+            except FileNotFoundError:  # the cache folder was removed meanwhile
+                continue
+            _lock(lock_file)
+            try:
+                if os.path.samestat(os.fstat(lock_file.fileno()), os.stat(lock_file_path)):
+                    break
+            except FileNotFoundError:
+                pass
+            _unlock(lock_file)
+            lock_file.close()
+        try:
+            yield
+        finally:
+            _unlock(lock_file)
+            lock_file.close()
+
+
+def _lock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+    else:
+        while True:
+            try:
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:  # msvcrt gives up after trying for 10 seconds
+                continue
+
+
+def _unlock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# Removes the given file, unless it cannot be removed (e.g., on Windows, a lock file that is open)
+def _remove_file(file_path):
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+    except OSError as err:
+        LOGGER.debug(f"Could not remove {file_path}: {err}")
+
+
+_THREAD_LOCKS = dict()
+_THREAD_LOCKS_LOCK = threading.Lock()
+
+
+# Reads the cache manifest, or gets an empty one if there is none
+def _read_manifest():
+    manifest = {"max_bytes": None, "ontologies": dict()}
+    manifest_file = os.path.join(CACHE_FOLDER, MANIFEST_FILE)
+    if os.path.exists(manifest_file):
+        try:
+            with open(manifest_file) as json_file:
+                manifest.update(json.load(json_file))
+        except (OSError, ValueError) as err:
+            LOGGER.warning(f"Could not read the cache manifest {manifest_file}, so it is written anew: {err}")
+    return manifest
+
+
+# Reads the cache manifest while holding its lock (whose file name cannot be that of the lock of an ontology), so that
+# it can be modified, and writes it when the context exits
+@contextlib.contextmanager
+def _update_manifest():
+    with _file_lock(os.path.join(CACHE_FOLDER, MANIFEST_FILE + ".lock")):
+        manifest = _read_manifest()
+        yield manifest
+        with onto_utils.atomic_write(os.path.join(CACHE_FOLDER, MANIFEST_FILE), 'w') as json_file:
+            json.dump(manifest, json_file, indent=2)
+
+
+# Gets the reason why the cached ontology with the given acronym and manifest entry is stale (its cache files are
+# missing or its source document has changed), or None if it is not stale or its source cannot be checked
+def _get_stale_reason(ontology_acronym, entry, check_remote):
+    source = entry.get("source")
+    if source is None:
+        return None
+    if not cache_exists(ontology_acronym):
+        return "its cache files are missing"
+    if entry.get("document_version") is None or (not os.path.exists(source) and not check_remote):
+        return None
+    try:
+        if os.path.exists(source):
+            details = get_document_version(source, entry)
+        else:
+            owl_link = bioregistry.get_owl_download(source)
+            details = get_document_version(source if owl_link is None else owl_link, dict(),
+                                           hash_remote=entry["document_version"].startswith("sha256:"))
+    except (OSError, ValueError) as err:
+        LOGGER.debug(f"Could not get the version of ontology document {source}: {err}")
+        return None
+    if details["document_version"] != entry["document_version"]:
+        return "its source document has changed"
+    if any(entry.get(key) != value for key, value in details.items()):  # modified, but not changed
+        with _update_manifest() as manifest:
+            if ontology_acronym in manifest["ontologies"]:
+                manifest["ontologies"][ontology_acronym].update(details)
+    return None
+
+
+# Removes the cache files and manifest entry of the ontology with the given acronym, unless they cannot be removed
+# (e.g., on Windows, while the ontology is in use)
+def _remove_cached_ontology(ontology_acronym):
+    LOADED_ONTOLOGIES.clear(ontology_acronym)
+    try:
+        _remove_cache_files(ontology_acronym)
+        return True
+    except OSError as err:
+        LOGGER.warning(f"Could not remove ontology {ontology_acronym} from the cache: {err}")
+        return False
+
+
+# Removes the cache files, manifest entry and lock file of the ontology with the given acronym, while holding its lock
+def _remove_cache_files(ontology_acronym):
+    with cache_lock(ontology_acronym):
+        rmtree(os.path.join(CACHE_FOLDER, ontology_acronym))
+        with _update_manifest() as manifest:
+            manifest["ontologies"].pop(ontology_acronym, None)
+        _remove_file(_get_lock_file_path(ontology_acronym))
+
+
+# Gets the acronyms of the ontologies in the cache folder
+def _get_cache_folders():
+    if not os.path.exists(CACHE_FOLDER):
+        return []
+    return [name for name in os.listdir(CACHE_FOLDER) if os.path.isdir(os.path.join(CACHE_FOLDER, name))]
+
+
+# Gets the time a cached ontology was last accessed as recorded in its manifest entry or, for ontologies cached by
+# earlier versions of text2term, the time its cache folder was last modified
+def _get_last_access(ontology_acronym, entry):
+    if "last_access" in entry:
+        return entry["last_access"]
+    cache_dir = os.path.join(CACHE_FOLDER, ontology_acronym)
+    return os.path.getmtime(cache_dir) if os.path.exists(cache_dir) else None
+
+
+def _get_folder_size(folder):
+    size = 0
+    for directory, _, files in os.walk(folder):
+        size += sum(os.path.getsize(os.path.join(directory, file)) for file in files)
+    return size
+
+
+def _to_datetime(timestamp):
+    return None if timestamp is None else datetime.datetime.fromtimestamp(timestamp)
+
+
+# Downloads the ontology document at the given URL (or that bioregistry gives for the given ontology name) to the given
+# directory, and returns its path, or returns the given path if it is that of a local file
+def _download_ontology(ontology_url, ontology_acronym, download_dir):
+    if os.path.exists(ontology_url):
+        return ontology_url
+    owl_link = bioregistry.get_owl_download(ontology_url)
+    if owl_link is not None:
+        ontology_url = owl_link
+    document_path = os.path.join(download_dir, ontology_acronym + ".owl")
+    urllib.request.urlretrieve(ontology_url, document_path)
+    return document_path
+
+
+# Deletes the given ontology document if it was downloaded to the given directory (rather than being a local file)
+def _remove_downloaded_ontology(document_path, download_dir):
+    if os.path.dirname(document_path) == download_dir and os.path.exists(document_path):
+        os.remove(document_path)
+
+
+# Caches the ontology whose download has completed, in this process
+def _cache_downloaded_ontology(download, ontology_acronym, source):
+    try:
+        return _cache_ontology(download.result(), ontology_acronym, source)
+    finally:
+        owlready2.default_world.ontologies.clear()
+
+
+# Caches the ontology in the given document, downloaded from the given source, with the given acronym, and returns the
+# caching time
+def _cache_ontology(ontology_path, ontology_acronym, source):
+    start = time.time()
+    text2term.cache_ontology(ontology_path, ontology_acronym)
+    if ontology_path != source:  # the manifest records the source rather than the (temporary) downloaded document
+        with _update_manifest() as manifest:
+            entry = manifest["ontologies"].get(ontology_acronym, dict())
+            for key in ("document_size", "document_mtime"):
+                entry.pop(key, None)
+            entry["source"] = source
+    return time.time() - start
+
+
+# Logs the outcome of caching (or downloading) an ontology as reported by the given function, which returns the caching
+# time or raises the error that caused caching to fail
+def _report_cached_ontology(row, get_result, cache_set, failures, nr_ontologies):
+    try:
+        caching_time = get_result()
+        cache_set.update({row.acronym: OntologyCache(row.acronym)})
+        LOGGER.info(f"Cached ontology {row.acronym} ({len(cache_set) + len(failures)}/{nr_ontologies}, caching time: "
+                    f"{caching_time:.2f}s)")
+    except Exception as err:
+        failures[row.acronym] = err
+        err_message = "Could not cache ontology " + row.acronym + " due to error: " + str(err)
+        sys.stderr.write(err_message)
+        LOGGER.info(f"Failed to cache ontology {row.acronym} ({len(cache_set) + len(failures)}/{nr_ontologies})")
+
+
+# Gets the hit, miss and eviction counts, the number of entries and the (estimated) bytes of the cached ontologies kept
+# loaded in memory across map_terms calls
+def memory_cache_stats():
+    return LOADED_ONTOLOGIES.stats()
+
+
+# Sets the bound on the (estimated) bytes of the cached ontologies kept loaded in memory, evicting the least recently
+# used ones as needed. A bound of 0 disables keeping cached ontologies loaded
+def set_memory_cache_size(max_bytes):
+    LOADED_ONTOLOGIES.set_max_bytes(max_bytes)
+
+
+# Clears the cached ontologies kept loaded in memory, or only those with the given acronym
+def clear_memory_cache(ontology_acronym=''):
+    LOADED_ONTOLOGIES.clear(ontology_acronym)
+
+
+class LoadedOntology:
+
+    def __init__(self, terms, version=None):
+        """
+        Ontology terms loaded from the cache (and filtered) for a map_terms call, along with the indexes and mappers
+        derived from them, which are kept so that later map_terms calls can reuse them. The size of a loaded ontology is
+        the estimated bytes of memory held by its terms and derived objects, which is updated whenever an object is
+        derived from them, and then reported to the function set as size listener (if any)
+        :param terms: Dictionary of ontology term IRIs to OntologyTerm objects
+        :param version: Version of the cached ontology the terms were loaded from (see get_cache_version)
+        """
+        self.terms = terms
+        self.version = version
+        self.size_listener = None
+        self._derived = dict()
+        self._counted = set()  # IDs of the objects whose memory has been counted in the size
+        self.size = _estimate_size(terms, self._counted)
+        self._lock = threading.Lock()
+
+    def get_derived(self, name, build):
+        """
+        Get the object (e.g., index or mapper) with the given name derived from these terms, building it on first use
+        :param name: Name of the derived object
+        :param build: Function that builds the derived object
+        :return: Derived object
+        """
+        with self._lock:
+            if name in self._derived:
+                return self._derived[name]
+            derived = self._derived[name] = build()
+            # objects shared with the terms or other derived objects (e.g., the term store of a mapper) are not counted
+            self.size += _estimate_size(derived, self._counted)
+        if self.size_listener is not None:
+            self.size_listener(self)
+        return derived
+
+
+class LoadedOntologyCache:
+
+    def __init__(self, max_bytes=DEFAULT_MEMORY_CACHE_BYTES):
+        """
+        Least recently used (LRU) cache of the ontologies loaded from the ontology cache, which are kept in memory so
+        that mapping to a cached ontology repeatedly does not load and filter its terms again each time. The size of an
+        entry is the estimated memory held by its terms and by the indexes and mappers derived from them, which grows
+        as those are built, so entries are evicted whenever an entry grows as well as when one is added
+        :param max_bytes: Bound on the total estimated size of the entries
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = dict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get the loaded ontology with the given key, and mark it as the most recently used
+        :param key: Tuple whose first element is the ontology acronym
+        :return: LoadedOntology, or None if there is no loaded ontology with the given key
+        """
+        with self._lock:
+            loaded_ontology = self._entries.get(key)
+            if loaded_ontology is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+                self._entries.move_to_end(key)
+            return loaded_ontology
+
+    def put(self, key, loaded_ontology):
+        """
+        Add the given loaded ontology, evicting the least recently used ones while the total size exceeds the bound
+        :param key: Tuple whose first element is the ontology acronym
+        :param loaded_ontology: LoadedOntology
+        """
+        with self._lock:
+            self._remove(key)
+            if loaded_ontology.size > self.max_bytes:
+                LOGGER.debug(f"Not keeping ontology {key[0]} loaded in memory: its estimated size "
+                             f"({loaded_ontology.size} bytes) exceeds the bound of the memory cache ({self.max_bytes} "
+                             f"bytes)")
+                return
+            self._entries[key] = loaded_ontology
+            self._sizes[key] = loaded_ontology.size
+            loaded_ontology.size_listener = partial(self.resize, key)
+            self._evict()
+
+    def resize(self, key, loaded_ontology):
+        """
+        Update the size of the given loaded ontology (e.g., after an index was derived from it), evicting the least
+        recently used ones while the total size exceeds the bound
+        :param key: Tuple whose first element is the ontology acronym
+        :param loaded_ontology: LoadedOntology
+        """
+        with self._lock:
+            if self._entries.get(key) is not loaded_ontology:  # evicted (or replaced) since it was added
+                return
+            self._sizes[key] = loaded_ontology.size
+            self._evict()
+
+    def set_max_bytes(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self, ontology_acronym=''):
+        with self._lock:
+            for key in list(self._entries):
+                if ontology_acronym == '' or key[0] == ontology_acronym:
+                    self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses, "evictions": self._evictions,
+                    "entries": len(self._entries), "bytes": sum(self._sizes.values()), "max_bytes": self.max_bytes}
+
+    def _evict(self):
+        while len(self._entries) > 0 and sum(self._sizes.values()) > self.max_bytes:
+            key = next(iter(self._entries))
+            LOGGER.info(f"Evicting ontology {key[0]} from the memory cache (estimated size: {self._sizes[key]} bytes)")
+            self._remove(key)
+            self._evictions += 1
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        self._sizes.pop(key, None)
+
+
+LOADED_ONTOLOGIES = LoadedOntologyCache()
+
+
+# Estimates the bytes of memory held by the given value along with the values it refers to, other than the objects whose
+# IDs are in the given set of counted objects, to which the IDs of the objects counted are added. Arrays (and sparse
+# matrices) are counted by the bytes of their buffers, except memory-mapped arrays, whose pages are not held in memory,
+# and ontology terms are counted rather than measured. Strings are not deduplicated, so shared strings are overestimated
+def _estimate_size(value, counted):
+    size = 0
+    pending = [value]
+    while len(pending) > 0:
+        value = pending.pop()
+        if isinstance(value, _ATOMIC_TYPES):
+            size += sys.getsizeof(value)
+            continue
+        if id(value) in counted:
+            continue
+        counted.add(id(value))
+        if isinstance(value, np.ndarray):
+            if not _is_memory_mapped(value):
+                size += value.nbytes
+                if value.dtype == object:
+                    pending.extend(value.ravel().tolist())
+        elif isinstance(value, OntologyTerm):
+            size += ESTIMATED_TERM_BYTES
+        elif isinstance(value, (list, tuple, set, frozenset, dict)):
+            size += sys.getsizeof(value)
+            for item in (itertools.chain(value.keys(), value.values()) if isinstance(value, dict) else value):
+                if type(item) is str:  # most items are strings, which are counted here rather than kept pending
+                    size += sys.getsizeof(item)
+                else:
+                    pending.append(item)
+        else:
+            size += sys.getsizeof(value)
+            if type(value).__module__.partition(".")[0] in _MEASURED_PACKAGES:
+                pending.extend(getattr(value, "__dict__", {}).values())
+                pending.extend(getattr(value, name) for name in getattr(type(value), "__slots__", ())
+                               if hasattr(value, name))
+    return size
+
+
+def _is_memory_mapped(array):
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, "base", None)
+    return False
+
+
 # Class that is returned to run
 class OntologyCache:
     def __init__(self, ontology_acronym):
@@ -56,12 +723,14 @@ class OntologyCache:
 
     def map_terms(self, source_terms, base_iris=(), excl_deprecated=False, max_mappings=3, min_score=0.3,
                   mapper=Mapper.TFIDF, output_file='', save_graphs=False, save_mappings=False, source_terms_ids=(),
-                  term_type=OntologyTermType.CLASS):
+                  term_type=OntologyTermType.CLASS, batch_size=0, n_jobs=1, exact_match=False, num_perm=120,
+                  bands=40):
         return text2term.map_terms(source_terms, self.acronym, base_iris=base_iris,
                                    excl_deprecated=excl_deprecated, max_mappings=max_mappings, min_score=min_score,
                                    mapper=mapper, output_file=output_file, save_graphs=save_graphs,
                                    save_mappings=save_mappings, source_terms_ids=source_terms_ids, use_cache=True,
-                                   term_type=term_type)
+                                   term_type=term_type, batch_size=batch_size, n_jobs=n_jobs,
+                                   exact_match=exact_match, num_perm=num_perm, bands=bands)
 
     def clear_cache(self):
         clear_cache(self.acronym)
@@ -1,4 +1,7 @@
+import os
+import uuid
 import logging
+import contextlib
 import pandas as pd
 import bioregistry
 import shortuuid
@@ -97,6 +100,39 @@ def _get_iri(ont_name, term_name):
     return iri
 
 
+def get_worker_count(n_jobs):
+    """
+    Get the number of parallel workers to use for the given `n_jobs` value. Negative values are relative to the number
+    of available CPUs, such that -1 uses all CPUs, -2 uses all CPUs but one, and so on
+    :param n_jobs: Number of parallel jobs requested
+    :return: Number of workers (at least 1)
+    """
+    if n_jobs is None or n_jobs == 0:
+        return 1
+    if n_jobs < 0:
+        n_jobs = (os.cpu_count() or 1) + 1 + n_jobs
+    return max(n_jobs, 1)
+
+
+@contextlib.contextmanager
+def atomic_write(file_path, mode='wb'):
+    """
+    Open a temporary file in the directory of the given file for writing, and rename it to the given file once it has
+    been written. Renaming replaces any existing file atomically, so readers of the file never see it partially written
+    :param file_path: Path of the file to write
+    :param mode: Mode in which the temporary file is opened (e.g., 'w' for text, 'wb' for binary)
+    :return: File object of the temporary file
+    """
+    temp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, mode) as out_file:
+            yield out_file
+        os.replace(temp_path, file_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
 def get_logger(name, level=logging.INFO):
     formatter = logging.Formatter("%(asctime)s %(levelname)s [%(name)s]: %(message)s", "%Y-%m-%d %H:%M:%S")
     logger = logging.getLogger(name)
@@ -2,55 +2,137 @@
 
 import logging
 import nltk
+import numpy as np
 import rapidfuzz
+from scipy.sparse import csr_matrix
 from tqdm import tqdm
 from text2term import onto_utils
 from text2term.mapper import Mapper
 from text2term.term_mapping import TermMapping, TermMappingCollection
+from text2term.term_store import get_term_store
+
+# Maximum number of (source term, ontology term label/synonym) similarity scores computed at a time
+SCORE_BATCH_SIZE = 10000000
+
+# rapidfuzz scorers of the mappers computed via rapidfuzz.process.cdist, and the factors that scale their scores to 0-1
+RAPIDFUZZ_SCORERS = {
+    Mapper.LEVENSHTEIN: (rapidfuzz.distance.Levenshtein.normalized_similarity, 1),
+    Mapper.JARO: (rapidfuzz.distance.Jaro.normalized_similarity, 1),
+    Mapper.JARO_WINKLER: (rapidfuzz.distance.JaroWinkler.normalized_similarity, 1),
+    Mapper.INDEL: (rapidfuzz.distance.Indel.normalized_similarity, 1),
+    Mapper.FUZZY: (rapidfuzz.fuzz.WRatio, 100)
+}
 
 
 class SyntacticMapper:
 
     def __init__(self, target_ontology_terms):
         """
-        :param target_ontology_terms: Collection of ontology terms to be mapped against
+        :param target_ontology_terms: OntologyTermStore, or dictionary of ontology terms, to be mapped against
         """
         self.logger = onto_utils.get_logger(__name__, logging.INFO)
         self.target_ontology_terms = target_ontology_terms
+        self.term_store = get_term_store(target_ontology_terms)
+        self._names = self.term_store.names
+        # The names (labels and synonyms) of each term are contiguous, so the scores of a term are the maximum over a
+        # run of columns of the name scores. Terms without names are left out of these runs and get a score of 0
+        self._named_term_ids = np.flatnonzero(np.diff(self.term_store.name_offsets))
+        self._name_offsets = self.term_store.name_offsets[self._named_term_ids]
+        self._name_char_sets = None
 
-    def map(self, source_terms, source_terms_ids, mapper=Mapper.JARO_WINKLER, max_mappings=3):
+    def map(self, source_terms, source_terms_ids, mapper=Mapper.JARO_WINKLER, max_mappings=3, min_score=0.0, n_jobs=1):
         """
         :param source_terms: List of source terms to be mapped with ontology terms
         :param source_terms_ids: List of identifiers for the given source terms
         :param mapper: Mapping method to be used for matching
         :param max_mappings: Maximum number of (top scoring) ontology term mappings that should be returned
+        :param min_score: Minimum score [0,1] for the mappings returned. Comparisons of a source term with an ontology
+                          term label or synonym are abandoned as soon as their score is known to be below min_score
+        :param n_jobs: Number of threads used to compute similarity scores. Negative values are relative to the number
+                       of CPUs, so -1 uses all CPUs
         """
+        if mapper != Mapper.JACCARD and mapper not in RAPIDFUZZ_SCORERS:
+            raise ValueError("Unsupported mapping method: " + str(mapper))
+        workers = onto_utils.get_worker_count(n_jobs)
+        batch_size = max(1, SCORE_BATCH_SIZE // max(len(self._names), 1))
         mappings = []
-        for term, term_id in tqdm(zip(source_terms, source_terms_ids), total=len(source_terms)):
-            matches = self._map(term, term_id, mapper, max_mappings)
-            mappings.extend(matches)
+        with tqdm(total=len(source_terms)) as progress:
+            for start in range(0, len(source_terms), batch_size):
+                batch = source_terms[start:start + batch_size]
+                term_scores = self._get_term_scores(batch, mapper, min_score, workers)
+                rows, term_ids, scores = self._get_top_terms(term_scores, max_mappings, min_score)
+                for row, term_id, score in zip(rows.tolist(), term_ids.tolist(), scores.tolist()):
+                    mappings.append(TermMapping(batch[row], source_terms_ids[start + row],
+                                                self.term_store.labels[term_id], self.term_store.iris[term_id], score))
+                progress.update(len(batch))
         return TermMappingCollection(mappings).mappings_df()
 
-    def _map(self, source_term, source_term_id, mapper, max_matches=3):
-        self.logger.debug("Matching %s...", source_term)
-        term_matches = []
-        for term in self.target_ontology_terms.values():
-            highest_similarity = 0.0
-            for target_name in self._term_names(term):
-                similarity = self.compare(source_term, target_name, mapper)
-                self.logger.debug("%s -> %s (%.2f)", source_term, target_name, similarity)
-                if similarity > highest_similarity:
-                    highest_similarity = similarity
-            term_matches.append(TermMapping(source_term, source_term_id, term.label, term.iri, highest_similarity))
-        matches_sorted = sorted(term_matches, key=lambda x: x.mapping_score, reverse=True)
-        del matches_sorted[max_matches:]
-        return matches_sorted
-
-    def _term_names(self, ontology_term):
-        lbls_syns = []
-        lbls_syns.extend(ontology_term.labels)
-        lbls_syns.extend(ontology_term.synonyms)
-        return lbls_syns
+    def _get_term_scores(self, source_terms, mapper, min_score, workers):
+        # Array with the highest similarity score between each source term (rows) and the names of each term (columns)
+        term_scores = np.zeros((len(source_terms), len(self.term_store)))
+        if len(self._names) == 0 or len(source_terms) == 0:
+            return term_scores
+        if mapper == Mapper.JACCARD:
+            name_scores = self._jaccard_similarities(source_terms)
+        else:
+            scorer, scale = RAPIDFUZZ_SCORERS[mapper]
+            # rapidfuzz returns 0 for the comparisons whose score is below the score cutoff
+            name_scores = rapidfuzz.process.cdist(source_terms, self._names, scorer=scorer, dtype=np.float64,
+                                                  score_cutoff=min_score * scale, workers=workers)
+            if scale != 1:
+                name_scores /= scale
+        term_scores[:, self._named_term_ids] = np.maximum.reduceat(name_scores, self._name_offsets, axis=1)
+        return term_scores
+
+    @staticmethod
+    def _get_top_terms(term_scores, max_matches, min_score):
+        # Get the (at most) max_matches top scoring terms of each row (source term) with a score of at least min_score,
+        # as arrays of rows, term ids and scores sorted by row and then by decreasing score. Terms with tied scores are
+        # kept in the order of the ontology terms. Rather than sorting whole rows, only the terms scoring at least the
+        # max_matches-th highest score of their row, found via a partial sort, are sorted
+        nr_terms = term_scores.shape[1]
+        if max_matches <= 0 or nr_terms == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        if max_matches < nr_terms:
+            thresholds = -np.partition(-term_scores, max_matches - 1, axis=1)[:, max_matches - 1]
+        else:
+            thresholds = term_scores.min(axis=1)
+        rows, term_ids = np.nonzero(term_scores >= np.maximum(thresholds, min_score)[:, None])
+        scores = term_scores[rows, term_ids]
+        order = np.lexsort((term_ids, -scores, rows))
+        rows, term_ids, scores = rows[order], term_ids[order], scores[order]
+        ranks = np.arange(len(rows)) - np.searchsorted(rows, rows)
+        top = ranks < max_matches
+        return rows[top], term_ids[top], scores[top]
+
+    def _jaccard_similarities(self, source_terms):
+        # Jaccard similarity of the character sets of each source term and each name, via the sizes of their
+        # intersections, which are the entries of the product of binary (string x character) matrices
+        if self._name_char_sets is None:
+            self._name_char_vocabulary = dict()
+            self._name_char_sets = self._get_char_sets(self._names, self._name_char_vocabulary, extend=True)
+        source_char_sets = self._get_char_sets(source_terms, self._name_char_vocabulary)
+        intersections = (source_char_sets @ self._name_char_sets.T).toarray()
+        source_sizes = np.array([len(set(term)) for term in source_terms], dtype=np.float64)
+        name_sizes = np.asarray(self._name_char_sets.sum(axis=1), dtype=np.float64).ravel()
+        unions = source_sizes[:, None] + name_sizes[None, :] - intersections
+        distances = np.divide(unions - intersections, unions, out=np.ones_like(unions), where=unions > 0)
+        return 1 - distances
+
+    @staticmethod
+    def _get_char_sets(strings, vocabulary, extend=False):
+        # Binary sparse matrix with one row per string and one column per character in the given vocabulary. Unless
+        # extend is True, characters that are not in the vocabulary are left out
+        indptr, indices = [0], []
+        for string in strings:
+            for char in set(string):
+                if extend:
+                    indices.append(vocabulary.setdefault(char, len(vocabulary)))
+                elif char in vocabulary:
+                    indices.append(vocabulary[char])
+            indptr.append(len(indices))
+        return csr_matrix((np.ones(len(indices), dtype=np.float64), indices, indptr),
+                          shape=(len(strings), max(len(vocabulary), 1)))
 
     def compare(self, s1, s2, mapper):
         """
@@ -95,7 +177,7 @@ class SyntacticMapper:
         Calculates the Jaro-Winkler similarity between s1 and s2.
         :return similarity between s1 and s2 as a float between 0 and 1
         """
-        similarity = rapidfuzz.distance.Jaro.normalized_similarity(s1, s2)
+        similarity = rapidfuzz.distance.JaroWinkler.normalized_similarity(s1, s2)
         return similarity
 
     def compare_indel(self, s1, s2):
@@ -8,13 +8,18 @@ import pandas as pd
 from text2term import onto_utils
 from text2term import onto_cache
 from text2term.mapper import Mapper
-from text2term.term import OntologyTermType
+from text2term.term import OntologyTermType, TERM_FIELDS, MAPPING_FIELDS, GRAPH_FIELDS
 from text2term.term_collector import OntologyTermCollector
 from text2term.term_collector import filter_terms
 from text2term.term_graph_generator import TermGraphGenerator
 from text2term.bioportal_mapper import BioPortalAnnotatorMapper
 from text2term.syntactic_mapper import SyntacticMapper
-from text2term.tfidf_mapper import TFIDFMapper
+from text2term.tfidf_mapper import TFIDFMapper, TFIDFIndex
+from text2term.lsh_index import MinHashLSHIndex
+from text2term.label_index import LabelIndex
+from text2term.columnar_terms import ColumnarOntologyTerms
+from text2term.term_store import get_term_store
+from text2term.curie_resolver import CurieResolver, CURIE_RESOLVER
 from text2term.zooma_mapper import ZoomaMapper
 from text2term.config import VERSION
 from text2term.tagged_term import TaggedTerm
@@ -31,7 +36,8 @@ LOGGER = onto_utils.get_logger(__name__, level=logging.INFO)
 def map_terms(source_terms, target_ontology, base_iris=(), csv_columns=(), excl_deprecated=False, max_mappings=3,
               min_score=0.3, mapper=Mapper.TFIDF, output_file='', save_graphs=False, save_mappings=False,
               source_terms_ids=(), separator=',', use_cache=False, term_type=OntologyTermType.CLASS,
-              incl_unmapped=False, bioportal_apikey=""):
+              incl_unmapped=False, bioportal_apikey="", batch_size=0, n_jobs=1, exact_match=False, quadstore_dir=None,
+              num_perm=120, bands=40):
     """
     Maps the terms in the given list to the specified target ontology.
 
@@ -56,7 +62,7 @@ def map_terms(source_terms, target_ontology, base_iris=(), csv_columns=(), excl_
         Exclude ontology terms stated as deprecated via `owl:deprecated true`
     mapper : mapper.Mapper
         Method used to compare source terms with ontology terms. One of: levenshtein, jaro, jarowinkler, jaccard,
-        fuzzy, tfidf, zooma, bioportal
+        fuzzy, tfidf, lsh, zooma, bioportal
     max_mappings : int
         Maximum number of top-ranked mappings returned per source term
     min_score : float
@@ -77,6 +83,22 @@ def map_terms(source_terms, target_ontology, base_iris=(), csv_columns=(), excl_
         Include unmapped terms in the output data frame
     bioportal_apikey : str
         BioPortal API Key to use along with the BioPortal mapper option
+    batch_size : int
+        Number of source terms mapped at a time by the TF-IDF mapper, to bound memory use when mapping large numbers of
+        source terms (0 maps all source terms at once)
+    n_jobs : int
+        Number of threads used by the mapper (-1 uses all CPUs)
+    exact_match : bool
+        Map source terms that exactly match a label or synonym of an ontology term (after normalization) with a score
+        of 1, and use the mapper only for the remaining source terms
+    quadstore_dir : str
+        Directory where the target ontology is kept in a persistent owlready2 quadstore, so that it is parsed only the
+        first time it is loaded (and whenever the ontology document changes). Not used when `use_cache=True`
+    num_perm : int
+        Number of hash functions in the MinHash signatures of the ontology labels used by the LSH mapper
+    bands : int
+        Number of bands the MinHash signatures are split into by the LSH mapper, which must divide `num_perm`. More
+        bands find more candidate labels for each source term, so fewer mappings are missed, at the cost of speed
 
     Returns
     ----------
@@ -95,15 +117,42 @@ def map_terms(source_terms, target_ontology, base_iris=(), csv_columns=(), excl_
     if output_file == '':
         timestamp = datetime.datetime.now().strftime("%d-%m-%YT%H-%M-%S")
         output_file = "t2t-mappings-" + timestamp + ".csv"
-    # Load the ontology for either Zooma, Bioportal, or directly
+    # Load the ontology for either Zooma, Bioportal, or directly. Ontologies loaded from the cache are kept in memory
+    # along with the term store, indexes and mappers built for them, for use in later calls. The mappers and the graph
+    # generator use the store of the ontology terms
+    loaded_ontology = None
+    fields = MAPPING_FIELDS + GRAPH_FIELDS if save_graphs else MAPPING_FIELDS
     if mapper in {Mapper.ZOOMA, Mapper.BIOPORTAL}:
         target_terms = '' if target_ontology.lower() == 'all' else target_ontology
+    elif use_cache:
+        loaded_ontology = _get_loaded_ontology(target_ontology, base_iris, excl_deprecated, term_type, fields)
+        target_terms = loaded_ontology.get_derived("term_store", lambda: get_term_store(loaded_ontology.terms))
     else:
-        target_terms = _load_ontology(target_ontology, base_iris, excl_deprecated, use_cache, term_type)
+        target_terms = get_term_store(_load_ontology(target_ontology, base_iris, excl_deprecated, use_cache, term_type,
+                                                     quadstore_dir, fields), fields)
+    # Load the TF-IDF (and LSH) index of the ontology labels if it has been cached along with the ontology
+    tfidf_index, lsh_index = None, None
+    if loaded_ontology is not None and mapper in {Mapper.TFIDF, Mapper.LSH}:
+        tfidf_index = loaded_ontology.get_derived("tfidf_index", lambda: _load_tfidf_index(target_ontology))
+        if mapper == Mapper.LSH and tfidf_index is not None:
+            lsh_index = loaded_ontology.get_derived(f"lsh_index-{num_perm}-{bands}", lambda: _load_lsh_index(
+                target_ontology, tfidf_index, loaded_ontology.version, num_perm, bands))
+    # Load (or build) the index of normalized labels and synonyms used to map exact matches ahead of the mapper
+    label_index = None
+    if exact_match:
+        if mapper in {Mapper.ZOOMA, Mapper.BIOPORTAL}:
+            LOGGER.warning("Exact matching of source terms requires the target ontology terms, so it is not done when "
+                           "using the Zooma or BioPortal mappers")
+        elif loaded_ontology is not None:
+            label_index = loaded_ontology.get_derived("label_index", lambda: _load_label_index(target_ontology) or
+                                                      LabelIndex.build(target_terms))
+        else:
+            label_index = LabelIndex.build(target_terms)
     # Run the mapper
     LOGGER.info(f"Mapping {len(source_terms)} source terms to {target_ontology}")
     mappings_df = _do_mapping(source_terms, source_terms_ids, target_terms, mapper, max_mappings, min_score, tags,
-                              incl_unmapped, bioportal_apikey)
+                              incl_unmapped, bioportal_apikey, tfidf_index, batch_size, n_jobs, lsh_index,
+                              label_index, loaded_ontology, num_perm, bands)
     if not mappings_df.empty:
         mappings_df["Mapping Score"] = mappings_df["Mapping Score"].astype(float).round(decimals=3)
     if save_mappings:
@@ -114,18 +163,39 @@ def map_terms(source_terms, target_ontology, base_iris=(), csv_columns=(), excl_
     return mappings_df
 
 
-# Caches a single ontology
+# Caches a single ontology. Each cache file is written to a temporary file that then replaces it, and the ontology terms
+# are written last, so a cached ontology is used only once all its files have been written. Callers caching the same
+# ontology concurrently wait for the one caching it, and then use the ontology it cached
 def cache_ontology(ontology_url, ontology_acronym="", base_iris=()):
     if ontology_acronym == "":
         ontology_acronym = ontology_url
-    ontology_terms = _load_ontology(ontology_url, base_iris, exclude_deprecated=False, term_type=OntologyTermType.ANY)
     cache_dir = os.path.join("cache", ontology_acronym)
-    LOGGER.info(f"Caching ontology {ontology_url} to: {cache_dir}")
-    if not os.path.exists(cache_dir):
-        os.makedirs(cache_dir)
-    _serialize_ontology(ontology_terms, ontology_acronym, cache_dir)
-    _save_graphs(ontology_terms, output_file=os.path.join(cache_dir, ontology_acronym))
+    cached_version = onto_cache.get_cache_version(ontology_acronym)
+    with onto_cache.cache_lock(ontology_acronym):
+        if onto_cache.get_cache_version(ontology_acronym) not in {cached_version, None}:
+            LOGGER.info(f"Ontology {ontology_url} was cached to {cache_dir} while waiting to cache it")
+            return onto_cache.OntologyCache(ontology_acronym)
+        document_details = onto_cache.get_document_details(ontology_url)
+        ontology_terms = _load_ontology(ontology_url, base_iris, exclude_deprecated=False,
+                                        term_type=OntologyTermType.ANY)
+        term_store = get_term_store(ontology_terms)
+        LOGGER.info(f"Caching ontology {ontology_url} to: {cache_dir}")
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        TFIDFIndex.build(term_store).save(os.path.join(cache_dir, ontology_acronym + "-tfidf-index.pickle"))
+        LabelIndex.build(term_store).save(os.path.join(cache_dir, ontology_acronym + "-label-index.pickle"))
+        curie_resolver = CurieResolver()
+        curie_resolver.get_curies(term_store.iris)
+        curie_resolver.save(os.path.join(cache_dir, ontology_acronym + "-curie-namespaces.json"))
+        CURIE_RESOLVER.update(curie_resolver)
+        _save_graphs(term_store, output_file=os.path.join(cache_dir, ontology_acronym))
+        lsh_index_file = os.path.join(cache_dir, ontology_acronym + "-lsh-index.pickle")
+        if os.path.exists(lsh_index_file):  # built from the TF-IDF index replaced above, so it is built again when used
+            os.remove(lsh_index_file)
+        ColumnarOntologyTerms.build(ontology_terms).save(os.path.join(cache_dir, ontology_acronym + "-terms"))
+        onto_cache.record_cached_ontology(ontology_acronym, ontology_url, base_iris, document_details)
     ontology_terms.clear()
+    onto_cache.gc_cache(keep=(ontology_acronym,))
     return onto_cache.OntologyCache(ontology_acronym)
 
 
@@ -160,11 +230,6 @@ def _parse_source_terms(source_terms, source_terms_ids=(), csv_columns=(), separ
     return terms, source_terms_ids, tags
 
 
-def _serialize_ontology(ontology_terms, ontology_acronym, cache_dir):
-    with open(os.path.join(cache_dir, ontology_acronym + "-term-details.pickle"), 'wb+') as out_file:
-        pickle.dump(ontology_terms, out_file)
-
-
 def _load_data(input_file_path, csv_column_names, separator):
     if len(csv_column_names) >= 1:
         term_id_col_name = ""
@@ -179,17 +244,27 @@ def _load_data(input_file_path, csv_column_names, separator):
     return terms, term_ids
 
 
-def _load_ontology(ontology, iris, exclude_deprecated, use_cache=False, term_type=OntologyTermType.CLASS):
-    if use_cache:
+# Loads the given fields (out of TERM_FIELDS) of the ontology terms. The other fields of cached ontology terms are
+# loaded when first used (and terms cached as a pickle by earlier versions of text2term have all their fields), while
+# those of ontology terms collected from the ontology are no longer available
+def _load_ontology(ontology, iris, exclude_deprecated, use_cache=False, term_type=OntologyTermType.CLASS,
+                   quadstore_dir=None, fields=TERM_FIELDS):
+    if use_cache and os.path.exists(os.path.join("cache", ontology, ontology + "-terms")):
+        terms_dir = os.path.join("cache", ontology, ontology + "-terms")
+        LOGGER.info(f"Loading cached ontology from: {terms_dir}")
+        onto_terms = filter_terms(ColumnarOntologyTerms.load(terms_dir), iris, exclude_deprecated, term_type)
+        _load_curie_namespaces(ontology)
+    elif use_cache:
         pickle_file = os.path.join("cache", ontology, ontology + "-term-details.pickle")
         LOGGER.info(f"Loading cached ontology from: {pickle_file}")
         with open(pickle_file, "rb") as cached_ontology_pickle:
             onto_terms_unfiltered = pickle.load(cached_ontology_pickle)
             onto_terms = filter_terms(onto_terms_unfiltered, iris, exclude_deprecated, term_type)
+        _load_curie_namespaces(ontology)
     else:
-        term_collector = OntologyTermCollector(ontology_iri=ontology)
+        term_collector = OntologyTermCollector(ontology_iri=ontology, quadstore_dir=quadstore_dir)
         onto_terms = term_collector.get_ontology_terms(base_iris=iris, exclude_deprecated=exclude_deprecated,
-                                                       term_type=term_type)
+                                                       term_type=term_type, fields=fields)
         term_collector.close()
     LOGGER.info(f"Filtered ontology terms to those of type: {term_type}")
     if len(onto_terms) == 0:
@@ -197,27 +272,133 @@ def _load_ontology(ontology, iris, exclude_deprecated, use_cache=False, term_typ
     return onto_terms
 
 
+# Gets the cached ontology terms filtered as specified from the memory cache of loaded ontologies, or loads them from
+# the ontology cache and keeps them in the memory cache. Entries are keyed on the time the cached terms were last
+# modified, so an ontology that is cached again (e.g., because its local source document has changed) is loaded again.
+# Whether the source document has changed is checked when the ontology is not loaded in memory, and otherwise at most
+# every STALENESS_CHECK_INTERVAL seconds
+def _get_loaded_ontology(ontology, iris, exclude_deprecated, term_type, fields):
+    onto_cache.record_cache_access(ontology)
+    loaded_ontology = onto_cache.LOADED_ONTOLOGIES.get(_get_loaded_ontology_key(ontology, iris, exclude_deprecated,
+                                                                                 term_type))
+    if (loaded_ontology is None or onto_cache.is_staleness_check_due(ontology)) and \
+            onto_cache.refresh_cache(ontology, check_remote=False):
+        loaded_ontology = None
+    if loaded_ontology is None:
+        key = _get_loaded_ontology_key(ontology, iris, exclude_deprecated, term_type)
+        loaded_ontology = onto_cache.LoadedOntology(_load_ontology(ontology, iris, exclude_deprecated, use_cache=True,
+                                                                   term_type=term_type, fields=fields), key[1])
+        onto_cache.LOADED_ONTOLOGIES.put(key, loaded_ontology)
+    else:
+        LOGGER.info(f"Using ontology {ontology} already loaded from the cache")
+    return loaded_ontology
+
+
+def _get_loaded_ontology_key(ontology, iris, exclude_deprecated, term_type):
+    iris = iris if isinstance(iris, str) else tuple(iris)
+    return ontology, onto_cache.get_cache_version(ontology), iris, exclude_deprecated, term_type
+
+
+def _load_tfidf_index(ontology):
+    index_file = os.path.join("cache", ontology, ontology + "-tfidf-index.pickle")
+    if not os.path.exists(index_file):
+        LOGGER.debug(f"No cached TF-IDF index found for {ontology}")
+        return None
+    LOGGER.info(f"Loading cached TF-IDF index from: {index_file}")
+    return TFIDFIndex.load(index_file)
+
+
+def _load_label_index(ontology):
+    index_file = os.path.join("cache", ontology, ontology + "-label-index.pickle")
+    if not os.path.exists(index_file):
+        LOGGER.debug(f"No cached label index found for {ontology}")
+        return None
+    LOGGER.info(f"Loading cached label index from: {index_file}")
+    return LabelIndex.load(index_file)
+
+
+# Loads the CURIE prefixes of the IRI namespaces of a cached ontology, which were resolved when it was cached, into the
+# CURIE resolver shared by the mappers
+def _load_curie_namespaces(ontology):
+    namespaces_file = os.path.join("cache", ontology, ontology + "-curie-namespaces.json")
+    if os.path.exists(namespaces_file):
+        LOGGER.debug(f"Loading cached CURIE namespaces from: {namespaces_file}")
+        CURIE_RESOLVER.update(CurieResolver.load(namespaces_file))
+
+
+# Loads the MinHash LSH index of the labels in the given TF-IDF index, loaded from the given version of the cached
+# ontology, building and caching it on first use (or when it was cached with other MinHash parameters). This is done
+# while holding the cache lock of the ontology, and the index is only loaded or cached if the ontology has not been
+# cached again since the TF-IDF index was loaded, since caching it again replaces its TF-IDF index
+def _load_lsh_index(ontology, tfidf_index, cache_version, num_perm=120, bands=40):
+    index_file = os.path.join("cache", ontology, ontology + "-lsh-index.pickle")
+    with onto_cache.cache_lock(ontology):
+        is_current = cache_version is not None and onto_cache.get_cache_version(ontology) == cache_version
+        if is_current and os.path.exists(index_file):
+            LOGGER.info(f"Loading cached MinHash LSH index from: {index_file}")
+            lsh_index = MinHashLSHIndex.load(index_file)
+            if (lsh_index.num_perm, lsh_index.bands) == (num_perm, bands):
+                return lsh_index
+        LOGGER.info(f"Building MinHash LSH index of {len(tfidf_index.labels)} labels")
+        lsh_index = MinHashLSHIndex.build(tfidf_index.label_counts, num_perm=num_perm, bands=bands)
+        if is_current:
+            LOGGER.info(f"Caching MinHash LSH index to: {index_file}")
+            lsh_index.save(index_file)
+    return lsh_index
+
+
 def _do_mapping(source_terms, source_term_ids, ontology_terms, mapper, max_mappings, min_score, tags, incl_unmapped,
-                bioportal_apikey):
-    to_map, tags = _process_tags(source_terms, tags)
+                bioportal_apikey, tfidf_index=None, batch_size=0, n_jobs=1, lsh_index=None, label_index=None,
+                loaded_ontology=None, num_perm=120, bands=40):
+    start_tags = time.time()
+    to_map, to_map_ids, tags = _process_tags(source_terms, source_term_ids, tags)
+    LOGGER.debug("Processed the tags of %d source terms (processing time: %.2fs seconds)", len(source_terms),
+                 time.time() - start_tags)
     start = time.time()
-    if mapper == Mapper.TFIDF:
-        term_mapper = TFIDFMapper(ontology_terms)
-        mappings_df = term_mapper.map(to_map, source_term_ids, max_mappings=max_mappings, min_score=min_score)
+    exact_mappings_df = pd.DataFrame()
+    if label_index is not None:
+        nr_to_map = len(to_map)
+        exact_mappings_df, to_map, to_map_ids = label_index.map(to_map, to_map_ids, ontology_terms, max_mappings)
+        LOGGER.info(f"Mapped {nr_to_map - len(to_map)} of {nr_to_map} source terms by exact match of a label or "
+                    f"synonym; mapping the remaining {len(to_map)} source terms with the {mapper.value} mapper")
+    # Map each distinct source term once. The TF-IDF based mappers compare normalized source terms, so source terms
+    # that are the same when normalized get the same mappings; the other mappers compare source terms as given
+    source_terms_to_map = to_map
+    to_map, term_indexes = _deduplicate_terms(to_map, onto_utils.normalize if mapper in {Mapper.TFIDF, Mapper.LSH}
+                                              else None)
+    if len(to_map) < len(source_terms_to_map):
+        LOGGER.info(f"Mapping {len(to_map)} distinct source terms out of {len(source_terms_to_map)} "
+                    f"(deduplication ratio: {len(source_terms_to_map) / len(to_map):.2f})")
+    distinct_term_ids = list(range(len(to_map)))
+    if len(to_map) == 0:
+        mappings_df = pd.DataFrame()
+    elif mapper in {Mapper.TFIDF, Mapper.LSH}:
+        mapper_name = mapper.value if mapper == Mapper.TFIDF else f"{mapper.value}-{num_perm}-{bands}"
+        term_mapper = _get_term_mapper(loaded_ontology, mapper_name, lambda: TFIDFMapper(
+            ontology_terms, tfidf_index=tfidf_index, lsh_index=lsh_index))
+        mappings_df = term_mapper.map(to_map, distinct_term_ids, max_mappings=max_mappings, min_score=min_score,
+                                      batch_size=batch_size, n_jobs=n_jobs, approximate=mapper == Mapper.LSH,
+                                      num_perm=num_perm, bands=bands)
     elif mapper == Mapper.ZOOMA:
         term_mapper = ZoomaMapper()
-        mappings_df = term_mapper.map(to_map, source_term_ids, ontologies=ontology_terms, max_mappings=max_mappings)
+        mappings_df = term_mapper.map(to_map, distinct_term_ids, ontologies=ontology_terms,
+                                      max_mappings=max_mappings)
     elif mapper == Mapper.BIOPORTAL:
         if bioportal_apikey == "":
             LOGGER.error("A BioPortal API Key must be specified via the parameter `bioportal_apikey`")
             return pd.DataFrame()
         term_mapper = BioPortalAnnotatorMapper(bioportal_apikey)
-        mappings_df = term_mapper.map(to_map, source_term_ids, ontologies=ontology_terms, max_mappings=max_mappings)
+        mappings_df = term_mapper.map(to_map, distinct_term_ids, ontologies=ontology_terms,
+                                      max_mappings=max_mappings)
     elif mapper in {Mapper.LEVENSHTEIN, Mapper.JARO, Mapper.JARO_WINKLER, Mapper.INDEL, Mapper.FUZZY, Mapper.JACCARD}:
-        term_mapper = SyntacticMapper(ontology_terms)
-        mappings_df = term_mapper.map(to_map, source_term_ids, mapper, max_mappings=max_mappings)
+        term_mapper = _get_term_mapper(loaded_ontology, "syntactic", lambda: SyntacticMapper(ontology_terms))
+        mappings_df = term_mapper.map(to_map, distinct_term_ids, mapper, max_mappings=max_mappings, min_score=min_score,
+                                      n_jobs=n_jobs)
     else:
         raise ValueError("Unsupported mapper: " + mapper)
+    mappings_df = _expand_mappings(mappings_df, source_terms_to_map, to_map_ids, term_indexes)
+    if not exact_mappings_df.empty:
+        mappings_df = pd.concat([exact_mappings_df, mappings_df], ignore_index=True)
     LOGGER.info("...done (mapping time: %.2fs seconds)", time.time() - start)
 
     # Filter terms by the mapping score specified
@@ -246,40 +427,80 @@ def _do_mapping(source_terms, source_term_ids, ontology_terms, mapper, max_mappi
     return mappings_df
 
 
+# Gets the mapper built by the given function, or the one built earlier for the given loaded ontology
+def _get_term_mapper(loaded_ontology, name, build):
+    if loaded_ontology is None:
+        return build()
+    return loaded_ontology.get_derived(name + "_mapper", build)
+
+
 # Takes in the tags and source terms and processes them accordingly
-def _process_tags(source_terms, tags):
+def _process_tags(source_terms, source_term_ids, tags):
     to_map = []
+    to_map_ids = []
     # IGNORE TAGS SECTION
+    term_tags = tags if isinstance(tags, dict) else _get_tagged_term_tags(tags)
+    for term, term_id in zip(source_terms, source_term_ids):
+        if _is_ignored(term_tags[term]):
+            continue
+        to_map.append(term)
+        to_map_ids.append(term_id)
+    return to_map, to_map_ids, tags
+
+
+# Gets a dictionary of the terms of the given tagged terms to the tags of the first tagged term of each term
+def _get_tagged_term_tags(tagged_terms):
+    term_tags = dict()
+    for tagged_term in tagged_terms:
+        term_tags.setdefault(tagged_term.get_term(), tagged_term.get_tags())
+    return term_tags
+
+
+def _is_ignored(term_tags):
+    if isinstance(term_tags, list):
+        return any(tag in IGNORE_TAGS for tag in term_tags)
+    return term_tags in IGNORE_TAGS
+
+
+# Gets the distinct source terms, optionally compared by the given key function (eg onto_utils.normalize), and the
+# index of the distinct term of each source term
+def _deduplicate_terms(source_terms, key=None):
+    distinct_terms = []
+    distinct_term_indexes = dict()
+    term_indexes = []
     for term in source_terms:
-        if isinstance(tags, dict):
-            term_tags = tags[term]
-        else:
-            for tag in tags:
-                if tag.get_term() == term:
-                    term_tags = tag.get_tags()
-                    break
-        if isinstance(term_tags, list):
-            if not any(tag in IGNORE_TAGS for tag in term_tags):
-                to_map.append(term)
-        else:
-            if term_tags not in IGNORE_TAGS:
-                to_map.append(term)
-    return to_map, tags
+        term_key = term if key is None else key(term)
+        if term_key not in distinct_term_indexes:
+            distinct_term_indexes[term_key] = len(distinct_terms)
+            distinct_terms.append(term)
+        term_indexes.append(distinct_term_indexes[term_key])
+    return distinct_terms, term_indexes
+
+
+# Expands the mappings of distinct source terms, whose Source Term IDs are the indexes of the distinct terms, to
+# mappings of each of the given source terms and their IDs, in the order of the source terms
+def _expand_mappings(mappings_df, source_terms, source_term_ids, term_indexes):
+    if mappings_df.empty:
+        return mappings_df
+    sources_df = pd.DataFrame({"Distinct Term Index": term_indexes, TermMapping.SRC_TERM_ID: source_term_ids,
+                               TermMapping.SRC_TERM: source_terms})
+    distinct_mappings_df = mappings_df.drop(columns=TermMapping.SRC_TERM).rename(
+        columns={TermMapping.SRC_TERM_ID: "Distinct Term Index"})
+    expanded_df = sources_df.merge(distinct_mappings_df, on="Distinct Term Index", how="inner", sort=False)
+    return expanded_df[mappings_df.columns]
 
 
+# Adds a column with the tags of the source term of each mapping, joined by commas. The tags of each source term are
+# joined once and mapped to the mappings via a dictionary, rather than by scanning the mappings for each source term
 def _add_tags_to_df(df, tags):
     if isinstance(tags, dict):
-        for key, value in tags.items():
-            if isinstance(value, list):
-                to_store = ','.join(value)
-            else:
-                to_store = str(value)
-            df.loc[df['Source Term'] == key, "Tags"] = to_store
+        joined_tags = {key: ','.join(value) if isinstance(value, list) else str(value) for key, value in tags.items()}
     else:
-        for term in tags:
-            to_store = ','.join(term.get_tags())
-            df.loc[df['Source Term'] == term.get_term(), "Tags"] = to_store
-    return df
+        # tagged terms of the same source term overwrite the tags of the ones before them
+        joined_tags = {term.get_term(): ','.join(term.get_tags()) for term in tags}
+    if not joined_tags:
+        return df
+    return df.assign(Tags=df['Source Term'].map(joined_tags))
 
 
 def _filter_mappings(mappings_df, min_score):
@@ -289,38 +510,50 @@ def _filter_mappings(mappings_df, min_score):
     return new_df
 
 
+# Adds a mapping without a mapped term for each source term that has no mappings, all of them in a single data frame
 def _add_unmapped_terms(mappings_df, tags, source_terms, source_terms_ids):
     if mappings_df.size == 0:
-        mapped = []
+        mapped = set()
         mappings_df = pd.DataFrame(columns=OUTPUT_COLUMNS)
     else:
-        mapped = pd.unique(mappings_df["Source Term"])
-    for (term, term_id) in zip(source_terms, source_terms_ids):
-        if term not in mapped:
-            non_mapping = TermMapping(term, term_id, "", "", 0)
-            _add_tag(tags, term, UNMAPPED_TAG, ignore=True)
-            mappings_df.loc[len(mappings_df.index)] = non_mapping.to_dict()
-    return mappings_df
+        mapped = set(mappings_df["Source Term"])
+    unmapped = [(term, term_id) for term, term_id in zip(source_terms, source_terms_ids) if term not in mapped]
+    if len(unmapped) == 0:
+        return mappings_df
+    unmapped_terms, unmapped_term_ids = map(list, zip(*unmapped))
+    _add_tag(tags, unmapped_terms, UNMAPPED_TAG, ignore=True)
+    unmapped_df = pd.DataFrame({TermMapping.SRC_TERM_ID: unmapped_term_ids, TermMapping.SRC_TERM: unmapped_terms,
+                                TermMapping.TGT_TERM_LBL: "", TermMapping.TGT_TERM_CURIE: "",
+                                TermMapping.TGT_TERM_IRI: "", TermMapping.MAPPING_SCORE: 0},
+                               columns=mappings_df.columns)
+    if mappings_df.empty:
+        return unmapped_df
+    return pd.concat([mappings_df, unmapped_df], ignore_index=True)
 
 
-def _add_tag(tags, term, to_add, ignore=False):
+# Adds the given tag to each of the given source terms, once per occurrence of each term
+def _add_tag(tags, terms, to_add, ignore=False):
     if isinstance(tags, dict):
-        new_tags = tags.get(term, [])
-        if new_tags is None:
-            new_tags = []
-        if not (ignore and any(tag in IGNORE_TAGS for tag in new_tags)):
-            if isinstance(new_tags, list):
-                new_tags.append(to_add)
-            elif new_tags != "":
-                new_tags = [new_tags, to_add]
-            else:
-                new_tags = [to_add]
-        tags[term] = new_tags
+        for term in terms:
+            new_tags = tags.get(term, [])
+            if new_tags is None:
+                new_tags = []
+            if not (ignore and any(tag in IGNORE_TAGS for tag in new_tags)):
+                if isinstance(new_tags, list):
+                    new_tags.append(to_add)
+                elif new_tags != "":
+                    new_tags = [new_tags, to_add]
+                else:
+                    new_tags = [to_add]
+            tags[term] = new_tags
     else:
+        tagged_terms = dict()
         for tagged_term in tags:
-            check_ignore = not ignore and not any(tagged_term.has_tag(tag) for tag in IGNORE_TAGS)
-            if tagged_term.get_term() == term and check_ignore:
-                tagged_term.add_tags([to_add])
+            tagged_terms.setdefault(tagged_term.get_term(), []).append(tagged_term)
+        for term in terms:
+            for tagged_term in tagged_terms.get(term, ()):
+                if not (ignore and any(tagged_term.has_tag(tag) for tag in IGNORE_TAGS)):
+                    tagged_term.add_tags([to_add])
 
 
 def _save_mappings(mappings, output_file, min_score, mapper, target_ontology, base_iris,
@@ -349,5 +582,5 @@ def _save_mappings(mappings, output_file, min_score, mapper, target_ontology, ba
 
 def _save_graphs(terms, output_file):
     term_graphs = TermGraphGenerator(terms).graphs_dicts()
-    with open(output_file + "-term-graphs.json", 'w') as json_file:
+    with onto_utils.atomic_write(output_file + "-term-graphs.json", 'w') as json_file:
         json.dump(term_graphs, json_file, indent=2)
@@ -1,6 +1,10 @@
 """Provides OntologyTerm class and OntologyTermType string enumeration"""
 
+import sys
+import threading
 from enum import Enum
+from types import MappingProxyType
+from collections.abc import Mapping
 
 
 class OntologyTermType(str, Enum):
@@ -9,12 +13,103 @@ class OntologyTermType(str, Enum):
     ANY = "any"
 
 
+# Fields of ontology terms that can be collected selectively (the IRI, deprecation and type of terms always are)
+TERM_FIELDS = ("labels", "synonyms", "definitions", "parents", "restrictions", "children", "instances")
+
+# Fields used by the mappers, and fields used to build the graphs of the neighborhood of ontology terms
+MAPPING_FIELDS = ("labels", "synonyms")
+GRAPH_FIELDS = ("labels", "parents", "children", "instances")
+
+
+# Fields with a set of strings per term, fields with a dictionary of neighbour IRIs to their labels per term, and the
+# field with a dictionary of property IRIs to fillers per term
+SET_FIELDS = ("labels", "synonyms", "definitions")
+NEIGHBOUR_FIELDS = ("parents", "children", "instances")
+
+# Value of the set fields of terms that have no values of a field, shared by all of them
+EMPTY_SET = frozenset()
+
+
+class OntologyTermTable:
+
+    def __init__(self):
+        """
+        Table of the IRIs and labels of the terms that are neighbours (parents, children or instances) of the terms of
+        an ontology, shared by those terms so that each neighbour is stored once and referenced by its integer ID,
+        rather than stored again in the dictionaries of neighbours of each term. The table also deduplicates the
+        strings of the terms sharing it, such that equal IRIs and labels are the same string object
+        """
+        self.iris = []
+        self.labels = []
+        self._ids = dict()
+        self._strings = dict()
+        self._lock = threading.Lock()
+
+    def intern(self, value):
+        """
+        Get the string of this table that is equal to the given value, adding the value to the table if there is none
+        :param value: String (e.g., IRI, or owlready2 locstr label), or another value, which is returned as is
+        :return: Equal string of this table
+        """
+        if type(value) is str:
+            return sys.intern(value)
+        if not isinstance(value, str):
+            return value
+        return self._strings.setdefault((str(value), getattr(value, "lang", None)), value)
+
+    def get_id(self, iri, label):
+        """
+        Get the ID of the neighbour term with the given IRI and label, adding it to this table if it is not there
+        :param iri: IRI of the neighbour term
+        :param label: Label of the neighbour term
+        :return: int
+        """
+        label = self.intern(label)
+        key = (iri, str(label), getattr(label, "lang", None)) if isinstance(label, str) else (iri, label)
+        term_id = self._ids.get(key)
+        if term_id is None:
+            with self._lock:
+                term_id = self._ids.get(key)
+                if term_id is None:
+                    term_id = len(self.iris)
+                    self.iris.append(self.intern(iri))
+                    self.labels.append(label)
+                    self._ids[key] = term_id
+        return term_id
+
+    def get_neighbours(self, term_ids):
+        """
+        Get the IRIs and labels of the neighbour terms with the given IDs
+        :param term_ids: IDs of neighbour terms in this table
+        :return: Dictionary of the IRIs of the neighbour terms to their labels
+        """
+        return {self.iris[term_id]: self.labels[term_id] for term_id in term_ids}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
 class OntologyTerm:
 
+    __slots__ = ("_iri", "_labels", "_synonyms", "_definitions", "_parents", "_children", "_instances",
+                 "_restrictions", "_deprecated", "_term_type", "_term_table", "_field_loader", "_views")
+
+    # Slots that are bound to the process the term was created in, or built from the other slots, so not serialized
+    _TRANSIENT_SLOTS = ("_field_loader", "_views")
+
     def __init__(self, iri, labels, definitions=(), synonyms=(), parents=(), children=(), instances=(), restrictions=(),
-                 deprecated=False, term_type=OntologyTermType.CLASS):
+                 deprecated=False, term_type=OntologyTermType.CLASS, field_loader=None, term_table=None):
         """
-        Constructor for a succinct representation of an ontology term
+        Constructor for a succinct, read-only representation of an ontology term. Sets of strings are stored as
+        frozensets, and dictionaries as tuples of key-value pairs or, for the dictionaries of neighbours given a term
+        table, as tuples of the IDs of the neighbours in that table. Dictionaries are given as read-only dictionaries
+        built when first used
         :param iri: IRI of the ontology term
         :param labels: Set of human-readable labels for the term (e.g., rdfs:label, skos:prefLabel)
         :param definitions: Set of textual definitions of the term
@@ -25,17 +120,24 @@ class OntologyTerm:
         :param restrictions: Dictionary containing complex class restrictions (such as located_in.Hand) on this term
         :param deprecated: true if term is stated to be owl:deprecated, false otherwise
         :param term_type: Type of term: class or property
+        :param field_loader: Function that takes the IRI of the term and the name of a field in TERM_FIELDS, and returns
+                             the value of that field. Fields given as None are loaded with this function when first used
+        :param term_table: OntologyTermTable shared by the terms of the ontology, which stores the neighbours of this
+                           term and deduplicates its strings, or None for a term that does not share a table
         """
-        self._iri = iri
-        self._labels = labels
-        self._synonyms = synonyms
-        self._definitions = definitions
-        self._parents = parents
-        self._children = children
-        self._instances = instances
-        self._restrictions = restrictions
+        self._iri = sys.intern(iri) if type(iri) is str else iri
+        self._term_table = term_table
+        self._field_loader = field_loader
+        self._views = None
         self._deprecated = deprecated
         self._term_type = term_type
+        self._labels = None if labels is None else self._freeze_set(labels)
+        self._synonyms = None if synonyms is None else self._freeze_set(synonyms)
+        self._definitions = None if definitions is None else self._freeze_set(definitions)
+        self._parents = None if parents is None else self._freeze_neighbours(parents)
+        self._children = None if children is None else self._freeze_neighbours(children)
+        self._instances = None if instances is None else self._freeze_neighbours(instances)
+        self._restrictions = None if restrictions is None else self._freeze_dict(restrictions)
 
     @property
     def iri(self):
@@ -49,63 +151,65 @@ class OntologyTerm:
     def labels(self):
         """
         Returns the set of human-readable labels for the term specified using rdfs:label or skos:prefLabel properties
-        :return: set
+        :return: frozenset
         """
-        return self._labels
+        return self._load_field("labels") if self._labels is None else self._labels
 
     @property
     def definitions(self):
         """
         Returns the set of textual definitions of the term specified using either the skos:definition or the
          IAO:0000115 ('definition') annotation properties
-        :return: set
+        :return: frozenset
         """
-        return self._definitions
+        return self._load_field("definitions") if self._definitions is None else self._definitions
 
     @property
     def synonyms(self):
         """
         Returns the set of synonyms of the term specified using obo:hasExactSynonym or ncit:P90 properties
-        :return: set
+        :return: frozenset
         """
-        return self._synonyms
+        return self._load_field("synonyms") if self._synonyms is None else self._synonyms
 
     @property
     def parents(self):
         """
-        Returns a dictionary containing the IRIs of parent terms as keys, and their respective labels as values
-        :return: dict
+        Returns a read-only dictionary containing the IRIs of parent terms as keys, and their respective labels as
+        values
+        :return: MappingProxyType
         """
-        return self._parents
+        return self._get_view("parents")
 
     @property
     def children(self):
         """
-        Returns a dictionary containing the IRIs of child terms as keys, and their respective labels as values
-        :return: dict
+        Returns a read-only dictionary containing the IRIs of child terms as keys, and their respective labels as values
+        :return: MappingProxyType
         """
-        return self._children
+        return self._get_view("children")
 
     @property
     def instances(self):
         """
-        Returns a dictionary containing the IRIs of instance terms as keys, and their respective labels as values
-        :return: dict
+        Returns a read-only dictionary containing the IRIs of instance terms as keys, and their respective labels as
+        values
+        :return: MappingProxyType
         """
-        return self._instances
+        return self._get_view("instances")
 
     @property
     def restrictions(self):
         """
-        Returns a dictionary containing the IRIs of properties as keys, and the respective fillers as values
+        Returns a read-only dictionary containing the IRIs of properties as keys, and the respective fillers as values
         For example, for a restriction such as ':has_disease_location :pancreas', the dictionary would have:
         {':has_disease_location': ':pancreas'}
         For nested expressions such as 'has_disease_location (:pancreas or :liver);, the dictionary would have a string
         representation of that expression (using owlready2s to_str):
         {':has_disease_location': ':pancreas | :liver'}
-        :return: dict
+        :return: MappingProxyType
         """
-        return self._restrictions
+        return self._get_view("restrictions")
 
     @property
     def label(self):
@@ -113,7 +217,7 @@ class OntologyTerm:
         Returns a single label for this term
         :return: str
         """
-        return next(iter(self.labels))
+        return next(iter(self._load_field("labels") if self._labels is None else self._labels))
 
     @property
     def deprecated(self):
@@ -131,6 +235,102 @@ class OntologyTerm:
         """
         return self._term_type
 
+    @property
+    def term_table(self):
+        """
+        Returns the OntologyTermTable shared by this term and the other terms of its ontology, if any
+        :return: OntologyTermTable or None
+        """
+        return self._term_table
+
+    def get_neighbour_ids(self, field, term_table):
+        """
+        Get the IDs in the given term table of the parents, children or instances of this term
+        :param field: Field of the neighbours, out of NEIGHBOUR_FIELDS
+        :param term_table: OntologyTermTable, to which the neighbours that are not in it are added
+        :return: Tuple of the IDs of the neighbours
+        """
+        neighbours = getattr(self, "_" + field)
+        if neighbours is None:
+            neighbours = self._load_field(field)
+        if neighbours and term_table is not self._term_table:
+            get_id = term_table.get_id
+            neighbours = tuple([get_id(iri, label) for iri, label in self._get_neighbours(neighbours).items()])
+        return neighbours
+
+    def _load_field(self, field):
+        # Load the value of a field that was given as None, i.e., that has not been loaded
+        value = self._freeze(field, () if self._field_loader is None else self._field_loader(self._iri, field))
+        setattr(self, "_" + field, value)
+        return value
+
+    def _get_neighbours(self, neighbours):
+        return dict(neighbours) if self._term_table is None else self._term_table.get_neighbours(neighbours)
+
+    def _get_view(self, field):
+        # Get the read-only dictionary of the given field, which is built the first time the field is used
+        if self._views is None:
+            self._views = dict()
+        view = self._views.get(field)
+        if view is None:
+            value = self._load_field(field) if getattr(self, "_" + field) is None else getattr(self, "_" + field)
+            view = MappingProxyType(dict(value) if field == "restrictions" else self._get_neighbours(value))
+            self._views[field] = view
+        return view
+
+    def _freeze(self, field, value):
+        # Get the read-only representation of the given value of the given field, using the strings of the term table
+        if value is None:  # not loaded
+            return None
+        if field in SET_FIELDS:
+            return self._freeze_set(value)
+        if field in NEIGHBOUR_FIELDS:
+            return self._freeze_neighbours(value)
+        return self._freeze_dict(value)
+
+    def _freeze_set(self, values):
+        if not values:
+            return EMPTY_SET
+        return frozenset(values) if self._term_table is None else frozenset(map(self._term_table.intern, values))
+
+    def _freeze_neighbours(self, neighbours):
+        if not neighbours or self._term_table is None:
+            return self._freeze_dict(neighbours)
+        get_id = self._term_table.get_id
+        return tuple([get_id(iri, label) for iri, label in _get_items(neighbours)])
+
+    def _freeze_dict(self, dictionary):
+        if not dictionary:
+            return ()
+        if self._term_table is None:
+            return tuple(_get_items(dictionary))
+        intern = self._term_table.intern
+        return tuple([(intern(key), intern(value)) for key, value in _get_items(dictionary)])
+
+    def __getstate__(self):
+        # field loaders are bound to the collector or cache the term was loaded from, so they are not serialized, and
+        # the fields that have not been loaded yet are loaded first, as they could not be loaded afterwards. The state
+        # is that of objects with slots, i.e., None (for the absent dictionary of attributes) and the slots by name
+        for field in TERM_FIELDS:
+            if getattr(self, "_" + field) is None:
+                self._load_field(field)
+        return None, {name: getattr(self, name) for name in self.__slots__ if name not in self._TRANSIENT_SLOTS}
+
+    def __setstate__(self, state):
+        self._field_loader = None
+        self._views = None
+        if isinstance(state, tuple):
+            _, slots = state
+            for name in self.__slots__:
+                if name not in self._TRANSIENT_SLOTS:
+                    setattr(self, name, slots.get(name))
+            return
+        # terms serialized before they were read-only have a dictionary of mutable (or unloaded) fields
+        for name in ("_iri", "_deprecated", "_term_type", "_term_table"):
+            setattr(self, name, state.get(name))
+        for field in TERM_FIELDS:
+            setattr(self, "_" + field, self._freeze(field, state.get("_" + field)))
+
     def __eq__(self, other):
         if isinstance(other, OntologyTerm):
             return self._iri == other._iri
@@ -142,5 +342,10 @@ class OntologyTerm:
     def __str__(self):
         return "Ontology Term: " + self.iri + ", Type: " + self.term_type + ", Labels: " + str(self.labels) + \
                ", Synonyms: " + str(self.synonyms) + ", Definitions: " + str(self.definitions) + \
-               ", Parents: " + str(self.parents) + ", Children: " + str(self.children) + \
-               ", Instances: " + str(self.instances) + ", Restrictions: " + str(self.restrictions)
+               ", Parents: " + str(dict(self.parents)) + ", Children: " + str(dict(self.children)) + \
+               ", Instances: " + str(dict(self.instances)) + ", Restrictions: " + str(dict(self.restrictions))
+
+
+def _get_items(dictionary):
+    # Dictionaries of read-only terms are tuples of their items
+    return dictionary.items() if type(dictionary) is dict or isinstance(dictionary, Mapping) else dictionary
@@ -2,51 +2,101 @@
 
 from owlready2 import *
 from text2term import onto_utils
-from text2term.term import OntologyTerm, OntologyTermType
+from text2term.term import OntologyTerm, OntologyTermTable, OntologyTermType, TERM_FIELDS
+from text2term.columnar_terms import ColumnarOntologyTerms
+from text2term.term_store import OntologyTermStore
+import os
+import re
+import json
+import hashlib
 import logging
+import urllib.request
 import bioregistry
 
+# Annotation properties, by their owlready2 Python names, whose values are collected in bulk from the quadstore
+BULK_ANNOTATION_PROPERTIES = ("label", "prefLabel", "hasExactSynonym", "hasRelatedSynonym", "hasBroadSynonym", "P90",
+                              "alternative_term", "IAO_0000115", "definition")
+
+# Number of bytes at the start of a remote ontology document searched for its version IRI
+VERSION_IRI_SEARCH_BYTES = 65536
+VERSION_IRI_PATTERN = re.compile(rb'versionIRI\s*(?:rdf:resource)?\s*=?\s*["<]([^">]+)[">]', re.IGNORECASE)
+
 
 class OntologyTermCollector:
 
-    def __init__(self, ontology_iri, use_reasoning=False, log_level=logging.INFO):
+    def __init__(self, ontology_iri, use_reasoning=False, log_level=logging.INFO, quadstore_dir=None):
         """
         Construct an ontology term collector for the ontology at the given IRI
         :param ontology_iri: IRI of the ontology (e.g., path of ontology document in the local file system, URL)
         :param use_reasoning: Use a reasoner to compute inferred class hierarchy
+        :param quadstore_dir: Directory of persistent owlready2 quadstores. If given, the ontology is parsed into a
+                              quadstore file in this directory the first time it is loaded, and later loads reopen that
+                              quadstore instead of parsing the ontology again, unless the ontology document has changed
         """
         self.logger = onto_utils.get_logger(__name__, level=log_level)
-        self.ontology = self._load_ontology(ontology_iri)
+        self._annotation_values = dict()
+        self._bulk_annotation_storids = dict()
+        self._relation_subjects = None
+        self._term_table = OntologyTermTable()  # shared by the collected terms
+        self._closed = False
+        self._persistent_world = quadstore_dir is not None
+        self.ontology = self._load_ontology(ontology_iri, quadstore_dir)
         if use_reasoning:
             self._classify_ontology(self.ontology)
 
-    def get_ontology_terms(self, base_iris=(), exclude_deprecated=False, term_type=OntologyTermType.ANY):
+    def get_ontology_terms(self, base_iris=(), exclude_deprecated=False, term_type=OntologyTermType.ANY,
+                           fields=TERM_FIELDS):
         """
         Collect the terms described in the ontology at the specified IRI
         :param base_iris: Limit ontology term collection to terms whose IRIs start with any IRI given in this tuple
         :param exclude_deprecated: Exclude ontology terms stated as deprecated using owl:deprecated 'true'
         :param term_type: Type of term--can be 'class' or 'property' or 'any' (individuals may be added in the future)
+        :param fields: Fields of the terms to collect, out of those in TERM_FIELDS. The other fields are collected when
+                       first used, provided this collector has not been closed by then
         :return: Dictionary of ontology term IRIs and their respective details in the specified ontology
         """
+        unknown_fields = set(fields) - set(TERM_FIELDS)
+        if len(unknown_fields) > 0:
+            raise ValueError("Invalid ontology term fields: " + ", ".join(sorted(unknown_fields)) +
+                             ". Acceptable fields are: " + ", ".join(TERM_FIELDS))
         self.logger.info("Collecting ontology term details...")
         start = time.time()
+        self._collect_annotation_values()
+        if "children" in fields or "instances" in fields:
+            self._collect_relation_subjects(self.ontology)
         ontology_terms = dict()
         if len(base_iris) > 0:
             for iri in base_iris:
                 iri = iri.strip()
                 query = iri + "*"
                 self.logger.info("...collecting terms with IRIs starting in: " + iri)
-                iris = list(default_world.search(iri=query))
+                iris = list(self.ontology.world.search(iri=query))
                 ontology_terms = ontology_terms | self._get_ontology_terms(iris, self.ontology, exclude_deprecated,
-                                                                           term_type)
+                                                                           term_type, fields)
         else:
             ontology_signature = self._get_ontology_signature(self.ontology)
-            ontology_terms = self._get_ontology_terms(ontology_signature, self.ontology, exclude_deprecated, term_type)
+            ontology_terms = self._get_ontology_terms(ontology_signature, self.ontology, exclude_deprecated, term_type,
+                                                      fields)
         end = time.time()
         self.logger.info("...done: collected %i ontology terms (collection time: %.2fs)", len(ontology_terms),
                          end - start)
         return ontology_terms
 
+    def get_term_store(self, base_iris=(), exclude_deprecated=False, term_type=OntologyTermType.ANY,
+                       fields=TERM_FIELDS):
+        """
+        Collect the terms described in the ontology at the specified IRI into a store of their IRIs, names and
+        neighbours, which refers to the neighbours of the terms by their IDs in the term table of this collector
+        :param base_iris: Limit ontology term collection to terms whose IRIs start with any IRI given in this tuple
+        :param exclude_deprecated: Exclude ontology terms stated as deprecated using owl:deprecated 'true'
+        :param term_type: Type of term--can be 'class' or 'property' or 'any' (individuals may be added in the future)
+        :param fields: Fields of the terms to collect, out of those in TERM_FIELDS
+        :return: OntologyTermStore
+        """
+        ontology_terms = self.get_ontology_terms(base_iris=base_iris, exclude_deprecated=exclude_deprecated,
+                                                 term_type=term_type, fields=fields)
+        return OntologyTermStore.build(ontology_terms, fields)
+
     def filter_terms(self, onto_terms, iris=(), excl_deprecated=False, term_type=OntologyTermType.ANY):
         return filter_terms(onto_terms, iris, excl_deprecated, term_type)
 
@@ -59,37 +109,132 @@ class OntologyTermCollector:
             signature.extend(list(imported_ontology.properties()))
         return signature
 
-    def _get_ontology_terms(self, term_list, ontology, exclude_deprecated, term_type):
+    def _collect_annotation_values(self):
+        """
+        Collect the values of the annotation properties in BULK_ANNOTATION_PROPERTIES and of owl:deprecated for all
+        subjects, with one query per quadstore table, rather than querying the quadstore for each term and property
+        """
+        world = self.ontology.world
+        self._bulk_annotation_storids = dict()
+        for property_name in BULK_ANNOTATION_PROPERTIES:
+            annotation_property = world._props.get(property_name)
+            # Non-annotation properties of the same name have class-specific semantics, so they are not collected here
+            if annotation_property is not None and issubclass_python(annotation_property, AnnotationProperty):
+                self._bulk_annotation_storids[property_name] = annotation_property.storid
+        storids = set(self._bulk_annotation_storids.values()) | {deprecated.storid}
+        self._annotation_values = {storid: dict() for storid in storids}
+        # Values are listed in the same order as owlready2 lists them for each subject: object values before data
+        # values, and each in the order they were stored
+        parameters = ",".join("?" * len(storids))
+        for query in ("SELECT s,p,o,NULL FROM objs WHERE p IN (%s) ORDER BY rowid" % parameters,
+                      "SELECT s,p,o,d FROM datas WHERE p IN (%s) ORDER BY rowid" % parameters):
+            for subject, predicate, value, datatype in world.graph.execute(query, tuple(storids)):
+                self._annotation_values[predicate].setdefault(subject, []).append((value, datatype))
+
+    def _collect_relation_subjects(self, ontology):
+        """
+        Collect the subjects of the rdfs:subClassOf, rdfs:subPropertyOf and rdf:type relations asserted in the given
+        ontology, grouped by relation and object, with a single query. This inverts the parent and type relations once,
+        so the children and instances of each term are looked up rather than queried from the quadstore for each term
+        :param ontology: Ontology whose relations are collected (as with owlready2's get_children_of/get_instances_of)
+        """
+        self._relation_subjects = dict()
+        # Subjects are listed in the same order as owlready2 lists them for each relation and object
+        query = "SELECT s,p,o FROM objs WHERE c=? AND p IN (?,?,?) ORDER BY o,p,s"
+        parameters = (ontology.graph.c, rdfs_subclassof, rdfs_subpropertyof, rdf_type)
+        for subject, predicate, value in ontology.world.graph.execute(query, parameters):
+            self._relation_subjects.setdefault((predicate, value), []).append(subject)
+
+    def _get_relation_subjects(self, predicate, ontology_term, ontology):
+        if self._relation_subjects is None:
+            storids = ontology._get_obj_triples_po_s(predicate, ontology_term.storid)
+        else:
+            storids = self._relation_subjects.get((predicate, ontology_term.storid), ())
+        return [ontology.world._get_by_storid(storid) for storid in storids]
+
+    def _get_annotation_values(self, ontology_term, property_name):
+        """
+        Get the values of the annotation property with the given owlready2 Python name on the given term, from the
+        values collected in bulk if the property is among those, or otherwise via owlready2
+        :param ontology_term: Ontology term
+        :param property_name: Python name of the annotation property (e.g., 'label')
+        :return: List of values
+        """
+        storid = self._bulk_annotation_storids.get(property_name)
+        if storid is None:
+            return getattr(ontology_term, property_name)
+        return self._get_bulk_annotation_values(ontology_term, storid)
+
+    def _get_bulk_annotation_values(self, ontology_term, storid):
+        ontology = ontology_term.namespace.ontology
+        return [ontology._to_python(value, datatype)
+                for value, datatype in self._annotation_values[storid].get(ontology_term.storid, ())]
+
+    def _get_deprecated(self, ontology_term):
+        if deprecated.storid in self._annotation_values:
+            return self._get_bulk_annotation_values(ontology_term, deprecated.storid)
+        return deprecated[ontology_term]
+
+    def _get_ontology_terms(self, term_list, ontology, exclude_deprecated, term_type, fields=TERM_FIELDS):
         ontology_terms = dict()
         for ontology_term in term_list:
             # Parse if should include ontology classes, properties, or both
             include = _filter_term_type(ontology_term, term_type, False)
             if include and ontology_term is not Thing and ontology_term is not Nothing:
-                if (exclude_deprecated and not deprecated[ontology_term]) or (not exclude_deprecated):
+                term_deprecated = self._get_deprecated(ontology_term)
+                if (exclude_deprecated and not term_deprecated) or (not exclude_deprecated):
                     iri = ontology_term.iri
-                    labels = self._get_labels(ontology_term)
-                    synonyms = self._get_synonyms(ontology_term)
-                    named_parents, complex_parents = self._get_parents(ontology_term)
-                    children = self._get_children(ontology_term, ontology)
-                    instances = self._get_instances(ontology_term, ontology)
-                    definitions = self._get_definitions(ontology_term)
-                    is_deprecated = deprecated[ontology_term] == [True]
+                    term_fields = self._get_term_fields(ontology_term, ontology, fields)
+                    is_deprecated = term_deprecated == [True]
                     if _filter_term_type(ontology_term, OntologyTermType.CLASS, False):
                         owl_term_type = OntologyTermType.CLASS
                     elif _filter_term_type(ontology_term, OntologyTermType.PROPERTY, False):
                         owl_term_type = OntologyTermType.PROPERTY
                     else:
                         owl_term_type = "undetermined"
-                        self.logger.warn("Term has undetermined type %s %s", iri, labels)
-                    term_details = OntologyTerm(iri, labels, definitions=definitions, synonyms=synonyms,
-                                                parents=named_parents, children=children, instances=instances,
-                                                restrictions=complex_parents, deprecated=is_deprecated,
-                                                term_type=owl_term_type)
+                        self.logger.warn("Term has undetermined type %s %s", iri, term_fields.get("labels"))
+                    term_details = OntologyTerm(iri, deprecated=is_deprecated, term_type=owl_term_type,
+                                                field_loader=self._load_term_field, term_table=self._term_table,
+                                                **term_fields)
                     ontology_terms[iri] = term_details
                 else:
                     self.logger.debug("Excluding deprecated ontology term: %s", ontology_term.iri)
         return ontology_terms
 
+    def _get_term_fields(self, ontology_term, ontology, fields):
+        """
+        Get the given fields of the given ontology term
+        :param ontology_term: Ontology term
+        :param ontology: Ontology whose relations are used to get the children and instances of the term
+        :param fields: Fields to get, out of those in TERM_FIELDS
+        :return: Dictionary of all fields in TERM_FIELDS to their values, which are None for the fields not requested
+        """
+        term_fields = dict.fromkeys(TERM_FIELDS)
+        if "labels" in fields:
+            term_fields["labels"] = self._get_labels(ontology_term)
+        if "synonyms" in fields:
+            term_fields["synonyms"] = self._get_synonyms(ontology_term)
+        if "parents" in fields or "restrictions" in fields:
+            named_parents, complex_parents = self._get_parents(ontology_term)
+            if "parents" in fields:
+                term_fields["parents"] = named_parents
+            if "restrictions" in fields:
+                term_fields["restrictions"] = complex_parents
+        if "children" in fields:
+            term_fields["children"] = self._get_children(ontology_term, ontology)
+        if "instances" in fields:
+            term_fields["instances"] = self._get_instances(ontology_term, ontology)
+        if "definitions" in fields:
+            term_fields["definitions"] = self._get_definitions(ontology_term)
+        return term_fields
+
+    def _load_term_field(self, iri, field):
+        # Field loader of the collected terms, which gets a field that was not collected from the loaded ontology
+        if self._closed:
+            raise RuntimeError(f"Cannot load the '{field}' field of ontology term {iri}, which was not collected, "
+                               f"because the ontology term collector has been closed")
+        return self._get_term_fields(self.ontology.world[iri], self.ontology, (field,))[field]
+
     def _get_parents(self, ontology_term):
         parents = dict()  # named/atomic superclasses except owl:Thing
         restrictions = dict()  # restrictions are class expressions such as 'pancreatitis disease_has_location pancreas'
@@ -113,8 +258,9 @@ class OntologyTermCollector:
         return parents, restrictions
 
     def _add_named_parent(self, parent, parents):
-        if len(parent.label) > 0:
-            parents.update({parent.iri: parent.label[0]})
+        parent_labels = self._get_annotation_values(parent, "label")
+        if len(parent_labels) > 0:
+            parents.update({parent.iri: parent_labels[0]})
         else:
             parents.update({parent.iri: onto_utils.label_from_iri(parent.iri)})
 
@@ -134,10 +280,11 @@ class OntologyTermCollector:
     def _get_children(self, ontology_term, ontology):
         children = dict()
         try:
-            for child in ontology.get_children_of(ontology_term):
+            for child in self._get_relation_subjects(ontology_term._rdfs_is_a, ontology_term, ontology):
                 if len(child.iri) > 0:
-                    if len(child.label) > 0:
-                        children.update({child.iri: child.label[0]})
+                    child_labels = self._get_annotation_values(child, "label")
+                    if len(child_labels) > 0:
+                        children.update({child.iri: child_labels[0]})
                     else:
                         children.update({child.iri: onto_utils.label_from_iri(child.iri)})
         except (TypeError, AttributeError, ValueError) as err:
@@ -147,10 +294,11 @@ class OntologyTermCollector:
     def _get_instances(self, ontology_term, ontology):
         instances = dict()
         try:
-            for instance in ontology.get_instances_of(ontology_term):
+            for instance in self._get_relation_subjects(rdf_type, ontology_term, ontology):
                 if len(instance.iri) > 0:
-                    if len(instance.label) > 0:
-                        instances.update({instance.iri: instance.label[0]})
+                    instance_labels = self._get_annotation_values(instance, "label")
+                    if len(instance_labels) > 0:
+                        instances.update({instance.iri: instance_labels[0]})
                     else:
                         instances.update({instance.iri: onto_utils.label_from_iri(instance.iri)})
         except AttributeError as err:
@@ -207,7 +355,7 @@ class OntologyTermCollector:
         """
         rdfs_labels = []
         try:
-            for rdfs_label in ontology_term.label:
+            for rdfs_label in self._get_annotation_values(ontology_term, "label"):
                 rdfs_labels.append(rdfs_label)
         except (AttributeError, ValueError) as err:
             self.logger.debug(err)
@@ -221,7 +369,7 @@ class OntologyTermCollector:
         """
         skos_labels = []
         try:
-            for skos_pref_label in ontology_term.prefLabel:
+            for skos_pref_label in self._get_annotation_values(ontology_term, "prefLabel"):
                 skos_labels.append(skos_pref_label)
         except AttributeError as err:
             self.logger.debug(err)
@@ -230,7 +378,7 @@ class OntologyTermCollector:
     def _get_efo_alt_terms(self, ontology_term):
         efo_alt_terms = []
         try:
-            for efo_alt_term in ontology_term.alternative_term:
+            for efo_alt_term in self._get_annotation_values(ontology_term, "alternative_term"):
                 efo_alt_terms.append(efo_alt_term)
         except AttributeError as err:
             self.logger.debug(err)
@@ -245,7 +393,7 @@ class OntologyTermCollector:
         """
         synonyms = []
         try:
-            for synonym in ontology_term.hasExactSynonym:
+            for synonym in self._get_annotation_values(ontology_term, "hasExactSynonym"):
                 if hasattr(synonym, 'iri'):
                     synonym = synonym.iri
                 synonyms.append(synonym)
@@ -262,7 +410,7 @@ class OntologyTermCollector:
         """
         synonyms = []
         try:
-            for synonym in ontology_term.hasRelatedSynonym:
+            for synonym in self._get_annotation_values(ontology_term, "hasRelatedSynonym"):
                 if hasattr(synonym, 'iri'):
                     synonym = synonym.iri
                 synonyms.append(synonym)
@@ -279,7 +427,7 @@ class OntologyTermCollector:
         """
         synonyms = []
         try:
-            for synonym in ontology_term.hasBroadSynonym:
+            for synonym in self._get_annotation_values(ontology_term, "hasBroadSynonym"):
                 if hasattr(synonym, 'iri'):
                     synonym = synonym.iri
                 synonyms.append(synonym)
@@ -296,7 +444,7 @@ class OntologyTermCollector:
         """
         nci_synonyms = []
         try:
-            for synonym in ontology_term.P90:
+            for synonym in self._get_annotation_values(ontology_term, "P90"):
                 nci_synonyms.append(synonym)
         except AttributeError as err:
             self.logger.debug(err)
@@ -319,7 +467,7 @@ class OntologyTermCollector:
     def _get_iao_definition(self, ontology_term):
         definition = ""
         try:
-            definition = ontology_term.IAO_0000115
+            definition = self._get_annotation_values(ontology_term, "IAO_0000115")
         except AttributeError as err:
             self.logger.debug(err)
         return definition
@@ -327,15 +475,16 @@ class OntologyTermCollector:
     def _get_skos_definition(self, ontology_term):
         definition = ""
         try:
-            definition = ontology_term.definition
+            definition = self._get_annotation_values(ontology_term, "definition")
         except AttributeError as err:
             self.logger.debug(err)
         return definition
 
-    def _load_ontology(self, ontology_iri):
+    def _load_ontology(self, ontology_iri, quadstore_dir=None):
         """
         Load the ontology at the specified IRI.
         :param ontology_iri: IRI of the ontology (e.g., path of ontology document in the local file system, URL)
+        :param quadstore_dir: Directory of persistent owlready2 quadstores, or None to load into the default world
         :return: Ontology document
         """
         self.logger.info("Loading ontology %s...", ontology_iri)
@@ -343,12 +492,51 @@ class OntologyTermCollector:
         owl_link = bioregistry.get_owl_download(ontology_iri)
         if owl_link is not None:
             ontology_iri = owl_link
-        ontology = get_ontology(ontology_iri).load()
+        if quadstore_dir is None:
+            ontology = get_ontology(ontology_iri).load()
+        else:
+            ontology = self._load_persistent_ontology(ontology_iri, quadstore_dir)
         end = time.time()
         self._log_ontology_metrics(ontology)
         self.logger.info("...done (ontology loading time: %.2fs)", end - start)
         return ontology
 
+    def _load_persistent_ontology(self, ontology_iri, quadstore_dir):
+        """
+        Load the ontology at the specified IRI into a persistent owlready2 World backed by a quadstore file, or reopen
+        that quadstore if it was built from the same version of the ontology document. Versions of local documents are
+        identified by their SHA-256 hash, and versions of remote documents by their version IRI (or, if they have none,
+        by their SHA-256 hash)
+        :param ontology_iri: IRI of the ontology (e.g., path of ontology document in the local file system, URL)
+        :param quadstore_dir: Directory of persistent owlready2 quadstores
+        :return: Ontology document
+        """
+        os.makedirs(quadstore_dir, exist_ok=True)
+        quadstore_name = hashlib.sha256(ontology_iri.encode("utf-8")).hexdigest()[:16]
+        quadstore_file = os.path.join(quadstore_dir, quadstore_name + ".sqlite3")
+        metadata_file = os.path.join(quadstore_dir, quadstore_name + ".json")
+        metadata = dict()
+        if os.path.exists(metadata_file):
+            with open(metadata_file) as json_file:
+                metadata = json.load(json_file)
+        document_version = get_document_version(ontology_iri, metadata)
+        if os.path.exists(quadstore_file) and metadata.get("document_version") == document_version["document_version"]:
+            world = World(filename=quadstore_file)
+            if metadata["base_iri"] in world.ontologies:
+                self.logger.info("...reopening quadstore of unchanged ontology document: %s", quadstore_file)
+                return world.ontologies[metadata["base_iri"]]
+            world.close()
+        for file in (quadstore_file, metadata_file):
+            if os.path.exists(file):
+                os.remove(file)
+        self.logger.info("...parsing ontology into quadstore: %s", quadstore_file)
+        world = World(filename=quadstore_file)
+        ontology = world.get_ontology(ontology_iri).load()
+        world.save()
+        with open(metadata_file, 'w') as json_file:
+            json.dump(document_version | {"ontology_iri": ontology_iri, "base_iri": ontology.base_iri}, json_file)
+        return ontology
+
     def _classify_ontology(self, ontology):
         """
         Perform reasoning over the given ontology (consistency checking and classification)
@@ -357,11 +545,17 @@ class OntologyTermCollector:
         self.logger.info("Reasoning over ontology...")
         start = time.time()
         with ontology:  # entailments will be added to this ontology
-            sync_reasoner(infer_property_values=True)
+            sync_reasoner(ontology.world, infer_property_values=True)
         end = time.time()
         self.logger.info("...done (reasoning time: %.2fs)", end - start)
 
     def close(self):
+        # a persistent world is closed rather than having its ontology destroyed, which would delete it from the
+        # quadstore. Entailments added by reasoning are not saved, so they are discarded when the world is closed
+        self._closed = True
+        if self._persistent_world:
+            self.ontology.world.close()
+            return
         # when multiple ontologies are loaded with owlready2, and they reference the same ontology term (IRI), a lookup
         # for that IRI returns the term from the first ontology loaded —> need to unload previously loaded ontologies
         try:
@@ -370,6 +564,8 @@ class OntologyTermCollector:
             self.logger.debug("Unable to destroy ontology: ", err)
 
     def _log_ontology_metrics(self, ontology):
+        if not self.logger.isEnabledFor(logging.DEBUG):  # counting entities iterates over the whole ontology
+            return
         self.logger.debug(" Ontology IRI: %s", ontology.base_iri)
         self.logger.debug(" Class count: %i", len(list(ontology.classes())))
         self.logger.debug(" Object property count: %i", len(list(ontology.object_properties())))
@@ -377,6 +573,8 @@ class OntologyTermCollector:
         self.logger.debug(" Annotation property count: %i", len(list(ontology.annotation_properties())))
 
 def filter_terms(onto_terms, iris=(), excl_deprecated=False, term_type=OntologyTermType.ANY):
+    if isinstance(onto_terms, ColumnarOntologyTerms):  # filtered by searching the sorted IRIs of the terms
+        return onto_terms.filter(iris, excl_deprecated, term_type)
     filtered_onto_terms = {}
     for base_iri, term in onto_terms.items():
         if type(iris) == str:
@@ -389,6 +587,33 @@ def filter_terms(onto_terms, iris=(), excl_deprecated=False, term_type=OntologyT
             filtered_onto_terms.update({base_iri: term})
     return filtered_onto_terms
 
+# Gets the version of the ontology document at the given IRI, along with the details used to identify the version of a
+# local document without hashing it again when it has not been modified since the given (previous) metadata. Remote
+# documents without a version IRI are hashed only if hash_remote is True, and otherwise have no version (None)
+def get_document_version(ontology_iri, metadata, hash_remote=True):
+    if os.path.exists(ontology_iri):
+        stat = os.stat(ontology_iri)
+        file_details = {"document_size": stat.st_size, "document_mtime": stat.st_mtime_ns}
+        if all(metadata.get(key) == value for key, value in file_details.items()) and "document_version" in metadata:
+            return file_details | {"document_version": metadata["document_version"]}
+        digest = hashlib.sha256()
+        with open(ontology_iri, 'rb') as document:
+            for chunk in iter(lambda: document.read(1 << 20), b""):
+                digest.update(chunk)
+        return file_details | {"document_version": "sha256:" + digest.hexdigest()}
+    with urllib.request.urlopen(ontology_iri) as document:
+        head = document.read(VERSION_IRI_SEARCH_BYTES)
+        version_iri = VERSION_IRI_PATTERN.search(head)
+        if version_iri is not None:
+            return {"document_version": "versionIRI:" + version_iri.group(1).decode("utf-8")}
+        if not hash_remote:
+            return {"document_version": None}
+        digest = hashlib.sha256(head)
+        for chunk in iter(lambda: document.read(1 << 20), b""):
+            digest.update(chunk)
+        return {"document_version": "sha256:" + digest.hexdigest()}
+
+
 def _filter_term_type(ontology_term, term_type, cached):
     if term_type == OntologyTermType.CLASS:
         if cached:
@@ -2,53 +2,64 @@
 
 from text2term import onto_utils
 from text2term.term_graph import TermGraph, Node, Edge
+from text2term.term_store import get_term_store
 
 
 class TermGraphGenerator:
 
     def __init__(self, terms):
-        self._terms = terms
+        """
+        :param terms: OntologyTermStore, or dictionary of ontology terms, whose graphs are generated
+        """
+        self._term_store = get_term_store(terms)
         self._logger = onto_utils.get_logger(__name__)
+        self._node_term_ids = self._term_store.node_term_ids.tolist()
+        self._parents = self._term_store.get_neighbour_ids("parents")
+        self._children = self._term_store.get_neighbour_ids("children")
+        self._instances = self._term_store.get_neighbour_ids("instances")
 
     def graph(self, term):
-        """ Build and return a graph representing the neighborhood of an ontology term. """
-        nodes, edges = set(), set()
-        nodes.add(Node(term.iri, term.label))
-        self._add_superclasses(term, nodes, edges)
-        self._add_subclasses(term, term.children, nodes, edges)
-        self._add_instances(term, term.instances, nodes, edges)
-        return TermGraph(term.iri, nodes, edges)
-
-    def _add_superclasses(self, term, nodes, edges):
-        parents = term.parents
-        for parent_iri in parents:
-            self._add_node(parent_iri, parents[parent_iri], nodes)
-            edges.add(Edge(term.iri, parent_iri, Edge.IS_A))
-            self._add_ancestors(parent_iri, nodes, edges)
+        """
+        Build and return a graph representing the neighborhood of an ontology term
+        :param term: OntologyTerm, or IRI, of a term of the terms given to this generator
+        """
+        return self._graph(self._term_store.get_term_id(term if isinstance(term, str) else term.iri))
 
-    def _add_ancestors(self, node_iri, nodes, edges):
-        if node_iri in self._terms:
-            ancestors = self._terms[node_iri].parents
-            for ancestor_iri in ancestors:
-                self._add_node(ancestor_iri, ancestors[ancestor_iri], nodes)
-                edges.add(Edge(node_iri, ancestor_iri, Edge.IS_A))
-                self._add_ancestors(ancestor_iri, nodes, edges)
-        else:
-            self._logger.debug("Unable to get ancestor term %s from the ontology term details dictionary "
-                               "(possibly filtered out through the `base_iris` option)", node_iri)
-
-    def _add_children(self, term, children, edge_type, nodes, edges):
-        for child_iri in children:
-            self._add_node(child_iri, children[child_iri], nodes)
-            edges.add(Edge(child_iri, term.iri, edge_type))
+    def _graph(self, term_id):
+        term_iri = self._term_store.iris[term_id]
+        nodes, edges = set(), set()
+        nodes.add(Node(term_iri, self._term_store.labels[term_id]))
+        self._add_ancestors(term_id, nodes, edges, set())
+        self._add_children(term_id, self._children, Edge.IS_A, nodes, edges)
+        self._add_children(term_id, self._instances, Edge.INSTANCE_OF, nodes, edges)
+        return TermGraph(term_iri, nodes, edges)
 
-    def _add_subclasses(self, term, subclasses, nodes, edges):
-        self._add_children(term, subclasses, Edge.IS_A, nodes, edges)
+    def _add_ancestors(self, term_id, nodes, edges, visited_term_ids):
+        # Add the parents of the given term and, recursively, their ancestors. Every node and edge reachable from a term
+        # is added the first time it is visited, so terms reached again via other paths are not visited again
+        visited_term_ids.add(term_id)
+        term_iri = self._term_store.iris[term_id]
+        offsets, node_ids = self._parents
+        for node_id in node_ids[offsets[term_id]:offsets[term_id + 1]]:
+            parent_iri = self._add_node(node_id, nodes)
+            edges.add(Edge(term_iri, parent_iri, Edge.IS_A))
+            parent_term_id = self._node_term_ids[node_id]
+            if parent_term_id < 0:
+                self._logger.debug("Unable to get ancestor term %s from the ontology term details dictionary "
+                                   "(possibly filtered out through the `base_iris` option)", parent_iri)
+            elif parent_term_id not in visited_term_ids:
+                self._add_ancestors(parent_term_id, nodes, edges, visited_term_ids)
 
-    def _add_instances(self, term, instances, nodes, edges):
-        self._add_children(term, instances, Edge.INSTANCE_OF, nodes, edges)
+    def _add_children(self, term_id, children, edge_type, nodes, edges):
+        term_iri = self._term_store.iris[term_id]
+        offsets, node_ids = children
+        for node_id in node_ids[offsets[term_id]:offsets[term_id + 1]]:
+            child_iri = self._add_node(node_id, nodes)
+            edges.add(Edge(child_iri, term_iri, edge_type))
 
-    def _add_node(self, term_iri, term_label, nodes):
+    def _add_node(self, node_id, nodes):
+        term_iri = self._term_store.node_iris[node_id]
+        term_label = self._term_store.node_labels[node_id]
         if len(term_iri) > 0:
             if isinstance(term_label, list) and len(term_label) > 0:
                 label = term_label[0]
@@ -62,10 +73,11 @@ class TermGraphGenerator:
                 self._logger.debug("Label is null or empty for term " + term_iri)
         else:
             self._logger.debug("The given term has no IRI")
+        return term_iri
 
     def graphs_dicts(self):
         """Convenience function to get a list of all term graphs' dictionary representations"""
         graph_dicts = []
-        for term in self._terms.values():
-            graph_dicts.append(self.graph(term).as_dict())
+        for term_id in range(len(self._term_store)):
+            graph_dicts.append(self._graph(term_id).as_dict())
         return graph_dicts
@@ -1,7 +1,7 @@
 """Provides TermMapping and TermMappingCollection classes"""
 
 import pandas as pd
-from text2term import onto_utils
+from text2term.curie_resolver import CURIE_RESOLVER
 
 
 class TermMapping:
@@ -37,9 +37,7 @@ class TermMapping:
 
     @property
     def mapped_term_curie(self):
-        if self.mapped_term_iri == "":
-            return ""
-        return onto_utils.curie_from_iri(self.mapped_term_iri)
+        return CURIE_RESOLVER.get_curie(self.mapped_term_iri)
 
     @property
     def mapping_score(self):
@@ -74,4 +72,15 @@ class TermMappingCollection:
         return self._mappings
 
     def mappings_df(self):
-        return pd.DataFrame([m.to_dict() for m in self.mappings])
+        # the CURIEs of the mapped terms are resolved in one pass over the column of their IRIs
+        if len(self.mappings) == 0:
+            return pd.DataFrame()
+        mapped_term_iris = [m.mapped_term_iri for m in self.mappings]
+        return pd.DataFrame({
+            TermMapping.SRC_TERM_ID: [m.source_term_id for m in self.mappings],
+            TermMapping.SRC_TERM: [m.source_term for m in self.mappings],
+            TermMapping.TGT_TERM_LBL: [m.mapped_term_label for m in self.mappings],
+            TermMapping.TGT_TERM_CURIE: CURIE_RESOLVER.get_curies(mapped_term_iris),
+            TermMapping.TGT_TERM_IRI: mapped_term_iris,
+            TermMapping.MAPPING_SCORE: [m.mapping_score for m in self.mappings]
+        })
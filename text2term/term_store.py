@@ -0,0 +1,148 @@
+"""Provides OntologyTermStore class"""
+
+import logging
+import numpy as np
+from text2term import onto_utils
+from text2term.term import OntologyTermTable, NEIGHBOUR_FIELDS, MAPPING_FIELDS, GRAPH_FIELDS
+
+
+class OntologyTermStore:
+
+    def __init__(self, iris, labels, names, name_offsets, node_iris, node_labels, neighbours):
+        """
+        Struct-of-arrays representation of a collection of ontology terms, which the mappers, the label index and the
+        term graph generator use directly rather than going through OntologyTerm objects. Each term is identified by an
+        integer term ID, which is its position in the table of IRIs. The names (labels followed by synonyms) of the
+        terms are stored in a single list, where the names of each term are contiguous and delimited by name offsets.
+        Parents, children and instances are stored as compressed sparse row (CSR) adjacency: an array of the IDs of the
+        neighbour nodes of all terms, where the neighbours of each term are delimited by offsets. Nodes are the (IRI,
+        label) pairs of neighbours as given by the terms, which are not necessarily terms of the store themselves (e.g.,
+        parents of terms that were filtered out via base IRIs)
+        :param iris: List of the IRIs of the terms, in the order of their term IDs
+        :param labels: List of a single label of each term
+        :param names: List of the labels and synonyms of all terms
+        :param name_offsets: Array of the offset in `names` of the names of each term, followed by the number of names
+        :param node_iris: List of the IRIs of the neighbour nodes, in the order of their node IDs
+        :param node_labels: List of the labels of the neighbour nodes
+        :param neighbours: Dictionary of each field in NEIGHBOUR_FIELDS to a tuple of the array of the offsets of the
+                           neighbours of each term (followed by the number of neighbours) and the array of node IDs
+        """
+        self.iris = iris
+        self.labels = labels
+        self.names = names
+        self.name_offsets = name_offsets
+        self.name_term_ids = np.repeat(np.arange(len(iris), dtype=np.int64), np.diff(name_offsets))
+        self.node_iris = node_iris
+        self.node_labels = node_labels
+        self.neighbours = neighbours
+        self._term_ids = None
+        self._node_term_ids = None
+
+    @classmethod
+    def build(cls, ontology_terms, fields=MAPPING_FIELDS + GRAPH_FIELDS):
+        """
+        Build a store of the given ontology terms. Neighbours are referenced by their IDs in the term table shared by
+        the terms (e.g., the table of the terms collected by an OntologyTermCollector), so they are not looked up again
+        :param ontology_terms: Dictionary of ontology term IRIs to OntologyTerm objects
+        :param fields: Fields of the terms to store, out of MAPPING_FIELDS and GRAPH_FIELDS. Neighbour fields that are
+                       not given are stored without neighbours, so that fields not collected for the terms are not used
+        :return: OntologyTermStore
+        """
+        terms = ontology_terms.values()
+        term_table = next((term.term_table for term in terms), None) or OntologyTermTable()
+        neighbour_fields = [field for field in NEIGHBOUR_FIELDS if field in fields]
+        neighbour_ids = {field: [] for field in NEIGHBOUR_FIELDS}
+        iris, labels, names, name_counts = [], [], [], [0]
+        for term in terms:
+            iris.append(term.iri)
+            term_labels = term.labels
+            labels.append(term.label if term_labels else "")
+            names.extend(term_labels)
+            if "synonyms" in fields:
+                names.extend(term.synonyms)
+            name_counts.append(len(names))
+            for field in neighbour_fields:
+                neighbour_ids[field].append(term.get_neighbour_ids(field, term_table))
+        name_offsets = np.array(name_counts, dtype=np.int64)
+        is_string = np.fromiter((isinstance(name, str) for name in names), dtype=bool, count=len(names))
+        if not is_string.all():
+            logger = onto_utils.get_logger(__name__, logging.INFO)
+            logger.debug(f"Leaving out {len(names) - is_string.sum()} ontology term labels or synonyms that are not "
+                         f"strings")
+            names = [name for name, keep in zip(names, is_string.tolist()) if keep]
+            name_offsets = np.concatenate(([0], np.cumsum(is_string)))[name_offsets]
+        neighbours = {field: _get_adjacency(neighbour_ids[field], len(iris)) for field in NEIGHBOUR_FIELDS}
+        nr_nodes = len(term_table.iris)  # the table may be extended later by other terms sharing it
+        return cls(iris, labels, names, name_offsets, term_table.iris[:nr_nodes], term_table.labels[:nr_nodes],
+                   neighbours)
+
+    @property
+    def node_term_ids(self):
+        """
+        Returns the term ID of the IRI of each neighbour node, or -1 for nodes that are not terms of this store
+        :return: Array of term IDs
+        """
+        if self._node_term_ids is None:
+            self._node_term_ids = self.get_term_ids(self.node_iris)
+        return self._node_term_ids
+
+    def get_term_id(self, iri):
+        """
+        Get the term ID of the term with the given IRI
+        :param iri: IRI of a term
+        :return: int, or None if there is no term with the given IRI in this store
+        """
+        return self._get_term_ids().get(iri)
+
+    def get_term_ids(self, iris):
+        """
+        Get the term IDs of the terms with the given IRIs
+        :param iris: Collection of IRIs
+        :return: Array of the term ID of each IRI, which is -1 for the IRIs of terms that are not in this store
+        """
+        get_term_id = self._get_term_ids().get
+        return np.fromiter((get_term_id(iri, -1) for iri in iris), dtype=np.int64, count=len(iris))
+
+    def get_neighbour_ids(self, field):
+        """
+        Get the adjacency of the given neighbour field as lists, which are faster than arrays to index one by one
+        :param field: Field of the neighbours, out of NEIGHBOUR_FIELDS
+        :return: List of the offsets of the neighbours of each term, and list of the node IDs of the neighbours
+        """
+        offsets, node_ids = self.neighbours[field]
+        return offsets.tolist(), node_ids.tolist()
+
+    def _get_term_ids(self):
+        if self._term_ids is None:
+            self._term_ids = {iri: term_id for term_id, iri in enumerate(self.iris)}
+        return self._term_ids
+
+    def __contains__(self, iri):
+        return iri in self._get_term_ids()
+
+    def __len__(self):
+        return len(self.iris)
+
+
+def get_term_store(ontology_terms, fields=MAPPING_FIELDS + GRAPH_FIELDS):
+    """
+    Get a store of the given ontology terms, which are either already stored or built into a store. Terms that can
+    build their own store (e.g., ColumnarOntologyTerms) are stored that way
+    :param ontology_terms: OntologyTermStore, or dictionary of ontology term IRIs to OntologyTerm objects
+    :param fields: Fields of the terms to store, out of MAPPING_FIELDS and GRAPH_FIELDS
+    :return: OntologyTermStore
+    """
+    if isinstance(ontology_terms, OntologyTermStore):
+        return ontology_terms
+    if hasattr(ontology_terms, "get_term_store"):
+        return ontology_terms.get_term_store()
+    return OntologyTermStore.build(ontology_terms, fields)
+
+
+def _get_adjacency(neighbour_ids, nr_terms):
+    # Offsets and node IDs of the neighbours of each term, given the tuple of neighbour IDs of each term (if any)
+    if len(neighbour_ids) == 0:
+        return np.zeros(nr_terms + 1, dtype=np.int64), np.zeros(0, dtype=np.int32)
+    offsets = np.concatenate(([0], np.cumsum([len(ids) for ids in neighbour_ids], dtype=np.int64)))
+    return offsets, np.fromiter((node_id for ids in neighbour_ids for node_id in ids), dtype=np.int32,
+                                count=offsets[-1])
@@ -1,23 +1,52 @@
-"""Provides TFIDFMapper class"""
+"""Provides TFIDFMapper and TFIDFIndex classes"""
 
+import pickle
 import logging
+import numpy as np
+import pandas as pd
 import sparse_dot_topn as ct
-from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
+from collections import Counter
+from scipy.sparse import csr_matrix, vstack
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
 from text2term import onto_utils
-from text2term.term_mapping import TermMapping, TermMappingCollection
+from text2term.lsh_index import MinHashLSHIndex
+from text2term.term_store import get_term_store
+from text2term.term_mapping import TermMapping
+from text2term.curie_resolver import CURIE_RESOLVER
+
+# Number of (source term, candidate label) pairs scored at a time when mapping approximately
+RESCORE_BATCH_SIZE = 100000
+
+# Percentile of the number of labels/synonyms per ontology term used to size the initial top-n label matches per row
+TYPICAL_LABELS_PERCENTILE = 90
 
 
 class TFIDFMapper:
 
-    def __init__(self, target_ontology_terms):
+    def __init__(self, target_ontology_terms, tfidf_index=None, lsh_index=None):
         """
-        :param target_ontology_terms: Collection of ontology terms to be mapped against
+        :param target_ontology_terms: OntologyTermStore, or dictionary of ontology terms, to be mapped against
+        :param tfidf_index: TFIDFIndex previously built for (a superset of) the given ontology terms. When not given,
+                            an index is built from the target ontology terms
+        :param lsh_index: MinHashLSHIndex of the labels in the given TFIDFIndex, used for approximate mapping. When not
+                            given (or built with other MinHash parameters than those used for mapping), an index is
+                            built from the TF-IDF index the first time approximate mapping is used
         """
         self.logger = onto_utils.get_logger(__name__, logging.INFO)
         self.target_ontology_terms = target_ontology_terms
-        self.target_labels, self.target_terms = self._get_target_labels_terms(target_ontology_terms)
+        self.term_store = get_term_store(target_ontology_terms)
+        self.lsh_index = None
+        if tfidf_index is None:
+            tfidf_index = TFIDFIndex.build(self.term_store)
+        else:
+            label_rows = tfidf_index.get_label_rows(self.term_store)
+            tfidf_index = tfidf_index.restrict(self.term_store)
+            if lsh_index is not None:
+                self.lsh_index = lsh_index.restrict(label_rows)
+        self._set_index(tfidf_index)
 
-    def map(self, source_terms, source_terms_ids, max_mappings=3, min_score=0.3, ngram_length=3):
+    def map(self, source_terms, source_terms_ids, max_mappings=3, min_score=0.3, ngram_length=3, batch_size=0,
+            n_jobs=1, approximate=False, num_perm=120, bands=40):
         """
         Main mapping function. Default settings return only the top candidate for every source string.
         :param source_terms: List of source terms to be mapped with ontology terms
@@ -26,70 +55,266 @@ class TFIDFMapper:
         :param min_score: The lower-bound threshold for keeping a candidate term mapping, between 0-1.
                             Default set to 0, so consider all candidates
         :param ngram_length: The gram length n for the string tokenizer
+        :param batch_size: The number of source terms to map at a time. Mapping in batches bounds the memory used by
+                            the sparse matrices and intermediate mappings, and gives the same results. Default set to 0,
+                            so map all source terms at once
+        :param n_jobs: The number of threads used to compute the sparse dot product between source and target vectors.
+                            Negative values are relative to the number of CPUs (eg -1 uses all CPUs)
+        :param approximate: Only score the labels that share a MinHash LSH bucket with each source term, instead of
+                            all labels. This is much faster for very large ontologies, but may miss some mappings
+        :param num_perm: The number of hash functions in the MinHash signatures of the LSH index used when mapping
+                            approximately
+        :param bands: The number of bands the MinHash signatures are split into, which must divide num_perm. More
+                            bands (with fewer hash functions each) find more candidate labels, so fewer mappings are
+                            missed, at the cost of speed
         """
-        source_terms_norm = onto_utils.normalize_list(source_terms)
-        vectorizer = self._tokenize(source_terms_norm, self.target_labels, n=ngram_length)
-        results_mtx = self._sparse_dot_top(vectorizer, source_terms_norm, self.target_labels, min_score)
-        results_df = self._get_mappings(results_mtx, max_mappings, source_terms, source_terms_ids, self.target_terms)
-        return results_df
+        if batch_size <= 0:
+            batch_size = max(len(source_terms), 1)
+        batches = [df for df in self.map_batches(source_terms, source_terms_ids, max_mappings=max_mappings,
+                                                  min_score=min_score, ngram_length=ngram_length,
+                                                  batch_size=batch_size, n_jobs=n_jobs,
+                                                  approximate=approximate, num_perm=num_perm,
+                                                  bands=bands) if not df.empty]
+        if len(batches) == 0:
+            return pd.DataFrame()
+        elif len(batches) == 1:
+            return batches[0]
+        return pd.concat(batches, ignore_index=True)
 
-    def _tokenize(self, source_terms, target_labels, analyzer='char_wb', n=3):
+    def map_batches(self, source_terms, source_terms_ids, max_mappings=3, min_score=0.3, ngram_length=3,
+                    batch_size=10000, n_jobs=1, approximate=False, num_perm=120, bands=40):
         """
-        Tokenizes the (source) input strings and the target labels based on the selected analyzer
-        :param source_terms: List of source terms to be matched
-        :param target_labels: List of labels from ontology terms to be matched against
-        :param analyzer: Type of analyzer ('char_wb', 'word')
-        :param n: The gram length n (when using n-gram analyzer)
-        :return TF-IDF Vectorizer
-        """
-        # Create count vectorizer and fit it on both lists to get vocabulary
-        count_vectorizer = CountVectorizer(analyzer=analyzer, ngram_range=(n, n))
-        vocabulary = count_vectorizer.fit(source_terms + target_labels).vocabulary_
-        return TfidfVectorizer(vocabulary=vocabulary, analyzer=analyzer, ngram_range=(n, n))
-
-    def _sparse_dot_top(self, vectorizer, source_terms, target_labels, min_score):
-        src_mtx = vectorizer.fit_transform(source_terms).tocsr()
-        tgt_mtx = vectorizer.fit_transform(target_labels).transpose().tocsr()
-        # 'ntop' specifies the maximum number of labels/synonyms that should be considered
-        # multiple labels/synonyms in the 'ntop' matches may be from the same ontology term
-        return ct.awesome_cossim_topn(src_mtx, tgt_mtx, ntop=50, lower_bound=min_score)
-
-    def _get_mappings(self, results_mtx, max_mappings, source_terms, source_terms_ids, target_terms):
-        """ Build and return dataframe for mapping results along with term graphs for the obtained mappings """
-        coo_mtx = results_mtx.tocoo()
-        mappings = []
-        last_source_term = ""
-        top_mappings = set()
-        for row, col, score in zip(coo_mtx.row, coo_mtx.col, coo_mtx.data):
-            source_term = source_terms[row]
-            source_term_id = source_terms_ids[row]
-            onto_term = target_terms[col]
-            self.logger.debug("Source term: %s maps to %s (%f)", source_term, onto_term.label, score)
-            if source_term == last_source_term:
-                if len(top_mappings) == max_mappings:
-                    continue
+        Map the given source terms in batches, yielding a data frame with the mappings of each batch of source terms
+        once it has been mapped. Memory use is determined by the batch size rather than the number of source terms.
+        :param source_terms: List of source terms to be mapped with ontology terms
+        :param source_terms_ids: List of identifiers for the given source terms
+        :param max_mappings: The maximum number of (top scoring) ontology term mappings that should be returned
+        :param min_score: The lower-bound threshold for keeping a candidate term mapping, between 0-1
+        :param ngram_length: The gram length n for the string tokenizer
+        :param batch_size: The number of source terms to map at a time
+        :param n_jobs: The number of threads used to compute the sparse dot product between source and target vectors
+        :param approximate: Only score the labels that share a MinHash LSH bucket with each source term
+        :param num_perm: The number of hash functions in the MinHash signatures of the LSH index
+        :param bands: The number of bands the MinHash signatures are split into
+        """
+        n_threads = onto_utils.get_worker_count(n_jobs)
+        if ngram_length != self.tfidf_index.ngram_length:
+            self.logger.debug("Rebuilding TF-IDF index using n-grams of length %i", ngram_length)
+            self._set_index(TFIDFIndex.build(self.term_store, ngram_length=ngram_length))
+            self.lsh_index = None
+        lsh_params = None if self.lsh_index is None else (self.lsh_index.num_perm, self.lsh_index.bands)
+        if approximate and lsh_params != (num_perm, bands):
+            self.logger.info("Building MinHash LSH index of %i ontology labels...", len(self.target_labels))
+            self.lsh_index = MinHashLSHIndex.build(self.tfidf_index.label_counts, num_perm=num_perm, bands=bands)
+        for start in range(0, len(source_terms), batch_size):
+            batch_terms = source_terms[start:start + batch_size]
+            batch_terms_ids = source_terms_ids[start:start + batch_size]
+            if len(source_terms) > batch_size:
+                self.logger.info("...mapping source terms %i-%i of %i", start + 1, start + len(batch_terms),
+                                 len(source_terms))
+            source_mtx = self.tfidf_index.transform(onto_utils.normalize_list(batch_terms))
+            if approximate:
+                results_mtx = self._approximate_dot_top(source_mtx, min_score)
             else:
-                last_source_term = source_term
-                top_mappings.clear()
-            if onto_term.iri not in top_mappings:
-                mappings.append(TermMapping(source_term, source_term_id, onto_term.label, onto_term.iri, score))
-                top_mappings.add(onto_term.iri)
-        return TermMappingCollection(mappings).mappings_df()
-
-    def _get_target_labels_terms(self, ontology_terms):
-        """Get lists of labels and terms to enable retrieving terms from their labels"""
-        target_labels, target_terms = [], []
-        for term in ontology_terms.values():
-            for label in term.labels:
-                if not isinstance(label, str):
-                    self.logger.debug(f"ontology term label {label} is not a string")
-                else:
-                    target_labels.append(label)
-                    target_terms.append(term)
-            for synonym in term.synonyms:
-                if not isinstance(synonym, str):
-                    self.logger.debug(f"ontology term synonym {synonym} is not a string")
+                results_mtx = self._sparse_dot_top(source_mtx, min_score, max_mappings, n_threads)
+            yield self._get_mappings(results_mtx, max_mappings, batch_terms, batch_terms_ids)
+
+    def _set_index(self, tfidf_index):
+        self.tfidf_index = tfidf_index
+        self.target_labels = tfidf_index.labels
+        # term ID of the ontology term of each label in the term store
+        self._label_term_ids = self.term_store.get_term_ids(tfidf_index.term_iris)
+        self._target_mtx = tfidf_index.target_matrix.transpose().tocsr()
+        # number of labels and synonyms of each target term, used to choose how many label matches to compute per row
+        labels_per_term = np.bincount(self._label_term_ids)
+        labels_per_term = labels_per_term[labels_per_term > 0] if len(self._label_term_ids) > 0 else np.ones(1)
+        self._typical_labels_per_term = int(np.ceil(np.percentile(labels_per_term, TYPICAL_LABELS_PERCENTILE)))
+        self._max_labels_per_term = int(labels_per_term.max())
+
+    def _sparse_dot_top(self, source_mtx, min_score, max_mappings, n_threads=1):
+        # 'top_n' specifies the maximum number of labels/synonyms that should be considered
+        # multiple labels/synonyms in the 'top_n' matches may be from the same ontology term, so 'top_n' starts at
+        # enough matches for 'max_mappings' terms with a typical number of labels/synonyms. Rows whose 'top_n' matches
+        # cover fewer than 'max_mappings' distinct terms are recomputed with a larger 'top_n', until they have enough
+        # distinct terms or 'top_n' can accommodate 'max_mappings' terms with the largest number of labels/synonyms
+        top_n = max_mappings * self._typical_labels_per_term
+        max_top_n = max_mappings * self._max_labels_per_term
+        results_mtx = self._sparse_dot_top_n(source_mtx, min_score, top_n, n_threads)
+        while top_n < max_top_n:
+            short_rows = self._get_short_rows(results_mtx, top_n, max_mappings)
+            if len(short_rows) == 0:
+                break
+            top_n = min(top_n * 2, max_top_n)
+            self.logger.debug("...recomputing top %i label matches of %i source terms", top_n, len(short_rows))
+            short_results_mtx = self._sparse_dot_top_n(source_mtx[short_rows], min_score, top_n, n_threads)
+            row_order = np.arange(results_mtx.shape[0])
+            row_order[short_rows] = results_mtx.shape[0] + np.arange(len(short_rows))
+            results_mtx = vstack([results_mtx, short_results_mtx], format='csr')[row_order]
+        return results_mtx
+
+    def _sparse_dot_top_n(self, source_mtx, min_score, top_n, n_threads):
+        # the rows of the source matrix are split between threads, and each row is sorted by decreasing score, so the
+        # result does not depend on the number of threads
+        return ct.sp_matmul_topn(source_mtx, self._target_mtx, top_n=top_n, threshold=min_score, sort=True,
+                                 n_threads=n_threads)
+
+    def _approximate_dot_top(self, source_mtx, min_score):
+        # compute the exact cosine similarity of the source terms only with the labels in their LSH buckets, and keep
+        # the label matches scoring above 'min_score', sorted by decreasing score within each row
+        source_rows, label_rows = self.lsh_index.get_candidates(source_mtx)
+        scores = np.empty(len(source_rows))
+        for start in range(0, len(source_rows), RESCORE_BATCH_SIZE):
+            end = start + RESCORE_BATCH_SIZE
+            source_vectors = source_mtx[source_rows[start:end]]
+            label_vectors = self.tfidf_index.target_matrix[label_rows[start:end]]
+            scores[start:end] = np.asarray(source_vectors.multiply(label_vectors).sum(axis=1)).ravel()
+        matches = scores > min_score
+        source_rows, label_rows, scores = source_rows[matches], label_rows[matches], scores[matches]
+        order = np.lexsort((-scores, source_rows))
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(source_rows, minlength=source_mtx.shape[0]))))
+        self.logger.debug("...scored %i LSH candidate labels of %i source terms", len(matches), source_mtx.shape[0])
+        return csr_matrix((scores[order], label_rows[order], indptr),
+                          shape=(source_mtx.shape[0], len(self.target_labels)))
+
+    def _get_short_rows(self, results_mtx, top_n, max_mappings):
+        """ Get the rows that have 'top_n' label matches, which cover fewer than 'max_mappings' distinct terms """
+        rows, _, _ = self._get_term_matches(results_mtx)
+        distinct_terms = np.bincount(rows, minlength=results_mtx.shape[0])
+        full_rows = np.diff(results_mtx.indptr) == top_n
+        return np.flatnonzero(full_rows & (distinct_terms < max_mappings))
+
+    def _get_term_matches(self, results_mtx):
+        """ Get the rows, term IDs and scores of the best scoring label or synonym of each term matched in each row """
+        rows = np.repeat(np.arange(results_mtx.shape[0]), np.diff(results_mtx.indptr))
+        term_ids = self._label_term_ids[results_mtx.indices]
+        # each row of the results matrix is sorted by decreasing score, so the first entry of a (row, term) pair is the
+        # best scoring label or synonym of that term. Other labels and synonyms of the same term are discarded
+        _, best = np.unique(rows * len(self.term_store) + term_ids, return_index=True)
+        best.sort()
+        return rows[best], term_ids[best], results_mtx.data[best]
+
+    def _get_mappings(self, results_mtx, max_mappings, source_terms, source_terms_ids):
+        """ Build and return dataframe for mapping results """
+        rows, term_ids, scores = self._get_term_matches(results_mtx)
+        # keep the first 'max_mappings' distinct terms of each row
+        rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+        top = rank < max_mappings
+        rows, term_ids, scores = rows[top], term_ids[top], scores[top]
+        if len(rows) == 0:
+            return pd.DataFrame()
+        mapped_terms, term_index = np.unique(term_ids, return_inverse=True)
+        iris, labels = self.term_store.iris, self.term_store.labels
+        mapped_iris = np.array([iris[term_id] for term_id in mapped_terms.tolist()], dtype=object)
+        mapped_labels = np.array([labels[term_id] for term_id in mapped_terms.tolist()], dtype=object)
+        mapped_curies = CURIE_RESOLVER.get_curies(mapped_iris)
+        return pd.DataFrame({
+            TermMapping.SRC_TERM_ID: np.asarray(source_terms_ids, dtype=object)[rows],
+            TermMapping.SRC_TERM: np.asarray(source_terms, dtype=object)[rows],
+            TermMapping.TGT_TERM_LBL: mapped_labels[term_index],
+            TermMapping.TGT_TERM_CURIE: mapped_curies[term_index],
+            TermMapping.TGT_TERM_IRI: mapped_iris[term_index],
+            TermMapping.MAPPING_SCORE: scores
+        })
+
+
+class TFIDFIndex:
+
+    def __init__(self, labels, term_iris, label_counts, vocabulary, ngram_length=3, analyzer='char_wb'):
+        """
+        Index of the labels and synonyms of a collection of ontology terms, vectorized using TF-IDF weights that are
+        fitted on those labels alone, so that the target side does not need to be recomputed for each mapping call.
+        :param labels: List of labels and synonyms of the indexed ontology terms
+        :param term_iris: List containing, for each label in `labels`, the IRI of the ontology term it belongs to
+        :param label_counts: Sparse matrix of n-gram counts, with one row per label and one column per n-gram
+        :param vocabulary: Dictionary of n-grams and their respective column in `label_counts`
+        :param ngram_length: The gram length n for the string tokenizer
+        :param analyzer: Type of analyzer ('char_wb', 'word')
+        """
+        self.labels = labels
+        self.term_iris = term_iris
+        self.label_counts = label_counts
+        self.vocabulary = vocabulary
+        self.ngram_length = ngram_length
+        self.analyzer = analyzer
+        self._transformer = TfidfTransformer().fit(label_counts)
+        self.target_matrix = self._transformer.transform(label_counts).tocsr()
+        # IDF weight of n-grams that do not occur in any indexed label (smooth IDF with a document frequency of 0)
+        self._unseen_idf = np.log(label_counts.shape[0] + 1) + 1
+        self._analyze = CountVectorizer(analyzer=analyzer, ngram_range=(ngram_length, ngram_length)).build_analyzer()
+
+    @classmethod
+    def build(cls, ontology_terms, ngram_length=3, analyzer='char_wb'):
+        """
+        Build a TF-IDF index of the labels and synonyms of the given ontology terms
+        :param ontology_terms: OntologyTermStore, or dictionary of ontology term IRIs to OntologyTerm objects
+        :param ngram_length: The gram length n for the string tokenizer
+        :param analyzer: Type of analyzer ('char_wb', 'word')
+        :return: TFIDFIndex
+        """
+        term_store = get_term_store(ontology_terms)
+        labels = term_store.names
+        term_iris = [term_store.iris[term_id] for term_id in term_store.name_term_ids.tolist()]
+        count_vectorizer = CountVectorizer(analyzer=analyzer, ngram_range=(ngram_length, ngram_length))
+        label_counts = count_vectorizer.fit_transform(labels).tocsr()
+        return cls(labels, term_iris, label_counts, count_vectorizer.vocabulary_, ngram_length, analyzer)
+
+    def restrict(self, ontology_terms):
+        """
+        Get an index containing only the labels and synonyms of the given ontology terms. The IDF weights are refitted
+        on the remaining labels, so the resulting index scores source terms as an index built from scratch would
+        :param ontology_terms: Collection of (IRIs of) ontology terms to keep in the index
+        :return: TFIDFIndex
+        """
+        rows = self.get_label_rows(ontology_terms)
+        if len(rows) == len(self.term_iris):
+            return self
+        return TFIDFIndex([self.labels[row] for row in rows], [self.term_iris[row] for row in rows],
+                          self.label_counts[rows], self.vocabulary, self.ngram_length, self.analyzer)
+
+    def get_label_rows(self, ontology_terms):
+        """
+        Get the rows of this index that hold the labels and synonyms of the given ontology terms
+        :param ontology_terms: Collection of (IRIs of) ontology terms
+        :return: Array of row numbers
+        """
+        keep = np.fromiter((iri in ontology_terms for iri in self.term_iris), dtype=bool, count=len(self.term_iris))
+        return np.flatnonzero(keep)
+
+    def transform(self, source_terms):
+        """
+        Vectorize the given source terms using the n-gram vocabulary and IDF weights of this index. N-grams that do not
+        occur in the index still count towards the norm of the source vectors, so a source term only gets a similarity
+        score of 1 with a label that has exactly the same n-gram profile
+        :param source_terms: List of (normalized) source terms
+        :return: Sparse matrix with one L2-normalized row per source term
+        """
+        indptr, indices, counts = [0], [], []
+        unseen_counts = np.zeros(len(source_terms))
+        for row, source_term in enumerate(source_terms):
+            for ngram, count in Counter(self._analyze(source_term)).items():
+                column = self.vocabulary.get(ngram)
+                if column is None:
+                    unseen_counts[row] += count * count
                 else:
-                    target_labels.append(synonym)
-                    target_terms.append(term)
-        return target_labels, target_terms
+                    indices.append(column)
+                    counts.append(count)
+            indptr.append(len(indices))
+        source_mtx = csr_matrix((np.asarray(counts, dtype=np.float64), np.asarray(indices, dtype=np.int32), indptr),
+                                shape=(len(source_terms), len(self.vocabulary)))
+        source_mtx.data *= self._transformer.idf_[source_mtx.indices]
+        norms = np.sqrt(np.asarray(source_mtx.multiply(source_mtx).sum(axis=1)).ravel() +
+                        unseen_counts * self._unseen_idf ** 2)
+        norms[norms == 0] = 1
+        source_mtx.data /= np.repeat(norms, np.diff(source_mtx.indptr))
+        return source_mtx
+
+    def save(self, file_path):
+        with onto_utils.atomic_write(file_path) as out_file:
+            pickle.dump((self.labels, self.term_iris, self.label_counts, self.vocabulary, self.ngram_length,
+                         self.analyzer), out_file)
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path, 'rb') as in_file:
+            return cls(*pickle.load(in_file))
+